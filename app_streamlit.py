@@ -1,39 +1,91 @@
 import json
 import os
-from typing import Optional
+import time
+from typing import Any, Dict, List, Optional
 
 import streamlit as st
 
-from xet_core import XetCore
+from xet_batch import existing_download
+from xet_core import SESSION_MARGIN, XetCore, read_listing
+from xet_jobs import JobManager
 
 
 st.set_page_config(page_title="小鹅通拉取工具", page_icon="🐣", layout="wide")
 
+# A listing file younger than this is shown as is; older ones are fetched again on request
+LISTING_TTL = 30 * 60
+# Seconds between refreshes of the job table while jobs are running
+JOBS_REFRESH = 1.0
+
+
+@st.cache_resource
+def get_jobs() -> JobManager:
+    # One worker pool per server process, shared by every rerun and browser tab
+    return JobManager()
+
+
+@st.cache_data(ttl=LISTING_TTL, show_spinner=False)
+def load_listing(path: str, mtime: float) -> List[Dict[str, Any]]:
+    # mtime is part of the cache key, so a listing written by a job replaces the cached one
+    return [e.to_dict() for e in read_listing(path)]
+
+
+def listing_age(path: str) -> Optional[float]:
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def is_fresh(path: str) -> bool:
+    # A listing younger than LISTING_TTL is shown from disk instead of listing the shop again
+    age = listing_age(path)
+    return age is not None and age < LISTING_TTL
+
 
 def ui_header():
     st.title("小鹅通音视频拉取工具")
-    st.caption("已购资源抓取与下载，扫码登录有效期4小时")
+    st.caption("已购资源抓取与下载，扫码登录有效期4小时；抓取、列表与下载都在后台运行，进度见下方任务表")
+
+
+def ui_session_status(appid: str) -> None:
+    # Only the recorded login time and cookie expiry; the probe request runs when a capture starts
+    expires = get_jobs().core(appid).session_expires_at()
+    left = (expires or 0) - time.time() - SESSION_MARGIN
+    if left > 0:
+        st.caption(f"登录有效，约 {int(left // 60)} 分钟后需重新扫码；抓取将在后台无界面运行")
+    else:
+        st.caption("登录已过期或尚未记录，抓取时会打开浏览器扫码")
 
 
 def ui_capture_section():
     st.subheader("扫码登录并抓取候选音频URL")
+    jobs = get_jobs()
     appid = st.text_input("店铺ID(appxx)", value=st.session_state.get("appid", ""))
+    if appid:
+        ui_session_status(appid)
     resource_url = st.text_input("资源播放页URL", value=st.session_state.get("resource_url", ""))
     resource_id = st.text_input("资源ID(可选)", value=st.session_state.get("resource_id", ""))
     wait = st.number_input("等待秒数", min_value=30, max_value=600, value=180)
-    if st.button("打开浏览器扫码并抓取"):
+    if st.button("抓取（登录失效时打开浏览器扫码）"):
         if not appid or not resource_url:
             st.error("请填写店铺ID与资源页URL")
         else:
             st.session_state["appid"] = appid
             st.session_state["resource_url"] = resource_url
             st.session_state["resource_id"] = resource_id
-            core = XetCore(appid)
-            path = core.login_and_capture(resource_url, resource_id or None, wait)
-            st.success(f"抓取完成: {path}")
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            st.json({"candidates": data.get("candidates", [])})
+            job = jobs.submit_capture(appid, resource_url, resource_id or None, int(wait))
+            st.session_state["capture_job"] = job.id
+    job = jobs.get(st.session_state.get("capture_job"))
+    if job is not None and job.state == "done":
+        st.success(f"抓取完成: {job.result}")
+        with open(job.result, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        st.json({"candidates": data.get("candidates", [])})
+    elif job is not None and job.state == "failed":
+        st.error(f"抓取失败: {job.message}")
+    elif job is not None:
+        st.info(f"任务 #{job.id} 运行中…")
 
 
 def ui_download_section():
@@ -45,39 +97,98 @@ def ui_download_section():
         if not appid or not capture_file:
             st.error("请填写店铺ID与抓取文件路径")
         else:
-            core = XetCore(appid)
-            out = core.download_from_capture(capture_file, title or None)
-            if out:
-                st.success(f"下载完成: {out}")
-            else:
-                st.error("下载失败，请检查抓取文件与登录状态")
+            job = get_jobs().submit_download(appid, capture_file, title or None)
+            st.success(f"已加入任务 #{job.id}")
+
+
+def ui_listing_table(core: XetCore, path: str, pid: Optional[str], key: str) -> None:
+    age = listing_age(path)
+    if age is None:
+        return
+    items = load_listing(path, os.path.getmtime(path))
+    note = "（已过期，建议刷新）" if age > LISTING_TTL else ""
+    st.write(f"共 {len(items)} 项，{int(age // 60)} 分钟前抓取{note}")
+    if pid is None:
+        st.dataframe(items, hide_index=True, use_container_width=True)
+        return
+    # Resources can be ticked for a bulk download; files already in download/ are marked and skipped
+    rows = [
+        {"选择": False, "#": idx, "id": it["id"], "title": it.get("title") or it["id"],
+         "已下载": bool(existing_download(core.download_dir, it.get("title") or it["id"]))}
+        for idx, it in enumerate(items)
+    ]
+    edited = st.data_editor(
+        rows,
+        key=f"{key}_editor",
+        hide_index=True,
+        use_container_width=True,
+        disabled=["#", "id", "title", "已下载"],
+    )
+    picked = [(r["#"], r["id"], r["title"]) for r in edited if r["选择"]]
+    cols = st.columns(3)
+    tabs = cols[0].number_input("并发标签页", min_value=1, max_value=8, value=3, key=f"{key}_tabs")
+    workers = cols[1].number_input("下载线程", min_value=1, max_value=8, value=2, key=f"{key}_workers")
+    cols[2].write("")
+    if cols[2].button(f"下载选中（{len(picked)}）", key=f"{key}_bulk", disabled=not picked):
+        job = get_jobs().submit_bulk(core.appid, pid, picked, tabs=int(tabs), download_workers=int(workers))
+        st.success(f"已加入任务 #{job.id}")
 
 
 def ui_list_section():
     st.subheader("抓取专栏列表 / 资源列表")
+    jobs = get_jobs()
     appid = st.text_input("店铺ID(appxx)", key="list_appid", value=st.session_state.get("appid", ""))
-    core = XetCore(appid) if appid else None
+    core = jobs.core(appid) if appid else None
 
     with st.expander("抓取店铺专栏列表"):
         entry_url = st.text_input("任意店铺页URL(有专栏列表)", key="entry_url", value="")
+        refresh = st.checkbox("忽略缓存重新抓取", key="products_refresh", value=False)
         if st.button("抓取专栏", key="btn_products"):
             if not core or not entry_url:
                 st.error("请填写店铺ID与入口URL")
+            elif not refresh and is_fresh(core.products_file()):
+                st.info("专栏列表在缓存有效期内，直接显示缓存；需要最新列表请勾选“忽略缓存重新抓取”")
             else:
-                items = core.capture_products(entry_url)
-                st.write(f"共 {len(items)} 个专栏")
-                st.table({"id": [i.get("id") for i in items], "title": [i.get("title") for i in items]})
+                job = jobs.submit_products(appid, entry_url)
+                st.success(f"已加入任务 #{job.id}")
+        if core:
+            ui_listing_table(core, core.products_file(), None, "products")
 
-    with st.expander("抓取专栏内资源列表"):
+    with st.expander("抓取专栏内资源列表", expanded=True):
         product_url = st.text_input("专栏详情页URL", key="product_url", value="")
         product_id = st.text_input("专栏ID(可选)", key="product_id", value="")
+        pid = XetCore.product_id_from_url(product_url, product_id or None) if product_url else product_id or None
+        refresh = st.checkbox("忽略缓存重新抓取", key="resources_refresh", value=False)
         if st.button("抓取资源", key="btn_resources"):
             if not core or not product_url:
                 st.error("请填写店铺ID与专栏URL")
+            elif not refresh and pid and is_fresh(core.resources_file(pid)):
+                st.info("资源列表在缓存有效期内，直接显示缓存；需要最新列表请勾选“忽略缓存重新抓取”")
             else:
-                items = core.capture_resources(product_url, product_id or None)
-                st.write(f"共 {len(items)} 个资源")
-                st.table({"id": [i.get("id") for i in items], "title": [i.get("title") for i in items]})
+                job = jobs.submit_resources(appid, product_url, pid)
+                st.success(f"已加入任务 #{job.id}")
+        if core and pid:
+            ui_listing_table(core, core.resources_file(pid), pid, f"res_{pid}")
+
+
+@st.fragment(run_every=JOBS_REFRESH)
+def ui_jobs_section():
+    # Reruns on its own every JOBS_REFRESH seconds; the rest of the page reruns only when a job finishes
+    jobs = get_jobs()
+    snapshot = jobs.snapshot()
+    finished = sum(1 for j in snapshot if j.finished)
+    if finished != st.session_state.get("jobs_finished", 0):
+        st.session_state["jobs_finished"] = finished
+        st.rerun(scope="app")
+    st.subheader("任务")
+    if not snapshot:
+        st.caption("暂无任务")
+        return
+    st.dataframe([j.row() for j in snapshot], hide_index=True, use_container_width=True)
+    if st.button("清除已完成", key="btn_clear_jobs"):
+        jobs.clear_finished()
+        st.session_state["jobs_finished"] = 0
+        st.rerun(scope="app")
 
 
 def main():
@@ -90,9 +201,8 @@ def main():
             ui_download_section()
         with cols[2]:
             ui_list_section()
+    ui_jobs_section()
 
 
 if __name__ == "__main__":
     main()
-
-
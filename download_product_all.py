@@ -1,10 +1,13 @@
 import argparse
-import os
-import time
-import random
-from typing import List, Dict, Any
+from typing import Iterator, Optional, Tuple
 
-from xet_core import XetCore
+import xet_metrics as metrics
+from xet_batch import StreamedListing, existing_download, run_batch
+from xet_core import CaptureSession, Entity, XetCore
+from xet_http import configure_limits, configure_session, parse_rate
+from xet_manifest import Manifest
+from xet_postprocess import from_flags
+from xet_store import ContentStore
 
 
 def parse_args() -> argparse.Namespace:
@@ -12,72 +15,122 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("appid", type=str, help="Shop ID, e.g., appxxxx")
     parser.add_argument("product_id", type=str, help="Product/column ID, e.g., p_xxx")
     parser.add_argument("--wait-list", type=int, default=120, help="Seconds to wait for listing resources")
+    parser.add_argument("--idle-list", type=float, default=5.0, help="Stop listing after this many quiet seconds")
     parser.add_argument("--wait-capture", type=int, default=180, help="Seconds to wait for each capture")
     parser.add_argument("--max", type=int, default=-1, help="Limit number of resources to download (-1 for all)")
     parser.add_argument("--start", type=int, default=0, help="Start index in the resource list")
     parser.add_argument("--headless-list", action="store_true", help="Headless when listing resources")
-    parser.add_argument("--sleep-min", type=float, default=2.0, help="Min seconds to sleep between downloads")
-    parser.add_argument("--sleep-max", type=float, default=7.0, help="Max seconds to sleep between downloads")
+    parser.add_argument("--headed", action="store_true", help="Always show the browser, even while the stored login is valid")  # noqa: E501
+    parser.add_argument("--no-api", action="store_true", help="List through the browser instead of replaying the API")
+    parser.add_argument("--block-assets", action="store_true", help="Skip images/fonts/css/trackers/media bodies while capturing")  # noqa: E501
+    parser.add_argument("--fresh-captures", action="store_true", help="Capture every item even if a stored capture is still valid")  # noqa: E501
+    parser.add_argument("--tabs", type=int, default=3, help="Max resource pages captured concurrently")
+    parser.add_argument("--connections", type=int, default=4, help="Parallel range connections per file")
+    parser.add_argument("--pool-size", type=int, default=32, help="HTTP keep-alive connections kept per host")
+    parser.add_argument("--max-bps", type=str, default=None, help="Per-host download bandwidth cap, e.g. 4M (default: unlimited)")  # noqa: E501
+    parser.add_argument("--max-rps", type=float, default=0.0, help="Per-host requests per second cap (default: unlimited)")
+    parser.add_argument("--dedup", action="store_true", help="Keep downloads in a content-addressed store (download/.store) and link duplicates")  # noqa: E501
+    parser.add_argument("--remux", action="store_true", help="Pipe HLS video into ffmpeg and save mp4 instead of .ts")
+    parser.add_argument("--audio-only", action="store_true", help="Pipe HLS video into ffmpeg and keep only the audio (m4a)")  # noqa: E501
+    parser.add_argument("--post-workers", type=int, default=1, help="ffmpeg processes running at once")
+    parser.add_argument("--metrics", type=str, default=None, help="Append per-stage timing spans to this JSON-lines file")  # noqa: E501
+    parser.add_argument("--metrics-summary", action="store_true", help="Print a per-stage timing table at the end (needs --metrics)")  # noqa: E501
+    parser.add_argument("--retries", type=int, default=5, help="Retries for 5xx/429/connection errors")
+    parser.add_argument("--sleep-min", type=float, default=2.0, help="Min seconds to sleep between steps of each stage")
+    parser.add_argument("--sleep-max", type=float, default=7.0, help="Max seconds to sleep between steps of each stage")
+    parser.add_argument("--download-workers", type=int, default=2, help="Downloads running alongside capturing")
+    parser.add_argument("--queue-size", type=int, default=4, help="Max finished captures waiting for a download worker")
     return parser.parse_args()
 
 
 def build_product_url(appid: str, product_id: str) -> str:
-    # Observed pattern: details?{product_id}
-    return f"https://{appid}.xet.citv.cn/p/column/details?{product_id}"
+    return XetCore.build_product_page_url(appid, product_id)
 
 
 def main() -> None:
     args = parse_args()
-    core = XetCore(args.appid)
+    configure_session(pool_size=args.pool_size, retries=args.retries)
+    configure_limits(parse_rate(args.max_bps), args.max_rps)
+    if args.metrics:
+        metrics.enable(args.metrics)
+    core = XetCore(args.appid, connections=args.connections, block_assets=args.block_assets)
+    core.headless = False if args.headed else None
+    core.postprocessor = from_flags(args.remux, args.audio_only, args.post_workers)
+    if args.dedup:
+        core.store = ContentStore.for_download_dir(core.download_dir)
 
-    # 1) list resources under the product
-    product_url = build_product_url(args.appid, args.product_id)
-    resources: List[Dict[str, Any]] = core.capture_resources(
-        product_url=product_url,
-        product_id=args.product_id,
-        wait_seconds=args.wait_list,
-        headless=args.headless_list,
-    )
-    print(f"Found {len(resources)} resources under {args.product_id}")
-
-    # 2) iterate and download each resource by title
     start = max(0, args.start)
-    end = len(resources) if args.max == -1 else min(len(resources), start + max(0, args.max))
-    selected = resources[start:end]
-    print(f"Downloading items [{start}:{end}) ...")
+    end = None if args.max == -1 else start + max(0, args.max)
+    # A dry listing (--max 0) downloads nothing, so it leaves no manifest behind either
+    manifest = Manifest.for_shop(core.capture_dir) if end != start else None
+    if manifest is not None:
+        manifest.upsert_product(args.product_id)
 
-    for idx, item in enumerate(selected, start=start):
+    def accept(idx: int, item: Entity) -> Optional[Tuple[int, str, str]]:
+        if manifest is not None:
+            manifest.upsert_resources(args.product_id, [item], start=idx)
+        if idx < start or (end is not None and idx >= end):
+            return None
         rid = item.get("id")
         title = item.get("title") or rid
         if not isinstance(rid, str):
             print(f"Skip index {idx}: invalid resource id")
-            continue
+            return None
         # Skip if a file with the resource title already exists in download dir
-        base_name = XetCore.sanitize_filename(title)
-        try:
-            existing_files = [fn for fn in os.listdir(core.download_dir) if fn.startswith(base_name + ".")]
-        except FileNotFoundError:
-            existing_files = []
-        if existing_files:
-            print(f"[{idx}] Skip: already exists -> {existing_files[0]}")
-            continue
-        try:
-            resource_url = XetCore.build_resource_page_url(args.appid, rid, args.product_id)
-            print(f"[{idx}] Capture: {rid} - {title}")
-            cap = core.login_and_capture(resource_url, rid, wait_seconds=args.wait_capture)
-            print(f"[{idx}] Download -> {title}")
-            out = core.download_from_capture(cap, title=title)
-            print(f"[{idx}] Done: {out}")
-            # Randomized backoff between items to avoid rate limiting
-            if idx < end - 1:
-                lo = max(0.0, min(args.sleep_min, args.sleep_max))
-                hi = max(args.sleep_min, args.sleep_max)
-                delay = random.uniform(lo, hi)
-                print(f"[{idx}] Sleeping {delay:.1f}s before next item...")
-                time.sleep(delay)
-        except Exception as e:
-            print(f"[{idx}] Failed: {rid} - {e}")
+        existing = existing_download(core.download_dir, title)
+        if existing:
+            print(f"[{idx}] Skip: already exists -> {existing}")
+            return None
+        return idx, rid, title
+
+    # 1) list resources under the product; each one joins the batch as soon as it is listed
+    product_url = build_product_url(args.appid, args.product_id)
+
+    def listing_of(session: Optional[CaptureSession]) -> Iterator[Optional[Entity]]:
+        return core.iter_resources(
+            product_url=product_url,
+            product_id=args.product_id,
+            wait_seconds=args.wait_list,
+            idle_seconds=args.idle_list,
+            headless=args.headless_list,
+            session=session,
+            use_api=not args.no_api,
+            pump_seconds=0.25,
+        )
+
+    # A headless listing opens its own browser on the profile, which must be closed again before the
+    # batch browser starts; so it runs to the end first instead of streaming into the batch
+    listed = iter(list(listing_of(None))) if args.headless_list else None
+
+    # Headless while the stored login is valid; a visible browser for the QR login once it expired
+    with core.capture_session() as session:
+        listing = StreamedListing(listed if listed is not None else listing_of(session), accept)
+        print(f"Downloading items [{start}:{'' if end is None else end}) while listing {args.product_id} ...")
+
+        # 2) captures (up to --tabs pages at once) feed a queue drained by --download-workers threads
+        stats = run_batch(
+            core,
+            listing.jobs(),
+            product_id=args.product_id,
+            wait_capture=args.wait_capture,
+            session=session,
+            tabs=args.tabs,
+            download_workers=args.download_workers,
+            queue_size=args.queue_size,
+            sleep_min=args.sleep_min,
+            sleep_max=args.sleep_max,
+            manifest=manifest,
+            reuse_captures=not args.fresh_captures,
+            poll=listing.poll,
+        )
+        if manifest is not None:
+            manifest.close()
+        print(f"Found {len(listing.resources)} resources under {args.product_id}")
+        print(f"Captured {stats['captured']}, downloaded {stats['downloaded']}, failed {stats['failed']}")
 
+    if args.metrics_summary:
+        metrics.print_summary()
+    metrics.disable()
     print("All done.")
 
 
@@ -0,0 +1,50 @@
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xet_http  # noqa: E402
+from xet_api import record_endpoint  # noqa: E402
+from xet_fakeserver import COOKIE_NAME, FakeXet  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_http():
+    # Limiter state is per host and 127.0.0.1 is shared by every fake server, so each test starts unthrottled
+    xet_http.configure_limits(0, 0)
+    xet_http.configure_session(retries=5, backoff=0.05)
+    yield
+    xet_http.configure_session(backoff=0.5)
+
+
+@pytest.fixture
+def fake():
+    with FakeXet(columns=1, lessons=3, media_size=512 * 1024) as srv:
+        yield srv
+
+
+@pytest.fixture
+def headers():
+    return {"Cookie": f"{COOKIE_NAME}=fake-session"}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # XetCore keeps captured/, download/ and playwright_data/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def learn_resources_endpoint(core, srv, product_id, page_size=10):
+    # What a browser listing records after the first page of a column loaded
+    request = types.SimpleNamespace(
+        url=f"{srv.base_url}/api/resources?product_id={product_id}&page=1&page_size={page_size}",
+        method="GET",
+        post_data=None,
+        headers={"Accept": "application/json"},
+    )
+    record_endpoint(core.api_file, "resources", request, product_id)
+    core.save_cookies(srv.cookies())
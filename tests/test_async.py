@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from xet_async import AsyncXetCore
+from xet_fakeserver import FakeXet
+from xet_http import SignedUrlExpired
+
+
+def _download(srv, url, headers, outfile):
+    async def run():
+        async with AsyncXetCore(srv.appid, connections=3) as xc:
+            try:
+                return await xc._download_file(url, headers, outfile)
+            finally:
+                # Every response went back to the pool, on the error paths too
+                assert not xc._http.connector._acquired
+
+    return asyncio.run(run())
+
+
+def test_ranged_download_with_drops_and_errors(workdir, headers):
+    with FakeXet(columns=1, lessons=1, media_size=768 * 1024, error_rate=0.1, drop_rate=0.1, seed=1) as srv:
+        rid = srv.resource_ids(srv.product_ids()[0])[0]
+        out = _download(srv, srv.media_url(rid), headers, str(workdir / "a.mp3"))
+        assert open(out, "rb").read() == srv.media_bytes(rid)
+
+
+def test_expired_signature_releases_the_response(workdir, headers):
+    with FakeXet(columns=1, lessons=1, media_size=64 * 1024, url_ttl=-60) as srv:
+        rid = srv.resource_ids(srv.product_ids()[0])[0]
+        with pytest.raises(SignedUrlExpired):
+            _download(srv, srv.media_url(rid), headers, str(workdir / "a.mp3"))
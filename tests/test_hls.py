@@ -0,0 +1,124 @@
+import json
+import os
+
+import pytest
+
+from xet_fakeserver import HLS_KEY, FakeXet
+from xet_hls import HlsDownloader, download_hls, parse_playlist, pick_variant
+from xet_http import journal_path
+
+
+MASTER = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=64000,CODECS="mp4a.40.2"
+low/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=256000,RESOLUTION=640x360
+high/index.m3u8
+"""
+
+MEDIA = """#EXTM3U
+#EXT-X-MEDIA-SEQUENCE:7
+#EXT-X-MAP:URI="init.mp4",BYTERANGE="720@0"
+#EXTINF:4.0,
+seg0.ts
+#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example/k1",IV=0x000102030405060708090a0b0c0d0e0f
+#EXT-X-BYTERANGE:1000@720
+#EXTINF:4.0,
+all.mp4
+#EXT-X-BYTERANGE:500
+#EXTINF:4.0,
+all.mp4
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:4.0,
+/abs/seg3.ts
+#EXT-X-ENDLIST
+"""
+
+
+def _encrypt(data, key, iv):
+    AES = pytest.importorskip("Crypto.Cipher.AES")
+    pad = 16 - len(data) % 16
+    return AES.new(key, AES.MODE_CBC, iv).encrypt(data + bytes([pad]) * pad)
+
+
+def test_master_playlist_variants():
+    playlist = parse_playlist(MASTER, "https://cdn.example/v/master.m3u8")
+    variants = playlist["variants"]
+    assert [v["uri"] for v in variants] == [
+        "https://cdn.example/v/low/index.m3u8",
+        "https://cdn.example/v/high/index.m3u8",
+    ]
+    assert variants[0]["codecs"] == "mp4a.40.2"
+    assert variants[1]["resolution"] == "640x360"
+    assert pick_variant(variants)["bandwidth"] == 256000
+    assert pick_variant(variants, max_bandwidth=100000)["bandwidth"] == 64000
+    # Every variant over the cap: the smallest one rather than nothing
+    assert pick_variant(variants, max_bandwidth=1000)["bandwidth"] == 64000
+
+
+def test_media_playlist_keys_byteranges_and_sequence():
+    playlist = parse_playlist(MEDIA, "https://cdn.example/v/index.m3u8")
+    segments = playlist["segments"]
+    assert playlist["map"] == {"uri": "https://cdn.example/v/init.mp4", "byterange": (720, 0)}
+    assert [s["seq"] for s in segments] == [7, 8, 9, 10]
+    assert [s["uri"] for s in segments] == [
+        "https://cdn.example/v/seg0.ts",
+        "https://cdn.example/v/all.mp4",
+        "https://cdn.example/v/all.mp4",
+        "https://cdn.example/abs/seg3.ts",
+    ]
+    key = {"method": "AES-128", "uri": "https://keys.example/k1", "iv": "0x000102030405060708090a0b0c0d0e0f"}
+    assert [s["key"] for s in segments] == [None, key, key, None]
+    # A BYTERANGE without an offset continues where the previous one ended
+    assert [s["byterange"] for s in segments] == [None, (1000, 720), (500, 1720), None]
+
+
+def test_not_a_playlist():
+    with pytest.raises(ValueError):
+        parse_playlist("<html></html>", "https://cdn.example/v/index.m3u8")
+
+
+def test_decrypt_with_explicit_iv_and_with_media_sequence_iv():
+    dl = HlsDownloader()
+    dl._keys["k"] = HLS_KEY
+    data = os.urandom(1000)
+    iv = bytes(range(16, 32))
+    explicit = {"seq": 5, "key": {"method": "AES-128", "uri": "k", "iv": "0x" + iv.hex()}}
+    assert dl._decrypt(_encrypt(data, HLS_KEY, iv), explicit) == data
+    # Without an IV attribute the media sequence number is the IV
+    implicit = {"seq": 5, "key": {"method": "AES-128", "uri": "k", "iv": None}}
+    assert dl._decrypt(_encrypt(data, HLS_KEY, (5).to_bytes(16, "big")), implicit) == data
+    assert dl._decrypt(data, {"seq": 5, "key": None}) == data
+
+
+def test_unsupported_encryption_is_an_error():
+    segment = {"seq": 0, "key": {"method": "SAMPLE-AES", "uri": "k", "iv": None}}
+    with pytest.raises(RuntimeError):
+        HlsDownloader()._decrypt(b"x" * 16, segment)
+
+
+@pytest.mark.parametrize("encrypt", [False, True])
+def test_download_from_fake_server(tmp_path, headers, encrypt):
+    if encrypt:
+        pytest.importorskip("Crypto.Cipher")
+    with FakeXet(columns=1, lessons=1, hls_every=1, hls_segments=12, segment_size=16 * 1024, hls_encrypt=encrypt) as srv:
+        rid = srv.resource_ids(srv.product_ids()[0])[0]
+        out = download_hls(srv.media_url(rid), headers, str(tmp_path / "a.ts"), workers=4)
+        assert open(out, "rb").read() == srv.media_bytes(rid)
+        assert not os.path.exists(journal_path(out))
+
+
+def test_download_resumes_after_journaled_segments(tmp_path, headers):
+    with FakeXet(columns=1, lessons=1, hls_every=1, hls_segments=8, segment_size=16 * 1024) as srv:
+        rid = srv.resource_ids(srv.product_ids()[0])[0]
+        url = srv.media_url(rid)
+        out = str(tmp_path / "a.ts")
+        done = 3 * srv.segment_size
+        # Stand-in bytes for the journaled segments: a resumed run must keep them, not fetch them again
+        with open(out + ".tmp", "wb") as f:
+            f.write(b"\0" * done)
+        with open(journal_path(out), "w", encoding="utf-8") as f:
+            json.dump({"url": url, "segments_total": 8, "segments_done": 3, "bytes": done}, f)
+        download_hls(url, headers, out, workers=2)
+        data = open(out, "rb").read()
+        assert data[:done] == b"\0" * done
+        assert data[done:] == srv.media_bytes(rid)[done:]
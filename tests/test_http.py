@@ -0,0 +1,129 @@
+import os
+import time
+
+import pytest
+
+import xet_http
+from xet_fakeserver import FakeXet
+from xet_http import (
+    MIN_PART_SIZE,
+    PART_SIZE,
+    PARTS_PER_CONNECTION,
+    RangedFile,
+    SignedUrlExpired,
+    download_file,
+    get_limiter,
+    is_expired,
+    is_throttle,
+    journal_bytes,
+    journal_path,
+    load_journal,
+    missing_ranges,
+    part_size_for,
+    save_journal,
+)
+
+
+def test_missing_ranges_fill_the_gaps_between_done_parts():
+    assert missing_ranges(100, [], 40) == [(0, 39), (40, 79), (80, 99)]
+    assert missing_ranges(100, [[0, 39], [60, 99]], 40) == [(40, 59)]
+    # Unsorted and overlapping, as a journal with parts cut short can be
+    assert missing_ranges(100, [[50, 69], [0, 9], [5, 19]], 30) == [(20, 49), (70, 99)]
+    assert missing_ranges(100, [[0, 99]], 10) == []
+
+
+def test_part_size_bounds():
+    assert part_size_for(100, 4) == MIN_PART_SIZE
+    assert part_size_for(10 ** 10, 4) == PART_SIZE
+    total = 64 * 1024 * 1024
+    assert part_size_for(total, 4) == total // (4 * PARTS_PER_CONNECTION)
+
+
+def test_expired_and_throttled_statuses():
+    past = f"https://cdn.example/a.mp3?sign=x&t={int(time.time()) - 60:x}"
+    future = f"https://cdn.example/a.mp3?sign=x&t={int(time.time()) + 600:x}"
+    unsigned = "https://cdn.example/a.mp3"
+    assert is_expired(403, past) and not is_throttle(403, past)
+    assert is_throttle(403, future) and not is_expired(403, future)
+    assert is_throttle(403, unsigned) and not is_expired(403, unsigned)
+    assert is_expired(410, future)
+    assert is_throttle(429, past)
+    assert not is_expired(404, past) and not is_throttle(404, past)
+
+
+def test_ranged_download(fake, headers, tmp_path):
+    rid = fake.resource_ids(fake.product_ids()[0])[0]
+    out = download_file(fake.media_url(rid), headers, str(tmp_path / "a.mp3"), connections=3, part_size=64 * 1024)
+    assert open(out, "rb").read() == fake.media_bytes(rid)
+    assert not os.path.exists(journal_path(out))
+    assert not os.path.exists(out + ".tmp")
+
+
+def test_ranged_download_resumes_from_journal(fake, headers, tmp_path):
+    rid = fake.resource_ids(fake.product_ids()[0])[0]
+    url, total = fake.media_url(rid), fake.media_total(rid)
+    out = str(tmp_path / "a.mp3")
+    done = 200 * 1024
+    # Stand-in bytes for the journaled range: a resumed run must keep them, not fetch them again
+    with open(out + ".tmp", "wb") as f:
+        f.write(b"\0" * done)
+        f.truncate(total)
+    save_journal(out, {"url": url, "etag": f'"{rid}"', "last_modified": None, "total": total, "done": [[0, done - 1]]})
+    assert journal_bytes(out, url) == done
+    download_file(url, headers, out, connections=2, part_size=64 * 1024)
+    data = open(out, "rb").read()
+    assert data[:done] == b"\0" * done
+    assert data[done:] == fake.media_bytes(rid)[done:]
+
+
+def test_changed_remote_file_starts_over(fake, headers, tmp_path):
+    rid = fake.resource_ids(fake.product_ids()[0])[0]
+    url, total = fake.media_url(rid), fake.media_total(rid)
+    out = str(tmp_path / "a.mp3")
+    with open(out + ".tmp", "wb") as f:
+        f.write(b"\0" * total)
+    save_journal(out, {"url": url, "etag": '"older"', "last_modified": None, "total": total, "done": [[0, total - 1]]})
+    download_file(url, headers, out, connections=2, part_size=64 * 1024)
+    assert open(out, "rb").read() == fake.media_bytes(rid)
+
+
+def test_parts_in_flight_are_journaled(tmp_path, monkeypatch):
+    out = str(tmp_path / "a.mp3")
+    url = "https://cdn.example/a.mp3?sign=1"
+    with RangedFile(out, url, 100) as rf:
+        rf.write(0, b"a" * 10)
+        rf.progress(0, 10)
+        # Within JOURNAL_INTERVAL of the last save nothing is written yet
+        assert load_journal(out, url)["done"] == []
+        monkeypatch.setattr(xet_http, "JOURNAL_INTERVAL", 0.0)
+        rf.write(50, b"b" * 5)
+        rf.progress(50, 55)
+        assert sorted(load_journal(out, url)["done"]) == [[0, 9], [50, 54]]
+        rf.part_done(0, 49, 0.1)
+        assert sorted(load_journal(out, url)["done"]) == [[0, 49], [50, 54]]
+
+
+def test_throttling_403_is_retried_not_recaptured(headers, tmp_path):
+    with FakeXet(columns=1, lessons=1, media_size=256 * 1024, throttle_rate=0.3, throttle_status=403, seed=3) as srv:
+        rid = srv.resource_ids(srv.product_ids()[0])[0]
+        out = download_file(srv.media_url(rid), headers, str(tmp_path / "a.mp3"), connections=2, part_size=64 * 1024)
+        assert open(out, "rb").read() == srv.media_bytes(rid)
+        assert get_limiter().factor("127.0.0.1") < 1.0
+
+
+def test_expired_signature_raises(fake, headers, tmp_path):
+    rid = fake.resource_ids(fake.product_ids()[0])[0]
+    fake.url_ttl = -60
+    with pytest.raises(SignedUrlExpired):
+        download_file(fake.media_url(rid), headers, str(tmp_path / "a.mp3"))
+
+
+def test_each_throttled_response_is_reported_once(headers):
+    xet_http.configure_session(retries=2, backoff=0.05)
+    with FakeXet(columns=1, lessons=1, media_size=64 * 1024, throttle_rate=1.0) as srv:
+        rid = srv.resource_ids(srv.product_ids()[0])[0]
+        r = xet_http.get_session().get(srv.media_url(rid), headers=headers)
+        assert r.status_code == 429
+        # Two retries by urllib3 plus the final answer: three halvings, not four
+        assert srv.requests["media"] == 3
+        assert get_limiter().factor("127.0.0.1") == 0.5 ** 3
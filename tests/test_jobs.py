@@ -0,0 +1,38 @@
+import queue
+import threading
+
+import xet_jobs
+from xet_jobs import JobManager
+
+
+def test_browser_work_of_the_same_shop_is_served_by_the_running_bulk_job(workdir, monkeypatch):
+    stop = threading.Event()
+    session = object()
+
+    def run_batch(core, todo, browser_work=None, **kwargs):
+        # The batch loop: serves outside work between its own steps until told to stop
+        while not stop.is_set():
+            try:
+                fn, fut = browser_work.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            fut.set_result(fn(session))
+        return {"captured": 0, "downloaded": 0, "failed": 0}
+
+    monkeypatch.setattr(xet_jobs, "run_batch", run_batch)
+    jobs = JobManager()
+    try:
+        bulk = jobs.submit_bulk("appx", None, [(0, "a_1", "one")])
+        while jobs.bulk_running() is None:
+            pass
+        # Served while the bulk job still holds the browser thread, with the batch's own browser
+        assert jobs.in_browser("appx", lambda s: s).result(timeout=5) is session
+        other = jobs.in_browser("appy", lambda s: s)
+        assert not other.done()
+        stop.set()
+        # Another shop's work waits for the bulk job and then gets a browser of its own
+        assert other.result(timeout=5) is None
+        assert bulk.state == "done" and jobs.bulk_running() is None
+    finally:
+        stop.set()
+        jobs.shutdown()
@@ -0,0 +1,77 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from xet_http import HostLimiter
+
+
+def test_throttle_halves_the_rate_and_successes_win_it_back():
+    limiter = HostLimiter(bytes_per_sec=1000, min_factor=1 / 4, recover_step=0.1)
+    limiter.throttled("h", retry_after=0)
+    assert limiter.factor("h") == 0.5
+    limiter.throttled("h", retry_after=0)
+    limiter.throttled("h", retry_after=0)
+    assert limiter.factor("h") == 0.25
+    for _ in range(3):
+        limiter.succeeded("h")
+    assert limiter.factor("h") == pytest.approx(0.55)
+    for _ in range(10):
+        limiter.succeeded("h")
+    assert limiter.factor("h") == 1.0
+    assert limiter.factor("other") == 1.0
+
+
+def test_throttle_pauses_only_that_host():
+    limiter = HostLimiter()
+    limiter.throttled("h", retry_after=2)
+    assert 1.5 < limiter.reserve_request("h") <= 2.0
+    assert limiter.reserve_request("other") == 0.0
+
+
+def test_byte_bucket_goes_into_debt_at_the_backed_off_rate():
+    limiter = HostLimiter(bytes_per_sec=1000)
+    # The first second's worth is available at once
+    assert limiter.reserve_bytes("h", 1000) == 0.0
+    assert limiter.reserve_bytes("h", 500) == pytest.approx(0.5, abs=0.05)
+    slowed = HostLimiter(bytes_per_sec=1000)
+    slowed.throttled("h", retry_after=0)
+    assert slowed.reserve_bytes("h", 1000) == pytest.approx(1.0, abs=0.05)
+
+
+def test_request_bucket():
+    limiter = HostLimiter(requests_per_sec=2)
+    assert limiter.reserve_request("h") == 0.0
+    assert limiter.reserve_request("h") == 0.0
+    assert limiter.reserve_request("h") == pytest.approx(0.5, abs=0.05)
+
+
+def test_shared_state_is_seen_by_every_limiter():
+    with multiprocessing.Manager() as manager:
+        shared = (manager.dict(), manager.Lock())
+        a = HostLimiter(bytes_per_sec=1000, shared=shared)
+        b = HostLimiter(bytes_per_sec=1000, shared=shared)
+        a.throttled("h", retry_after=0)
+        assert b.factor("h") == 0.5
+        assert a.reserve_bytes("h", 500) == 0.0
+        # b draws on what a already took
+        assert b.reserve_bytes("h", 500) == pytest.approx(1.0, abs=0.1)
+
+
+class _CountingDict(dict):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def __setitem__(self, key, value):
+        self.writes += 1
+        super().__setitem__(key, value)
+
+
+def test_shared_bucket_is_drawn_in_batches():
+    rows = _CountingDict()
+    limiter = HostLimiter(bytes_per_sec=16 * 64 * 1024, shared=(rows, threading.Lock()))
+    for _ in range(16):
+        limiter.reserve_bytes("h", 16 * 1024)
+    # 256KB in 16KB chunks: one batch of 64KB every four chunks, not one shared write per chunk
+    assert rows.writes == 4
@@ -0,0 +1,91 @@
+import json
+import os
+
+import pytest
+
+import xet_http
+from conftest import learn_resources_endpoint
+from xet_api import ReplayFailed
+from xet_core import Entity, XetCore, read_listing, write_listing
+from xet_fakeserver import FakeXet
+
+
+def test_listing_round_trip(tmp_path):
+    items = [Entity("a_1", "第1课：导论"), Entity("a_2"), {"id": "v_3", "title": 'Video "3"'}]
+    path = str(tmp_path / "sub" / "resources.ndjson")
+    assert write_listing(path, {"appid": "app", "product_id": "p_1"}, items) == 3
+    with open(path, "r", encoding="utf-8") as f:
+        assert json.loads(f.readline()) == {"_meta": {"appid": "app", "product_id": "p_1"}}
+    assert [e.to_dict() for e in read_listing(path)] == [
+        {"id": "a_1", "title": "第1课：导论"},
+        {"id": "a_2", "title": None},
+        {"id": "v_3", "title": 'Video "3"'},
+    ]
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_entity_reads_like_the_dict_it_replaced():
+    e = Entity("a_1", "One")
+    assert e["id"] == "a_1" and e.get("title") == "One"
+    assert e.get("missing", "x") == "x"
+    with pytest.raises(KeyError):
+        e["missing"]
+
+
+def test_merge_keeps_first_order_and_the_longer_title():
+    best = {}
+    page = {"data": {"list": [{"resource_id": "a_1"}, {"resource_id": "a_2", "resource_title": "Two"}]}}
+    assert XetCore.merge_entities(best, page, ["a_"]) == 2
+    again = {"data": {"list": [{"resource_id": "a_1", "resource_title": "One, full title"}, {"resource_id": "x_9"}]}}
+    assert XetCore.merge_entities(best, again, ["a_"]) == 0
+    assert [e.to_dict() for e in best.values()] == [
+        {"id": "a_1", "title": "One, full title"},
+        {"id": "a_2", "title": "Two"},
+    ]
+
+
+def test_api_replay_lists_every_page(workdir):
+    with FakeXet(columns=1, lessons=25, page_size=10) as srv:
+        pid = srv.product_ids()[0]
+        core = XetCore(srv.appid)
+        learn_resources_endpoint(core, srv, pid)
+        resources = core._list_via_api("resources", ["a_", "v_"], pid)
+        assert [e.id for e in resources] == srv.resource_ids(pid)
+        assert resources[0].title == "第1课"
+
+
+def test_api_replay_failing_after_the_first_page_falls_back_to_the_browser(workdir, monkeypatch):
+    with FakeXet(columns=1, lessons=25, page_size=10) as srv:
+        pid = srv.product_ids()[0]
+        core = XetCore(srv.appid)
+        learn_resources_endpoint(core, srv, pid)
+        session = xet_http.get_session()
+        request = session.request
+
+        def flaky(method, url, **kwargs):
+            if "page=2" in url:
+                raise xet_http.requests.exceptions.ConnectionError("reset")
+            return request(method, url, **kwargs)
+
+        monkeypatch.setattr(session, "request", flaky)
+        # A truncated listing is not a listing
+        assert core._list_via_api("resources", ["a_", "v_"], pid) is None
+        with pytest.raises(ReplayFailed):
+            for _ in core._iter_via_api("resources", ["a_", "v_"], pid, {}):
+                pass
+        # The streamed form keeps the first page and lets the browser finish the rest
+        browser = []
+
+        def iter_listing(url, prefixes, *args):
+            best = args[8]
+            browser.append(len(best))
+            rest = [Entity(rid, None) for rid in srv.resource_ids(pid)[len(best):]]
+            for e in rest:
+                best[e.id] = e
+            yield rest
+
+        monkeypatch.setattr(core, "_iter_listing", iter_listing)
+        listed = [e.id for e in core.iter_resources(srv.column_url(pid), pid) if e is not None]
+        assert browser == [10]
+        assert listed == srv.resource_ids(pid)
+        assert [e.id for e in read_listing(core.resources_file(pid))] == srv.resource_ids(pid)
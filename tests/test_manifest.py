@@ -0,0 +1,82 @@
+import os
+
+from conftest import learn_resources_endpoint
+from xet_batch import existing_download, sync_product
+from xet_core import Entity, XetCore
+from xet_fakeserver import FakeXet
+from xet_manifest import Manifest, file_sha256
+
+
+class _Session:
+    # Stands in for the browser: the listing comes from the API replay and captures are stubbed
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+def test_pending_is_the_sync_delta(tmp_path):
+    m = Manifest(str(tmp_path / "manifest.db"))
+    m.upsert_product("p_1")
+    assert m.upsert_resources("p_1", [Entity("a_1", "one"), Entity("a_2", "two")]) == 2
+    # Known ids refresh their title but are not new
+    assert m.upsert_resources("p_1", [Entity("a_1", "one, renamed")]) == 0
+    f = tmp_path / "one.mp3"
+    f.write_bytes(b"abc")
+    m.record_download("p_1", "a_1", str(f))
+    m.record_failure("p_1", "a_2", "boom")
+    rows = {r["resource_id"]: r for r in m.resources("p_1")}
+    assert rows["a_1"]["title"] == "one, renamed"
+    assert rows["a_1"]["sha256"] == file_sha256(str(f)) and rows["a_1"]["size"] == 3
+    assert rows["a_2"]["status"] == "failed" and rows["a_2"]["error"] == "boom"
+    assert [r["resource_id"] for r in m.pending("p_1")] == ["a_2"]
+    # A truncated or deleted file is pending again
+    f.write_bytes(b"ab")
+    assert [r["resource_id"] for r in m.pending("p_1")] == ["a_1", "a_2"]
+    m.close()
+
+
+def test_sync_product_fetches_only_the_delta(workdir, monkeypatch):
+    with FakeXet(columns=1, lessons=4, media_size=64 * 1024) as srv:
+        pid = srv.product_ids()[0]
+        core = XetCore(srv.appid, connections=2)
+        learn_resources_endpoint(core, srv, pid)
+        captured = []
+
+        def capture_many(jobs, session=None, poll=None, **kwargs):
+            for job in jobs:
+                if poll is not None:
+                    poll()
+                if job is None:
+                    continue
+                url, rid = job
+                captured.append(rid)
+                cap = core.write_capture(srv.lesson_url(rid), rid, [{"type": "response", "url": srv.media_url(rid)}], srv.cookies())  # noqa: E501
+                yield url, rid, cap
+
+        monkeypatch.setattr(core, "capture_session", lambda headless=None: _Session())
+        monkeypatch.setattr(core, "capture_many", capture_many)
+        manifest = Manifest.for_shop(core.capture_dir)
+        options = {"sleep_min": 0, "sleep_max": 0, "reuse_captures": False}
+
+        stats = sync_product(core, pid, manifest, **options)
+        rids = srv.resource_ids(pid)
+        assert stats["new"] == 4 and stats["downloaded"] == 4 and stats["failed"] == 0
+        for i, rid in enumerate(rids):
+            name = existing_download(core.download_dir, f"第{i + 1}课")
+            with open(os.path.join(core.download_dir, name), "rb") as f:
+                assert f.read() == srv.media_bytes(rid)
+
+        captured.clear()
+        stats = sync_product(core, pid, manifest, **options)
+        assert captured == [] and stats["new"] == 0 and stats["downloaded"] == 0
+
+        # A deleted file and a lesson added to the column are the whole delta
+        os.remove(os.path.join(core.download_dir, existing_download(core.download_dir, "第2课")))
+        srv.lessons = 5
+        stats = sync_product(core, pid, manifest, **options)
+        assert sorted(captured) == sorted([rids[1], srv.resource_ids(pid)[4]])
+        assert stats["new"] == 1 and stats["downloaded"] == 2
+        assert manifest.pending(pid) == []
+        manifest.close()
@@ -0,0 +1,63 @@
+import os
+
+from xet_manifest import file_sha256
+from xet_store import ContentStore, etag_store_key, url_store_key
+
+
+def _objects(store):
+    return [os.path.join(d, f) for d, _, files in os.walk(os.path.join(store.root, "objects")) for f in files]
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = ContentStore.for_download_dir(str(tmp_path))
+    a, b = tmp_path / "a.mp3", tmp_path / "b.mp3"
+    a.write_bytes(b"same lesson")
+    b.write_bytes(b"same lesson")
+    sha = file_sha256(str(a))
+    assert store.add(str(a), sha, [url_store_key("https://cdn.example/x/a.mp3?sign=1")]) == str(a)
+    store.add(str(b), sha)
+    assert store.stats() == {"objects": 1, "bytes": 11, "links": 2}
+    assert len(_objects(store)) == 1
+    assert a.read_bytes() == b.read_bytes() == b"same lesson"
+    if os.stat(a).st_nlink > 1:
+        assert os.path.samefile(a, b)
+    assert store.digest_of(str(b)) == sha
+    store.close()
+
+
+def test_url_key_ignores_the_signature_and_materializes(tmp_path):
+    store = ContentStore.for_download_dir(str(tmp_path))
+    a = tmp_path / "a.mp3"
+    a.write_bytes(b"lesson")
+    sha = file_sha256(str(a))
+    store.add(str(a), sha, [url_store_key("https://cdn.example/x/a.mp3?sign=1&t=1")])
+    hit = store.lookup(url_store_key("https://cdn.example/x/a.mp3?sign=2&t=2"))
+    assert hit == sha
+    assert store.materialize(hit, str(tmp_path / "other column.mp3"))
+    assert (tmp_path / "other column.mp3").read_bytes() == b"lesson"
+    assert store.lookup(url_store_key("https://cdn.example/x/b.mp3")) is None
+    assert store.lookup(None) is None
+    store.close()
+
+
+def test_missing_object_is_not_a_hit(tmp_path):
+    store = ContentStore.for_download_dir(str(tmp_path))
+    a = tmp_path / "a.mp3"
+    a.write_bytes(b"lesson")
+    sha = file_sha256(str(a))
+    key = url_store_key("https://cdn.example/x/a.mp3")
+    store.add(str(a), sha, [key])
+    for path in _objects(store):
+        os.remove(path)
+    assert store.lookup(key) is None
+    assert not store.materialize(sha, str(tmp_path / "b.mp3"))
+    store.close()
+
+
+def test_etag_keys():
+    assert etag_store_key("https://cdn.example/a.mp3", 'W/"weak"', 10) is None
+    assert etag_store_key("https://cdn.example/a.mp3", None, 10) is None
+    key = etag_store_key("https://cdn.example/a.mp3", '"e1"', 10)
+    assert key == etag_store_key("https://cdn.example/b.mp3?sign=2", '"e1"', 10)
+    assert key != etag_store_key("https://other.example/a.mp3", '"e1"', 10)
+    assert key != etag_store_key("https://cdn.example/a.mp3", '"e1"', 11)
@@ -0,0 +1,147 @@
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from xet_http import get_session
+
+
+# Parameter names the shop front-end uses for pagination
+PAGE_KEYS = ("page", "page_index", "pageIndex", "page_num", "pageNum", "page_no", "pageNo", "current_page", "currentPage")  # noqa: E501
+# Request headers that must not be replayed verbatim
+_DROP_HEADERS = {"cookie", "host", "content-length", "connection", "accept-encoding"}
+
+
+class ReplayFailed(RuntimeError):
+    # A page request failed after earlier pages were merged: the listing in best is incomplete
+    pass
+
+
+def load_endpoints(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception:
+        return {}
+
+
+def record_endpoint(path: str, kind: str, request: Any, subject: Optional[str] = None) -> None:
+    # Remember the request that produced listing entities, so later runs can replay it over HTTP
+    endpoints = load_endpoints(path)
+    endpoints[kind] = {
+        "url": request.url,
+        "method": request.method,
+        "post_data": request.post_data,
+        "headers": {k: v for k, v in request.headers.items() if k.lower() not in _DROP_HEADERS},
+        "subject": subject,
+        "learned_at": int(time.time()),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(endpoints, f, ensure_ascii=False, indent=2)
+
+
+def _find_page_key(params: Dict[str, Any]) -> Optional[str]:
+    for k in PAGE_KEYS:
+        if k in params and str(params[k]).isdigit():
+            return k
+    return None
+
+
+def _paged_request(endpoint: Dict[str, Any], subject: Optional[str]) -> Tuple[Callable[[int], Tuple[str, Optional[str]]], int]:  # noqa: E501
+    # Returns a builder page -> (url, body) and the page number the recorded request started at
+    url = endpoint["url"]
+    body = endpoint.get("post_data")
+    old = endpoint.get("subject")
+    if subject and old and subject != old:
+        url = url.replace(old, subject)
+        body = body.replace(old, subject) if body else body
+
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    key = _find_page_key(query)
+    if key:
+        def build_query(page: int) -> Tuple[str, Optional[str]]:
+            q = dict(query, **{key: str(page)})
+            return urlunsplit(parts._replace(query=urlencode(q))), body
+        return build_query, int(query[key])
+
+    if body:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            # Page numbers sit either at the top level or one object down (e.g. {"params": {...}})
+            holders = [data] + [v for v in data.values() if isinstance(v, dict)]
+            for holder in holders:
+                key = _find_page_key(holder)
+                if key:
+                    def build_json(page: int, holder: Dict[str, Any] = holder, key: str = key) -> Tuple[str, Optional[str]]:  # noqa: E501
+                        holder[key] = page if isinstance(holder[key], int) else str(page)
+                        return url, json.dumps(data, ensure_ascii=False)
+                    return build_json, int(holder[key])
+        else:
+            form = dict(parse_qsl(body, keep_blank_values=True))
+            key = _find_page_key(form)
+            if key:
+                def build_form(page: int) -> Tuple[str, Optional[str]]:
+                    return url, urlencode(dict(form, **{key: str(page)}))
+                return build_form, int(form[key])
+
+    # No recognizable pagination: the single recorded request is the whole listing
+    return (lambda page: (url, body)), -1
+
+
+def iter_replay(
+    endpoint: Dict[str, Any],
+    cookie_header: str,
+    merge: Callable[[Dict[str, Any], Any], int],
+    best: Dict[str, Any],
+    subject: Optional[str] = None,
+    max_pages: int = 200,
+    timeout: float = 20.0,
+) -> Iterator[int]:
+    # Page through a learned listing endpoint, folding each page into best with merge (which returns the
+    # number of new ids) and yielding that count per page. Stops quietly on a page without new ids. A
+    # failed first request ends it with best untouched (the replay did not work); a failure on a later
+    # page raises ReplayFailed, so a truncated listing is never mistaken for the whole one.
+    build, first_page = _paged_request(endpoint, subject)
+    headers = dict(endpoint.get("headers") or {})
+    headers["Cookie"] = cookie_header
+    session = get_session()
+    pages = max_pages if first_page >= 0 else 1
+    for i in range(pages):
+        url, body = build(first_page + i)
+        try:
+            r = session.request(endpoint.get("method") or "GET", url, headers=headers, data=body, timeout=timeout)
+            r.raise_for_status()
+            data = r.json()
+        except Exception as e:
+            if i == 0:
+                return
+            raise ReplayFailed(f"Listing replay failed on page {first_page + i}: {e}") from e
+        added = merge(best, data)
+        yield added
+        if added == 0:
+            return
+
+
+def replay_listing(
+    endpoint: Dict[str, Any],
+    cookie_header: str,
+    merge: Callable[[Dict[str, Any], Any], int],
+    subject: Optional[str] = None,
+    max_pages: int = 200,
+    timeout: float = 20.0,
+) -> Optional[List[Any]]:
+    # Whole listing at once; None means the replay failed and the caller should fall back to the
+    # browser (expired cookies, changed API, or no entities at all)
+    best: Dict[str, Any] = {}
+    try:
+        for _ in iter_replay(endpoint, cookie_header, merge, best, subject, max_pages, timeout):
+            pass
+    except ReplayFailed:
+        return None
+    return list(best.values()) if best else None
@@ -0,0 +1,426 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiohttp
+from playwright.async_api import async_playwright
+
+import xet_metrics as metrics
+from xet_api import record_endpoint
+from xet_core import PLAY_MEDIA_JS, PLAY_SELECTORS, RECAPTURE_ATTEMPTS, Entity, RawArchive, XetCore
+from xet_hls import download_hls
+from xet_http import (
+    CHUNK_SIZE,
+    RETRY_STATUSES,
+    OrderedHasher,
+    RangedFile,
+    SignedUrlExpired,
+    backoff_delay,
+    clear_journal,
+    finish_download,
+    get_limiter,
+    is_expired,
+    is_throttle,
+    journal_bytes,
+    url_host,
+)
+
+
+class AsyncXetCore:
+    # asyncio counterpart of XetCore: one event loop drives many captures (tabs of one browser)
+    # and downloads at once, bounded by semaphores. Paths, capture files, listings and parsing
+    # are shared with the sync class through self.core, so both produce the same on-disk layout.
+    #
+    #   async with AsyncXetCore(appid) as xc:
+    #       caps = await asyncio.gather(*(xc.login_and_capture(u, rid) for u, rid in jobs))
+
+    def __init__(
+        self,
+        appid: str,
+        max_tabs: int = 3,
+        max_downloads: int = 4,
+        connections: int = 4,
+        headless: Optional[bool] = None,
+        block_assets: bool = False,
+        retries: int = 5,
+    ) -> None:
+        self.core = XetCore(appid, max_tabs=max_tabs, connections=connections, block_assets=block_assets)
+        # None: headless while the stored login is valid, a visible browser for the QR login otherwise
+        self.headless = headless
+        self._login_started: Optional[float] = None
+        self.retries = retries
+        self._tabs = asyncio.Semaphore(self.core.max_tabs)
+        self._downloads = asyncio.Semaphore(max(1, max_downloads))
+        self._playwright: Any = None
+        self._context: Any = None
+        self._context_lock = asyncio.Lock()
+        self._http: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "AsyncXetCore":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def _ensure_context(self) -> Any:
+        async with self._context_lock:
+            if self._context is None:
+                if self.headless is None:
+                    self.headless = await asyncio.to_thread(self.core.session_valid)
+                if not self.headless and not self.core.session_valid(probe=False):
+                    self._login_started = time.time()
+                self._playwright = await async_playwright().start()
+                self._context = await self._playwright.chromium.launch_persistent_context(
+                    self.core.playwright_storage, headless=self.headless
+                )
+        return self._context
+
+    def _ensure_http(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=32, keepalive_timeout=60)
+            self._http = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None, sock_read=30))
+        return self._http
+
+    async def close(self) -> None:
+        if self._context is not None:
+            try:
+                cookies = await self._context.cookies()
+                logged_in_at = None
+                if self._login_started is not None:
+                    if await asyncio.to_thread(self.core.login_confirmed, cookies):
+                        logged_in_at = self._login_started
+                        self.core._probed = None
+                self.core.save_cookies(cookies, logged_in_at)
+            except Exception:
+                pass
+            try:
+                await self._context.close()
+            except Exception:
+                pass
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception:
+                pass
+        if self._http is not None:
+            await self._http.close()
+        self._context = None
+        self._playwright = None
+        self._http = None
+
+    @staticmethod
+    async def _install_asset_filter(
+        page: Any, candidates: Optional[List[Dict[str, Any]]] = None, found: Optional[asyncio.Event] = None
+    ) -> None:
+        # Same rules as XetCore._install_asset_filter; a media request blocked on a capture page is a find
+        async def handle(route):
+            try:
+                req = route.request
+                if XetCore.should_block(req.url, req.resource_type, candidates):
+                    await route.abort()
+                else:
+                    await route.continue_()
+            except Exception:
+                try:
+                    await route.continue_()
+                except Exception:
+                    pass
+            if found is not None and candidates:
+                found.set()
+
+        await page.route("**/*", handle)
+
+    async def _trigger_playback(self, page: Any) -> None:
+        try:
+            await page.wait_for_timeout(800)
+            for sel in PLAY_SELECTORS:
+                try:
+                    loc = page.locator(sel)
+                    if await loc.count() > 0:
+                        await loc.first.click(timeout=1000)
+                        await page.wait_for_timeout(300)
+                        break
+                except Exception:
+                    continue
+            try:
+                await page.evaluate(PLAY_MEDIA_JS)
+            except Exception:
+                pass
+        except Exception:
+            pass
+
+    async def login_and_capture(self, resource_url: str, resource_id: Optional[str] = None, wait_seconds: int = 120) -> str:  # noqa: E501
+        context = await self._ensure_context()
+        async with self._tabs:
+            page = await context.new_page()
+            candidates: List[Dict[str, Any]] = []
+            found = asyncio.Event()
+
+            async def on_response(resp):
+                try:
+                    url = resp.url
+                    ct = resp.headers.get("content-type", "").lower()
+                    if XetCore.is_media_response(url, ct):
+                        candidates.append({"type": "response", "from": url, "url": url})
+                    elif "application/json" in ct:
+                        cand = XetCore.json_candidate(url, await resp.json())
+                        if cand:
+                            candidates.append(cand)
+                except Exception:
+                    pass
+                if candidates:
+                    found.set()
+
+            page.on("response", on_response)
+            if self.core.block_assets:
+                await self._install_asset_filter(page, candidates, found)
+            try:
+                try:
+                    await page.goto(resource_url, wait_until="domcontentloaded", timeout=60000)
+                except Exception:
+                    pass
+                await self._trigger_playback(page)
+                deadline = time.time() + wait_seconds
+                while not candidates and time.time() < deadline:
+                    try:
+                        await asyncio.wait_for(found.wait(), timeout=min(2.0, max(0.05, deadline - time.time())))
+                    except asyncio.TimeoutError:
+                        try:
+                            await page.mouse.wheel(0, 800)
+                        except Exception:
+                            pass
+                cookies = await context.cookies()
+            finally:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+        return self.core.write_capture(resource_url, resource_id, candidates, cookies)
+
+    async def capture_resources(
+        self,
+        product_url: str,
+        product_id: Optional[str] = None,
+        wait_seconds: int = 120,
+        idle_seconds: float = 5.0,
+        use_api: bool = True,
+    ) -> List[Entity]:
+        pid = XetCore.product_id_from_url(product_url, product_id)
+        resources = None
+        with self.core._raw_archive(f"{pid or 'unknown_product'}_resources") as archive:
+            if use_api and pid:
+                resources = await asyncio.to_thread(self.core._list_via_api, "resources", ["a_", "v_"], pid, archive)
+            if resources is None:
+                resources = await self._capture_listing(
+                    product_url, ["a_", "v_"], wait_seconds, idle_seconds, "resources", pid, archive
+                )
+        self.core.write_resources(product_url, pid, resources)
+        return resources
+
+    async def _capture_listing(
+        self,
+        url: str,
+        id_prefixes: List[str],
+        wait_seconds: int,
+        idle_seconds: float,
+        api_kind: str,
+        api_subject: Optional[str],
+        archive: Optional[RawArchive] = None,
+    ) -> List[Entity]:
+        # Like XetCore._iter_listing: the first request that produced entities is recorded for API replay
+        context = await self._ensure_context()
+        async with self._tabs:
+            page = await context.new_page()
+            best: Dict[str, Entity] = {}
+            changed = asyncio.Event()
+            learned: List[bool] = []
+
+            async def on_response(resp):
+                try:
+                    if "application/json" in resp.headers.get("content-type", "").lower():
+                        if XetCore.merge_entities(best, await resp.json(), id_prefixes, archive):
+                            changed.set()
+                            if not learned:
+                                learned.append(True)
+                                record_endpoint(self.core.api_file, api_kind, resp.request, api_subject)
+                except Exception:
+                    pass
+
+            page.on("response", on_response)
+            if self.core.block_assets:
+                await self._install_asset_filter(page)
+            try:
+                try:
+                    await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+                except Exception:
+                    pass
+                deadline = time.time() + wait_seconds
+                while time.time() < deadline:
+                    # Before the first entity wait for the page (login); afterwards stop after a quiet period
+                    timeout = idle_seconds if best else 1.0
+                    changed.clear()
+                    try:
+                        await page.mouse.wheel(0, 1200)
+                    except Exception:
+                        pass
+                    try:
+                        await asyncio.wait_for(changed.wait(), timeout=min(timeout, max(0.05, deadline - time.time())))
+                    except asyncio.TimeoutError:
+                        if best:
+                            break
+            finally:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+        return list(best.values())
+
+    @asynccontextmanager
+    async def _open(self, url: str, headers: Dict[str, str]) -> AsyncIterator[aiohttp.ClientResponse]:
+        # GET with retries on throttling, 5xx and connection errors. The response is released on every
+        # way out: an expired signature, a failed status, or an error while the caller reads the body.
+        http = self._ensure_http()
+        limiter, host = get_limiter(), url_host(url)
+        attempt = 0
+        while True:
+            # The limiter may sit behind a Manager proxy; its lock and IPC stay off the event loop
+            wait = await asyncio.to_thread(limiter.reserve_request, host)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with AsyncExitStack() as stack:
+                try:
+                    resp = await stack.enter_async_context(http.get(url, headers=headers))
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt >= self.retries:
+                        raise
+                    delay = backoff_delay(attempt)
+                else:
+                    retry_after = resp.headers.get("Retry-After", "")
+                    throttle = is_throttle(resp.status, url)
+                    if throttle:
+                        await asyncio.to_thread(limiter.throttled, host, float(retry_after) if retry_after.isdigit() else None)  # noqa: E501
+                    elif resp.status < 400:
+                        await asyncio.to_thread(limiter.succeeded, host)
+                    if is_expired(resp.status, url):
+                        raise SignedUrlExpired(url, resp.status)
+                    # A throttling 403 is retried like a 429, after the pause the limiter just set
+                    if (resp.status not in RETRY_STATUSES and not throttle) or attempt >= self.retries:
+                        resp.raise_for_status()
+                        yield resp
+                        return
+                    delay = float(retry_after) if retry_after.isdigit() else backoff_delay(attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _throttle(self, url: str, n: int) -> None:
+        limiter = get_limiter()
+        if not limiter.bytes_per_sec:
+            return
+        delay = await asyncio.to_thread(limiter.reserve_bytes, url_host(url), n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _download_file(
+        self, url: str, headers: Dict[str, str], outfile: str, hasher: Optional[OrderedHasher] = None
+    ) -> str:
+        # Same probe, journal, part plan and on-disk handling as xet_http.download_file; only fetching differs
+        t0 = time.perf_counter()
+        async with self._open(url, {**headers, "Range": "bytes=0-0"}) as resp:
+            metrics.record("http_ttfb", time.perf_counter() - t0, host=url_host(url))
+            total = resp.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+            if resp.status != 206 or not total.isdigit():
+                # Server ignored the Range header and is already sending the whole body; nothing to resume
+                clear_journal(outfile)
+                tmp = outfile + ".tmp"
+                with metrics.span("part", start=0) as m:
+                    with open(tmp, "wb") as f:
+                        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                            await self._throttle(url, len(chunk))
+                            if hasher is not None:
+                                hasher.update_at(f.tell(), chunk)
+                            f.write(chunk)
+                    m["bytes"] = os.path.getsize(tmp)
+                if hasher is not None:
+                    hasher.finish(tmp)
+                return finish_download(outfile)
+            rf = RangedFile(outfile, url, int(total), resp.headers.get("ETag"), resp.headers.get("Last-Modified"), hasher)
+        parts = rf.parts(self.core.connections)
+        slots = asyncio.Semaphore(self.core.connections)
+
+        async def fetch(start: int, end: int) -> None:
+            async with slots:
+                offset = start
+                attempt = 0
+                t0 = time.perf_counter()
+                try:
+                    while offset <= end:
+                        try:
+                            async with self._open(url, {**headers, "Range": f"bytes={offset}-{end}"}) as part:
+                                if part.status != 206:
+                                    raise RuntimeError(f"Server stopped honouring Range requests: {url}")
+                                async for chunk in part.content.iter_chunked(CHUNK_SIZE):
+                                    await self._throttle(url, len(chunk))
+                                    rf.write(offset, chunk)
+                                    offset += len(chunk)
+                                    rf.progress(start, offset)
+                            if offset <= end:
+                                raise aiohttp.ClientPayloadError(f"Short read for bytes {start}-{end}")
+                        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+                            if attempt >= self.retries:
+                                raise
+                            await asyncio.sleep(backoff_delay(attempt))
+                            attempt += 1
+                except BaseException:
+                    rf.part_cut(start, offset)
+                    raise
+                rf.part_done(start, end, time.perf_counter() - t0, attempt)
+
+        with rf:
+            # Let every part finish or fail before the fd closes; the first failure is what surfaces
+            results = await asyncio.gather(*(fetch(a, b) for a, b in parts), return_exceptions=True)
+            for res in results:
+                if isinstance(res, BaseException):
+                    raise res
+        return rf.finish()
+
+    async def download_from_capture(self, capture_json_path: str, title: Optional[str] = None) -> Optional[str]:
+        # A signed URL rejected partway gets the resource captured again; the journal resumes the file
+        attempt = 0
+        while True:
+            plan = self.core.plan_download(capture_json_path, title)
+            if plan is None:
+                return None
+            url, headers, outfile, is_hls = plan
+            before = journal_bytes(outfile, url)
+            try:
+                async with self._downloads:
+                    if self.core.store is not None:
+                        # Dedup lookups and linking are blocking sqlite/filesystem work; run the sync path
+                        return await asyncio.to_thread(self.core._download_via_store, url, headers, outfile, is_hls)
+                    if is_hls:
+                        # Segment fetching is already concurrent inside the HLS engine; keep it off the loop
+                        return await asyncio.to_thread(download_hls, url, headers, outfile, 8, self.core.postprocessor)
+                    return await self._download_file(url, headers, outfile)
+            except SignedUrlExpired as e:
+                attempt = 1 if journal_bytes(outfile, url) > before else attempt + 1
+                if attempt > RECAPTURE_ATTEMPTS:
+                    raise
+                print(f"{e}; capturing {os.path.basename(outfile)} again to resume")
+                with open(capture_json_path, "r", encoding="utf-8") as f:
+                    payload = json.load(f)
+                capture_json_path = await self.login_and_capture(payload["page_url"], payload.get("resource_id"))
+
+    async def capture_and_download(
+        self,
+        resource_id: str,
+        product_id: Optional[str] = None,
+        title: Optional[str] = None,
+        wait_seconds: int = 120,
+    ) -> Optional[str]:
+        url = XetCore.build_resource_page_url(self.core.appid, resource_id, product_id)
+        cap = await self.login_and_capture(url, resource_id, wait_seconds)
+        return await self.download_from_capture(cap, title)
+
@@ -0,0 +1,337 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from itertools import chain
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from xet_core import CaptureSession, Entity, XetCore
+from xet_manifest import Manifest
+
+
+_STOP = object()
+
+
+def existing_download(download_dir: str, title: str) -> Optional[str]:
+    # Partial .tmp downloads do not count; they are resumed from their journal instead
+    base_name = XetCore.sanitize_filename(title)
+    try:
+        names = os.listdir(download_dir)
+    except FileNotFoundError:
+        return None
+    for fn in names:
+        if fn.startswith(base_name + ".") and not fn.endswith((".tmp", ".tmp.json")):
+            return fn
+    return None
+
+
+def capture_url(capture_json_path: str) -> Optional[str]:
+    try:
+        with open(capture_json_path, "r", encoding="utf-8") as f:
+            return XetCore.pick_best_candidate(json.load(f).get("candidates", []))
+    except Exception:
+        return None
+
+
+def polite_delay(sleep_min: float, sleep_max: float) -> float:
+    lo = max(0.0, min(sleep_min, sleep_max))
+    hi = max(sleep_min, sleep_max)
+    return random.uniform(lo, hi)
+
+
+class StreamedListing:
+    # Feeds run_batch from XetCore.iter_resources while the listing is still loading. accept(idx, entity)
+    # turns each listed resource into an (idx, rid, title) job, or None to skip it. jobs() hands the
+    # jobs out and yields None while none is ready; poll() keeps the listing page scrolling and is what
+    # run_batch passes on to capture_many. Both run on the browser thread.
+
+    def __init__(
+        self,
+        listing: Iterator[Optional[Entity]],
+        accept: Callable[[int, Entity], Optional[Tuple[int, str, str]]],
+    ) -> None:
+        self.listing = listing
+        self.accept = accept
+        self.resources: List[Entity] = []
+        self.done = False
+        self._todo: Deque[Tuple[int, str, str]] = deque()
+
+    def poll(self) -> None:
+        # Take listed resources until one job is ready or a pump of the listing page brought nothing
+        while not self.done and not self._todo:
+            try:
+                item = next(self.listing)
+            except StopIteration:
+                self.done = True
+                return
+            if item is None:
+                return
+            self.resources.append(item)
+            job = self.accept(len(self.resources) - 1, item)
+            if job is not None:
+                self._todo.append(job)
+
+    def jobs(self) -> Iterator[Optional[Tuple[int, str, str]]]:
+        while True:
+            while self._todo:
+                yield self._todo.popleft()
+            if self.done:
+                return
+            self.poll()
+            if not self._todo and not self.done:
+                yield None
+
+
+def run_batch(
+    core: XetCore,
+    items: Iterable[Optional[Tuple[int, str, str]]],
+    product_id: Optional[str] = None,
+    wait_capture: int = 180,
+    session: Optional[CaptureSession] = None,
+    tabs: Optional[int] = None,
+    download_workers: int = 2,
+    queue_size: int = 4,
+    sleep_min: float = 2.0,
+    sleep_max: float = 7.0,
+    manifest: Optional[Manifest] = None,
+    reuse_captures: bool = True,
+    progress: Optional[Callable[[str, str], None]] = None,
+    poll: Optional[Callable[[], None]] = None,
+    browser_work: Optional["queue.Queue[Tuple[Callable[[CaptureSession], Any], Future]]"] = None,
+) -> Dict[str, int]:
+    # Pipeline: the browser captures (idx, rid, title) items while download workers drain a bounded
+    # queue of finished captures, so the network and the browser are never idle waiting for each other.
+    # Politeness delays apply per stage: between opening resource pages, and between downloads per worker.
+    # With a manifest (and product_id), every capture, download and failure is recorded for later syncs.
+    # progress(event, rid) is called with "captured", "downloaded" or "failed" as items move along.
+    # items may also be a generator still being listed (StreamedListing.jobs, with poll=listing.poll).
+    # A download whose signed URL expires asks the browser thread for a fresh capture and resumes.
+    # browser_work carries (fn(session), future) from outside the batch; it is run between captures like
+    # the re-captures, and whatever is left when the batch ends stays queued for its owner.
+    track = manifest is not None and product_id is not None
+    stats = {"captured": 0, "downloaded": 0, "failed": 0}
+    lock = threading.Lock()
+    ready: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_size))
+    by_rid: Dict[str, Tuple[int, str]] = {}
+    # Re-capture requests from download workers; only the browser thread may drive Playwright
+    recaptures: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+    # Captures handed to the download queue whose download has not finished yet
+    outstanding = [0]
+
+    def report(event: str, rid: str) -> None:
+        with lock:
+            stats[event] += 1
+        if progress is not None:
+            try:
+                progress(event, rid)
+            except Exception:
+                pass
+
+    def recapture_for(rid: str) -> Callable[[str], str]:
+        def request(capture_json_path: str) -> str:
+            fut: "Future[str]" = Future()
+            recaptures.put((rid, fut))
+            return fut.result(timeout=wait_capture + 600)
+        return request
+
+    def download_worker() -> None:
+        while True:
+            job = ready.get()
+            if job is _STOP:
+                return
+            rid, cap = job
+            idx, title = by_rid[rid]
+            try:
+                print(f"[{idx}] Download -> {title}")
+                out = core.download_from_capture(cap, title=title, recapture=recapture_for(rid))
+                print(f"[{idx}] Done: {out}")
+                report("downloaded" if out else "failed", rid)
+                if track:
+                    if out:
+                        # The store already hashed the file while it streamed in; no second read
+                        digest = core.store.digest_of(out) if core.store is not None else None
+                        manifest.record_download(product_id, rid, out, digest)
+                    else:
+                        manifest.record_failure(product_id, rid, "no media candidate captured")
+            except Exception as e:
+                print(f"[{idx}] Failed: {rid} - {e}")
+                report("failed", rid)
+                if track:
+                    manifest.record_failure(product_id, rid, str(e))
+            finally:
+                with lock:
+                    outstanding[0] -= 1
+            delay = polite_delay(sleep_min, sleep_max)
+            if delay > 0:
+                time.sleep(delay)
+
+    def serve_recaptures(session: CaptureSession, timeout: float = 0.0) -> None:
+        # Runs on the browser thread, between steps of capture_many or after it finished
+        while browser_work is not None:
+            try:
+                fn, fut = browser_work.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fut.set_result(fn(session))
+            except Exception as e:
+                fut.set_exception(e)
+        while True:
+            try:
+                rid, fut = recaptures.get(timeout=timeout) if timeout else recaptures.get_nowait()
+            except queue.Empty:
+                return
+            timeout = 0.0
+            idx, title = by_rid[rid]
+            print(f"[{idx}] Capture again (signed URL expired): {rid} - {title}")
+            try:
+                url = XetCore.build_resource_page_url(core.appid, rid, product_id)
+                cap = core.login_and_capture(url, rid, wait_capture, session=session)
+                if track:
+                    manifest.record_capture(product_id, rid, cap, capture_url(cap))
+                fut.set_result(cap)
+            except Exception as e:
+                fut.set_exception(e)
+
+    def enqueue(session: CaptureSession, rid: str, cap: str) -> None:
+        with lock:
+            outstanding[0] += 1
+        # Blocks while the queue is full, so capturing never runs far ahead of downloading; workers
+        # waiting for a re-capture are served meanwhile or they could never drain it
+        while True:
+            try:
+                ready.put((rid, cap), timeout=0.5)
+                return
+            except queue.Full:
+                serve_recaptures(session)
+
+    def jobs(session: CaptureSession) -> Iterator[Optional[Tuple[str, str]]]:
+        for item in items:
+            if item is None:
+                yield None
+                continue
+            idx, rid, title = item
+            by_rid[rid] = (idx, title)
+            # A still-valid stored capture goes straight to the download queue, skipping the browser
+            cached = core.cached_capture(rid) if reuse_captures else None
+            if cached:
+                print(f"[{idx}] Reuse capture: {rid} - {title}")
+                report("captured", rid)
+                if track:
+                    manifest.record_capture(product_id, rid, cached, capture_url(cached))
+                enqueue(session, rid, cached)
+                continue
+            print(f"[{idx}] Capture: {rid} - {title}")
+            yield XetCore.build_resource_page_url(core.appid, rid, product_id), rid
+
+    workers = [threading.Thread(target=download_worker, daemon=True) for _ in range(max(1, download_workers))]
+    for w in workers:
+        w.start()
+    try:
+        with core._use_session(session, headless=None) as s:
+
+            def poll_all() -> None:
+                serve_recaptures(s)
+                if poll is not None:
+                    poll()
+
+            captures = core.capture_many(
+                jobs(s),
+                wait_seconds=wait_capture,
+                session=s,
+                max_tabs=tabs,
+                open_interval=lambda: polite_delay(sleep_min, sleep_max),
+                poll=poll_all,
+            )
+            for _, rid, cap in captures:
+                report("captured", rid)
+                if track:
+                    manifest.record_capture(product_id, rid, cap, capture_url(cap))
+                enqueue(s, rid, cap)
+            # Everything is captured; keep the browser for re-captures until the last download is done
+            while True:
+                with lock:
+                    if outstanding[0] <= 0:
+                        break
+                serve_recaptures(s, timeout=0.5)
+    finally:
+        while True:
+            try:
+                recaptures.get_nowait()[1].set_exception(RuntimeError("Batch stopped before the re-capture"))
+            except queue.Empty:
+                break
+        for _ in workers:
+            ready.put(_STOP)
+        for w in workers:
+            w.join()
+    return stats
+
+
+def sync_product(
+    core: XetCore,
+    product_id: str,
+    manifest: Manifest,
+    wait_list: int = 120,
+    idle_list: float = 5.0,
+    use_api: bool = True,
+    headless: Optional[bool] = None,
+    **batch_kwargs: Any,
+) -> Dict[str, int]:
+    # Re-list the column, then capture/download only the delta recorded in the manifest: new lessons,
+    # failed items, and files that are missing or truncated on disk. Rows known from earlier runs go
+    # first; new lessons join the batch as the listing streams in.
+    product_url = XetCore.build_product_page_url(core.appid, product_id)
+    manifest.upsert_product(product_id)
+    counts = {"new": 0, "fetch": 0}
+
+    def job(position: int, rid: str, title: str, done: bool) -> Optional[Tuple[int, str, str]]:
+        # Files from runs before the manifest existed are adopted instead of downloaded again
+        existing = existing_download(core.download_dir, title)
+        if existing and not done:
+            manifest.record_download(product_id, rid, os.path.join(core.download_dir, existing))
+            return None
+        counts["fetch"] += 1
+        return position, rid, title
+
+    known = []
+    for row in manifest.pending(product_id):
+        item = job(row["position"], row["resource_id"], row.get("title") or row["resource_id"], row["status"] == "done")
+        if item is not None:
+            known.append(item)
+
+    def accept(idx: int, entity: Entity) -> Optional[Tuple[int, str, str]]:
+        if not manifest.upsert_resources(product_id, [entity], start=idx):
+            return None
+        counts["new"] += 1
+        return job(idx, entity.id, entity.title or entity.id, False)
+
+    with core.capture_session(headless=headless) as session:
+        listing = StreamedListing(
+            core.iter_resources(
+                product_url,
+                product_id,
+                wait_seconds=wait_list,
+                idle_seconds=idle_list,
+                session=session,
+                use_api=use_api,
+                pump_seconds=0.25,
+            ),
+            accept,
+        )
+        stats = run_batch(
+            core,
+            chain(known, listing.jobs()),
+            product_id=product_id,
+            session=session,
+            manifest=manifest,
+            poll=listing.poll,
+            **batch_kwargs,
+        )
+    print(f"{product_id}: {len(listing.resources)} listed, {counts['new']} new, {counts['fetch']} queued")
+    stats["listed"] = len(listing.resources)
+    stats["new"] = counts["new"]
+    return stats
@@ -0,0 +1,327 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import xet_metrics as metrics
+from xet_batch import capture_url
+from xet_core import XetCore, read_listing, write_listing
+from xet_fakeserver import FakeXet
+
+
+def legacy_unique_by_id(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # The original dedup pass over the extractor's output, part of the same baseline
+    best: Dict[str, Dict[str, Any]] = {}
+    for it in items:
+        _id = it.get("id")
+        if not _id:
+            continue
+        cur = best.get(_id)
+        if cur is None:
+            best[_id] = it
+            continue
+        cur_title = cur.get("title")
+        new_title = it.get("title")
+        # Prefer the one with a non-empty title, or longer title text
+        def _len(x: Optional[str]) -> int:
+            return len(x) if isinstance(x, str) else 0
+        if (not cur_title and new_title) or (_len(new_title) > _len(cur_title)):
+            best[_id] = it
+    return list(best.values())
+
+
+def legacy_walk_collect_entities(node: Any, id_prefixes: List[str]) -> List[Dict[str, Any]]:
+    # The original recursive extractor, kept as the baseline for the entity benchmark
+    results: List[Dict[str, Any]] = []
+    try:
+        if isinstance(node, dict):
+            possible_keys = ["id", "resource_id", "spu_id", "src_id", "rid"]
+            _id = None
+            for k in possible_keys:
+                v = node.get(k)
+                if isinstance(v, str) and any(v.startswith(p) for p in id_prefixes):
+                    _id = v
+                    break
+            if _id:
+                title = (
+                    node.get("title")
+                    or node.get("product_name")
+                    or node.get("name")
+                    or node.get("resource_title")
+                    or node.get("course_title")
+                )
+                results.append({"id": _id, "title": title, "raw": node})
+            for v in node.values():
+                results.extend(legacy_walk_collect_entities(v, id_prefixes))
+        elif isinstance(node, list):
+            for it in node:
+                results.extend(legacy_walk_collect_entities(it, id_prefixes))
+    except Exception:
+        pass
+    return results
+
+
+def synthetic_listing(items: int, seed: int = 0) -> Dict[str, Any]:
+    # Shaped like a column listing page: a list of resources, each with nested metadata
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(items):
+        rid = f"{rnd.choice('av')}_{i:08x}e4b0{rnd.randrange(1 << 32):08x}"
+        rows.append({
+            "resource_id": rid,
+            "resource_title": f"Lesson {i}",
+            "img_url": f"https://img.example.com/{i}.jpg",
+            "extra": {"tags": [{"name": "t", "value": j} for j in range(5)], "stat": {"views": i}},
+            "product": {"id": "p_5c1234_AbCd", "title": "" if i % 3 else "Column"},
+        })
+    return {"code": 0, "data": {"list": rows, "total": items, "page": {"index": 1, "size": items}}}
+
+
+def synthetic_nested(depth: int) -> Dict[str, Any]:
+    # A deep chain of wrappers; the recursive walk copies every result list once per level
+    node: Dict[str, Any] = {"id": "a_leaf", "title": "leaf"}
+    for i in range(depth):
+        node = {"id": f"v_{i}", "child": node, "siblings": [{"n": i}]}
+    return node
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_entities(items: int, depth: int, repeat: int) -> None:
+    prefixes = ["a_", "v_"]
+    cases = [
+        (f"listing x{items}", synthetic_listing(items)),
+        (f"nested depth {depth}", synthetic_nested(depth)),
+    ]
+    print(f"{'case':<24}{'legacy (ms)':>14}{'iterative (ms)':>16}{'merge (ms)':>12}{'speedup':>10}")
+    for name, payload in cases:
+        old = legacy_walk_collect_entities(payload, prefixes)
+        new = XetCore._walk_collect_entities(payload, prefixes)
+        if [(e["id"], e["title"]) for e in old] != [(e["id"], e["title"]) for e in new]:
+            raise SystemExit(f"{name}: iterative extractor disagrees with the legacy one")
+        t_old = _time(lambda: legacy_unique_by_id(legacy_walk_collect_entities(payload, prefixes)), repeat)
+        t_new = _time(lambda: XetCore._walk_collect_entities(payload, prefixes), repeat)
+        t_merge = _time(lambda: XetCore.merge_entities({}, payload, prefixes), repeat)
+        print(f"{name:<24}{t_old * 1000:>14.2f}{t_new * 1000:>16.2f}{t_merge * 1000:>12.2f}{t_old / t_merge:>9.1f}x")
+    bench_listing_output(items, prefixes)
+
+
+def _listing_footprint(text: str, prefixes: List[str], compact: bool, outfile: str) -> Tuple[int, float, int]:
+    # Memory still held once the parsed page is dropped, time to write the listing file, and its size
+    tracemalloc.start()
+    payload = json.loads(text)
+    if compact:
+        best: Dict[str, Any] = {}
+        XetCore.merge_entities(best, payload, prefixes)
+        items: List[Any] = list(best.values())
+    else:
+        items = legacy_unique_by_id(legacy_walk_collect_entities(payload, prefixes))
+    del payload
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    if compact:
+        write_listing(outfile, {"bench": True}, items)
+    else:
+        with open(outfile, "w", encoding="utf-8") as f:
+            json.dump({"resources": items, "captured_at": int(time.time())}, f, ensure_ascii=False, indent=2)
+    return retained, time.perf_counter() - t0, os.path.getsize(outfile)
+
+
+def bench_listing_output(items: int, prefixes: List[str]) -> None:
+    # Old listing output (raw nodes kept, indented JSON) against Entity records streamed as NDJSON
+    text = json.dumps(synthetic_listing(items))
+    tmp = tempfile.mkdtemp(prefix="xet_bench_")
+    try:
+        print(f"\n{'listing output':<24}{'retained MB':>14}{'write (ms)':>12}{'file MB':>10}")
+        for name, compact, fname in (("raw + indent=2 JSON", False, "old.json"), ("Entity + NDJSON", True, "new.ndjson")):
+            retained, t_write, size = _listing_footprint(text, prefixes, compact, os.path.join(tmp, fname))
+            print(f"{name:<24}{retained / 1e6:>14.2f}{t_write * 1000:>12.2f}{size / 1e6:>10.2f}")
+        if sum(1 for _ in read_listing(os.path.join(tmp, "new.ndjson"))) != items:
+            raise SystemExit("NDJSON listing lost entities")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+@contextmanager
+def _scratch_dir(keep: bool) -> Iterator[str]:
+    # XetCore writes playwright_data/, captured/ and download/ under the cwd; keep benchmarks out of the repo
+    old = os.getcwd()
+    path = tempfile.mkdtemp(prefix="xet_bench_")
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(old)
+        if keep:
+            print(f"Artifacts kept in {path}")
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _latency_line(name: str, samples: List[float]) -> str:
+    s = sorted(samples)
+    if not s:
+        return f"{name:<22}{'-':>8}"
+    p = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1000  # noqa: E731
+    return f"{name:<22}{len(s):>8}{sum(s):>10.2f}{p(0.5):>10.0f}{p(0.95):>10.0f}{s[-1] * 1000:>10.0f}"
+
+
+def _server(args: argparse.Namespace, **overrides: Any) -> FakeXet:
+    opts = dict(
+        columns=1,
+        lessons=args.lessons,
+        media_size=args.size,
+        hls_every=args.hls_every,
+        hls_encrypt=args.hls_encrypt,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        drop_rate=args.drop_rate,
+    )
+    opts.update(overrides)
+    return FakeXet(**opts)
+
+
+def bench_download(args: argparse.Namespace) -> None:
+    # download_from_capture over synthetic captures; every file is checked byte for byte
+    with _scratch_dir(args.keep) as scratch, _server(args) as srv:
+        metrics.enable(os.path.join(scratch, "metrics.jsonl"))
+        core = XetCore(srv.appid, connections=args.connections)
+        pid = srv.product_ids()[0]
+        rids = srv.resource_ids(pid)
+        caps = [
+            core.write_capture(
+                srv.lesson_url(rid, pid), rid, [{"type": "json_key", "from": "", "url": srv.media_url(rid)}], srv.cookies()
+            )
+            for rid in rids
+        ]
+        latencies: List[float] = []
+
+        def one(i: int) -> Optional[str]:
+            t0 = time.perf_counter()
+            out = core.download_from_capture(caps[i], title=f"lesson_{i:04d}")
+            latencies.append(time.perf_counter() - t0)
+            return out
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+            outs = list(ex.map(one, range(len(caps))))
+        wall = time.perf_counter() - t0
+        total = 0
+        for rid, out in zip(rids, outs):
+            with open(out, "rb") as f:
+                if f.read() != srv.media_bytes(rid):
+                    raise SystemExit(f"{out}: content differs from what the server holds")
+            total += os.path.getsize(out)
+        print(f"{len(outs)} files, {total / 1e6:.1f} MB in {wall:.2f}s = {total / 1e6 / wall:.1f} MB/s "
+              f"(workers {args.workers}, connections {args.connections}, server requests {srv.requests})")
+        print(f"{'':<22}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        print(_latency_line("file download", latencies))
+        print(metrics.summary())
+        metrics.disable()
+
+
+def bench_capture(args: argparse.Namespace) -> None:
+    # Browser listing, API replay listing, and lesson captures through up to --tabs pages
+    with _scratch_dir(args.keep) as scratch, _server(args) as srv:
+        metrics.enable(os.path.join(scratch, "metrics.jsonl"))
+        core = XetCore(srv.appid, max_tabs=args.tabs)
+        pid = srv.product_ids()[0]
+        column = srv.column_url(pid)
+        with core.capture_session(headless=not args.show_browser) as session:
+            t0 = time.perf_counter()
+            items = core.capture_resources(column, pid, wait_seconds=120, idle_seconds=args.idle, session=session, use_api=False)  # noqa: E501
+            t_list = time.perf_counter() - t0
+            print(f"browser listing: {len(items)}/{srv.lessons} items in {t_list:.2f}s")
+
+            rids = [it["id"] for it in items][: args.captures]
+            t0 = time.perf_counter()
+            core.login_and_capture(srv.lesson_url(rids[0], pid), rids[0], wait_seconds=60, session=session)
+            print(f"single login_and_capture: {time.perf_counter() - t0:.2f}s")
+
+            latencies: List[float] = []
+            found = 0
+            t0 = time.perf_counter()
+            last = t0
+            jobs = [(srv.lesson_url(rid, pid), rid) for rid in rids]
+            for _, _, cap in core.capture_many(jobs, wait_seconds=60, session=session, max_tabs=args.tabs):
+                now = time.perf_counter()
+                latencies.append(now - last)
+                last = now
+                found += 1 if capture_url(cap) else 0
+            wall = time.perf_counter() - t0
+            print(f"capture_many: {len(jobs)} pages, {found} with media, {wall:.2f}s = {len(jobs) / wall:.2f} pages/s (tabs {args.tabs})")  # noqa: E501
+        # The cookie snapshot written when the session closed lets the learned endpoint be replayed
+        t0 = time.perf_counter()
+        items = core.capture_resources(column, pid, use_api=True)
+        print(f"API replay listing: {len(items)} items in {time.perf_counter() - t0:.2f}s")
+        print(f"{'':<22}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        print(_latency_line("capture interval", latencies))
+        print(metrics.summary())
+        metrics.disable()
+
+
+def _add_server_args(p: argparse.ArgumentParser, lessons: int) -> None:
+    p.add_argument("--lessons", type=int, default=lessons)
+    p.add_argument("--size", type=int, default=4 * 1024 * 1024, help="Bytes per mp3")
+    p.add_argument("--hls-every", type=int, default=0, help="Every n-th lesson is HLS")
+    p.add_argument("--hls-encrypt", action="store_true")
+    p.add_argument("--latency", type=float, default=0.02, help="Server latency per response, seconds")
+    p.add_argument("--bandwidth", type=int, default=0, help="Server bytes/s per connection (0: unlimited)")
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--throttle-rate", type=float, default=0.0)
+    p.add_argument("--drop-rate", type=float, default=0.0)
+    p.add_argument("--keep", action="store_true", help="Keep the scratch directory with files and metrics")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for xet_core hot paths")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_ent = sub.add_parser("entities", help="Entity extraction over large synthetic payloads")
+    p_ent.add_argument("--items", type=int, default=20000)
+    # The legacy walk needs the recursion limit raised to survive this depth at all
+    p_ent.add_argument("--depth", type=int, default=2000)
+    p_ent.add_argument("--repeat", type=int, default=5)
+    p_dl = sub.add_parser("download", help="download_from_capture against the local fake server")
+    _add_server_args(p_dl, lessons=16)
+    p_dl.add_argument("--workers", type=int, default=2, help="Files downloaded at once")
+    p_dl.add_argument("--connections", type=int, default=4, help="Range connections per file")
+    p_cap = sub.add_parser("capture", help="capture_resources/login_and_capture against the local fake server")
+    _add_server_args(p_cap, lessons=30)
+    p_cap.add_argument("--captures", type=int, default=10, help="Lesson pages to capture")
+    p_cap.add_argument("--tabs", type=int, default=3)
+    p_cap.add_argument("--idle", type=float, default=1.5, help="Listing idle cut-off, seconds")
+    p_cap.add_argument("--show-browser", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    if args.cmd == "entities":
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), args.depth * 3 + 100))
+        bench_entities(args.items, args.depth, args.repeat)
+    elif args.cmd == "download":
+        bench_download(args)
+    elif args.cmd == "capture":
+        bench_capture(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,30 @@
 import argparse
-import os
-import re
-from typing import Optional
+from typing import Any, List, Optional
 
+from xet_batch import sync_product
+import xet_metrics as metrics
 from xet_core import XetCore
+from xet_http import configure_limits, configure_session, parse_rate
+from xet_manifest import Manifest
+from xet_postprocess import from_flags
+from xet_store import ContentStore
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Unified CLI for Xiaoet (login/capture/download)")
+    parser.add_argument("--block-assets", action="store_true", help="Skip images/fonts/css/trackers/media bodies while capturing")  # noqa: E501
+    parser.add_argument("--headed", action="store_true", help="Always show the browser for captures (default: headless while the stored login is valid)")  # noqa: E501
+    parser.add_argument("--connections", type=int, default=4, help="Parallel range connections per file")
+    parser.add_argument("--pool-size", type=int, default=32, help="HTTP keep-alive connections kept per host")
+    parser.add_argument("--retries", type=int, default=5, help="Retries for 5xx/429/connection errors")
+    parser.add_argument("--max-bps", type=str, default=None, help="Per-host download bandwidth cap, e.g. 4M (default: unlimited)")  # noqa: E501
+    parser.add_argument("--max-rps", type=float, default=0.0, help="Per-host requests per second cap (default: unlimited)")
+    parser.add_argument("--dedup", action="store_true", help="Keep downloads in a content-addressed store (download/.store) and link duplicates")  # noqa: E501
+    parser.add_argument("--remux", action="store_true", help="Pipe HLS video into ffmpeg and save mp4 instead of .ts")
+    parser.add_argument("--audio-only", action="store_true", help="Pipe HLS video into ffmpeg and keep only the audio (m4a)")  # noqa: E501
+    parser.add_argument("--post-workers", type=int, default=1, help="ffmpeg processes running at once")
+    parser.add_argument("--metrics", type=str, default=None, help="Append per-stage timing spans to this JSON-lines file")  # noqa: E501
+    parser.add_argument("--metrics-summary", action="store_true", help="Print a per-stage timing table at the end (needs --metrics)")  # noqa: E501
     sub = parser.add_subparsers(dest="cmd", required=True)
 
     # login + capture
@@ -29,6 +46,7 @@ def parse_args() -> argparse.Namespace:
     p_quick.add_argument("resource_url", type=str, help="Audio/video page URL")
     p_quick.add_argument("--resource-id", type=str, default=None, help="Optional resource id")
     p_quick.add_argument("--wait", type=int, default=180, help="Max seconds to wait")
+    p_quick.add_argument("--fresh", action="store_true", help="Ignore a still-valid stored capture")
 
     # quick by product id + resource id
     p_qr = sub.add_parser("quick-resource", help="Capture+download by product_id and resource_id")
@@ -36,13 +54,17 @@ def parse_args() -> argparse.Namespace:
     p_qr.add_argument("product_id", type=str)
     p_qr.add_argument("resource_id", type=str)
     p_qr.add_argument("--wait", type=int, default=180)
+    p_qr.add_argument("--fresh", action="store_true", help="Ignore a still-valid stored capture")
 
     # list products
     p_lp = sub.add_parser("list-products", help="Capture product list (entry_url defaults to https://{appid}.xet.citv.cn)")
     p_lp.add_argument("appid", type=str, help="Shop ID")
     p_lp.add_argument("entry_url", nargs='?', default=None, type=str, help="Shop entry URL (optional)")
     p_lp.add_argument("--wait", type=int, default=120)
+    p_lp.add_argument("--idle", type=float, default=5.0, help="Stop after this many seconds without new items")
+    p_lp.add_argument("--no-api", action="store_true", help="Always list through the browser, never replay the API")
     p_lp.add_argument("--show-browser", action="store_true", help="Show browser window while capturing")
+    p_lp.add_argument("--keep-raw", action="store_true", help="Also archive the full API node of each item (raw/*.ndjson)")  # noqa: E501
 
     # list resources under product
     p_lr = sub.add_parser("list-resources", help="Capture resources under a product (product_url optional if product_id provided)")
@@ -50,101 +72,173 @@ def parse_args() -> argparse.Namespace:
     p_lr.add_argument("product_url", nargs='?', default=None, type=str, help="Product page URL (optional)")
     p_lr.add_argument("--product-id", type=str, default=None, help="Product ID (required if product_url omitted)")
     p_lr.add_argument("--wait", type=int, default=120)
+    p_lr.add_argument("--idle", type=float, default=5.0, help="Stop after this many seconds without new items")
+    p_lr.add_argument("--no-api", action="store_true", help="Always list through the browser, never replay the API")
     p_lr.add_argument("--show-browser", action="store_true", help="Show browser window while capturing")
-
-    return parser.parse_args()
-
-
-def cmd_capture(appid: str, resource_url: str, resource_id: Optional[str], wait: int) -> None:
-    core = XetCore(appid)
+    p_lr.add_argument("--keep-raw", action="store_true", help="Also archive the full API node of each item (raw/*.ndjson)")  # noqa: E501
+
+    # incremental sync of a product against the local manifest
+    p_sync = sub.add_parser("sync", help="Download only new/failed/missing/truncated resources of a product")
+    p_sync.add_argument("appid", type=str, help="Shop ID")
+    p_sync.add_argument("product_id", type=str, help="Product ID, e.g., p_xxx")
+    p_sync.add_argument("--wait-list", type=int, default=120)
+    p_sync.add_argument("--idle-list", type=float, default=5.0)
+    p_sync.add_argument("--wait-capture", type=int, default=180)
+    p_sync.add_argument("--no-api", action="store_true", help="List through the browser instead of replaying the API")
+    p_sync.add_argument("--tabs", type=int, default=3)
+    p_sync.add_argument("--download-workers", type=int, default=2)
+    p_sync.add_argument("--queue-size", type=int, default=4, help="Max finished captures waiting for a download worker")
+    p_sync.add_argument("--fresh-captures", action="store_true", help="Capture every item even if a stored capture is still valid")  # noqa: E501
+    p_sync.add_argument("--sleep-min", type=float, default=2.0)
+    p_sync.add_argument("--sleep-max", type=float, default=7.0)
+
+    return parser.parse_args(argv)
+
+
+def cmd_capture(appid: str, resource_url: str, resource_id: Optional[str], wait: int, block_assets: bool = False, headed: bool = False) -> None:  # noqa: E501
+    core = XetCore(appid, block_assets=block_assets)
+    core.headless = False if headed else None
     path = core.login_and_capture(resource_url, resource_id, wait)
     print(f"Capture saved to: {path}")
 
 
-def cmd_download(appid: str, capture: str, title: Optional[str]) -> None:
-    core = XetCore(appid)
+def cmd_download(appid: str, capture: str, title: Optional[str], postprocessor: Any = None, store: Any = None, connections: int = 4) -> None:  # noqa: E501
+    core = XetCore(appid, connections=connections)
+    core.postprocessor = postprocessor
+    core.store = store
     outfile = core.download_from_capture(capture, title)
     print(f"Downloaded: {outfile}")
 
 
-def cmd_quick(appid: str, resource_url: str, resource_id: Optional[str], wait: int) -> None:
-    core = XetCore(appid)
-    cap = core.login_and_capture(resource_url, resource_id, wait)
+def cmd_quick(appid: str, resource_url: str, resource_id: Optional[str], wait: int, block_assets: bool = False, fresh: bool = False, postprocessor: Any = None, store: Any = None, headed: bool = False, connections: int = 4) -> None:  # noqa: E501
+    core = XetCore(appid, connections=connections, block_assets=block_assets)
+    core.headless = False if headed else None
+    core.postprocessor = postprocessor
+    core.store = store
+    if fresh:
+        cap = core.login_and_capture(resource_url, resource_id, wait)
+    else:
+        cap = core.capture_or_reuse(resource_url, resource_id, wait)
     out = core.download_from_capture(cap)
     print(f"Downloaded: {out}")
 
 
-def cmd_quick_resource(appid: str, product_id: str, resource_id: str, wait: int) -> None:
-    core = XetCore(appid)
+def cmd_quick_resource(appid: str, product_id: str, resource_id: str, wait: int, block_assets: bool = False, fresh: bool = False, postprocessor: Any = None, store: Any = None, headed: bool = False, connections: int = 4) -> None:  # noqa: E501
+    core = XetCore(appid, connections=connections, block_assets=block_assets)
+    core.headless = False if headed else None
+    core.postprocessor = postprocessor
+    core.store = store
     url = XetCore.build_resource_page_url(appid, resource_id, product_id)
-    cap = core.login_and_capture(url, resource_id, wait)
+    if fresh:
+        cap = core.login_and_capture(url, resource_id, wait)
+    else:
+        cap = core.capture_or_reuse(url, resource_id, wait)
     out = core.download_from_capture(cap)
     print(f"Downloaded: {out}")
 
 
+def cmd_sync(args: argparse.Namespace, block_assets: bool = False, postprocessor: Any = None, store: Any = None) -> None:
+    core = XetCore(args.appid, connections=args.connections, block_assets=block_assets)
+    core.headless = False if args.headed else None
+    core.postprocessor = postprocessor
+    core.store = store
+    manifest = Manifest.for_shop(core.capture_dir)
+    try:
+        stats = sync_product(
+            core,
+            args.product_id,
+            manifest,
+            wait_list=args.wait_list,
+            idle_list=args.idle_list,
+            use_api=not args.no_api,
+            wait_capture=args.wait_capture,
+            tabs=args.tabs,
+            download_workers=args.download_workers,
+            queue_size=args.queue_size,
+            reuse_captures=not args.fresh_captures,
+            sleep_min=args.sleep_min,
+            sleep_max=args.sleep_max,
+        )
+    finally:
+        manifest.close()
+    print(f"Sync {args.product_id}: {stats}")
+
+
 def main() -> None:
-    # args = parse_args()
-    # 调试代码：硬编码参数（按需启用其中一个预设）
+    args = parse_args()
+    # 调试代码：硬编码参数（按需启用其中一个预设，替换上面的 parse_args）
     # 预设A：list-products（抓取专栏列表）
-    # args = argparse.Namespace(
-    #     cmd="list-products",
-    #     appid="app8ydmwl262114",
-    #     entry_url="https://app8ydmwl262114.xet.citv.cn",
-    #     wait=120,
-    #     show_browser=True,
-    # )
+    # args = parse_args(["list-products", "app8ydmwl262114", "https://app8ydmwl262114.xet.citv.cn", "--show-browser"])
     # 预设B：list-resources（抓取某专栏资源列表）
-    # args = argparse.Namespace(
-    #     cmd="list-resources",
-    #     appid="app8ydmwl262114",
-    #     product_url="https://app8ydmwl262114.xet.citv.cn/p/column/details?p_59e9fbdfbb63e_ttHpBdbE",
-    #     product_id="p_59e9fbdfbb63e_ttHpBdbE",
-    #     wait=120,
-    #     show_browser=True,
-    # )
+    # args = parse_args(["list-resources", "app8ydmwl262114", "--product-id", "p_59e9fbdfbb63e_ttHpBdbE", "--show-browser"])  # noqa: E501
     # 预设C：quick-resource（通过 product_id + resource_id 直接打开页面并下载）
-    args = argparse.Namespace(
-        cmd="quick-resource",
-        appid="app8ydmwl262114",
-        product_id="p_59e9fbdfbb63e_ttHpBdbE",
-        resource_id="a_68b3f491e4b0694ca10c26e9",
-        wait=100,
-    )
-    
+    # args = parse_args(["quick-resource", "app8ydmwl262114", "p_59e9fbdfbb63e_ttHpBdbE", "a_68b3f491e4b0694ca10c26e9", "--wait", "100"])  # noqa: E501
+    configure_session(pool_size=args.pool_size, retries=args.retries)
+    configure_limits(parse_rate(args.max_bps), args.max_rps)
+    if args.metrics:
+        metrics.enable(args.metrics)
+    try:
+        run_command(args)
+    finally:
+        if args.metrics_summary:
+            metrics.print_summary()
+        metrics.disable()
+
+
+def run_command(args: argparse.Namespace) -> None:
+    block_assets = args.block_assets
+    post = from_flags(args.remux, args.audio_only, args.post_workers)
+    store = ContentStore.for_download_dir("download") if args.dedup else None
+    headed = args.headed
+    connections = args.connections
     if args.cmd == "capture":
-        cmd_capture(args.appid, args.resource_url, args.resource_id, args.wait)
+        cmd_capture(args.appid, args.resource_url, args.resource_id, args.wait, block_assets, headed)
     elif args.cmd == "download":
-        cmd_download(args.appid, args.capture, args.title)
+        cmd_download(args.appid, args.capture, args.title, post, store, connections)
     elif args.cmd == "quick":
-        cmd_quick(args.appid, args.resource_url, args.resource_id, args.wait)
+        cmd_quick(args.appid, args.resource_url, args.resource_id, args.wait, block_assets, args.fresh, post, store, headed, connections)  # noqa: E501
     elif args.cmd == "list-products":
-        core = XetCore(args.appid)
+        core = XetCore(args.appid, block_assets=block_assets)
+        core.keep_raw = args.keep_raw
         entry_url = args.entry_url or f"https://{args.appid}.xet.citv.cn"
-        items = core.capture_products(entry_url, args.wait, headless=(not args.show_browser))
-        outfile = os.path.join(core.capture_dir, "products.json")
+        items = core.capture_products(
+            entry_url,
+            args.wait,
+            headless=(not args.show_browser),
+            idle_seconds=args.idle,
+            use_api=not args.no_api,
+        )
+        outfile = core.products_file()
         print(f"Saved to: {outfile} ({len(items)} items)")
         for it in items:
             print(f"{it.get('id')}\t{it.get('title')}")
     elif args.cmd == "list-resources":
-        core = XetCore(args.appid)
+        core = XetCore(args.appid, block_assets=block_assets)
+        core.keep_raw = args.keep_raw
         product_url = args.product_url
         if not product_url:
             if not args.product_id:
                 raise SystemExit("Either product_url or --product-id must be provided")
             product_url = f"https://{args.appid}.xet.citv.cn/p/column/details?{args.product_id}"
-        items = core.capture_resources(product_url, args.product_id, args.wait, headless=(not args.show_browser))
-        pid = args.product_id
-        if not pid:
-            m = re.search(r"product_id=([pA-Za-z0-9_]+)", product_url)
-            if m:
-                pid = m.group(1)
-        key = pid or "unknown_product"
-        outfile = os.path.join(core.capture_dir, f"{key}_resources.json")
+        items = core.capture_resources(
+            product_url,
+            args.product_id,
+            args.wait,
+            headless=(not args.show_browser),
+            idle_seconds=args.idle,
+            use_api=not args.no_api,
+        )
+        outfile = core.resources_file(XetCore.product_id_from_url(product_url, args.product_id))
         print(f"Saved to: {outfile} ({len(items)} items)")
         for it in items:
             print(f"{it.get('id')}\t{it.get('title')}")
+    elif args.cmd == "sync":
+        cmd_sync(args, block_assets, post, store)
     elif args.cmd == "quick-resource":
-        cmd_quick_resource(args.appid, args.product_id, args.resource_id, args.wait)
+        cmd_quick_resource(
+            args.appid, args.product_id, args.resource_id, args.wait, block_assets, args.fresh, post, store,
+            headed, connections,
+        )
 
 
 if __name__ == "__main__":
@@ -2,73 +2,244 @@ import json
 import os
 import re
 import time
-from typing import Any, Dict, List, Optional
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
 
-from playwright.sync_api import sync_playwright
-import requests
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError, sync_playwright
+
+import xet_metrics as metrics
+from xet_api import ReplayFailed, iter_replay, load_endpoints, record_endpoint
+from xet_hls import download_hls
+from xet_http import OrderedHasher, SignedUrlExpired, download_file, journal_bytes, signed_url_expiry, url_is_alive
+from xet_manifest import file_sha256
+from xet_postprocess import target_path
+from xet_store import etag_store_key, url_store_key
+
+
+ENTITY_ID_KEYS = ("id", "resource_id", "spu_id", "src_id", "rid")
+ENTITY_TITLE_KEYS = ("title", "product_name", "name", "resource_title", "course_title")
+# Stored captures older than this are captured again, whatever their URL says
+CAPTURE_TTL = 2 * 3600
+# Signed URLs this close to expiry are not worth starting a download with
+CAPTURE_EXPIRY_MARGIN = 10 * 60
+# A QR login stays valid for about 4 hours; past SESSION_TTL - SESSION_MARGIN it is treated as expired
+SESSION_TTL = 4 * 3600
+SESSION_MARGIN = 10 * 60
+# How long a session probe result is trusted before the next one
+SESSION_PROBE_TTL = 5 * 60
+# Cookie the shop sets once a QR login has completed
+LOGIN_COOKIE = "ko_token"
+# Fresh captures tried in a row without the download getting any further, once its signed URL expires
+RECAPTURE_ATTEMPTS = 2
+# Media URL extensions, in the order pick_best_candidate prefers them
+MEDIA_EXTS = [".m3u8", ".m4a", ".mp3", ".aac", ".flac"]
+MEDIA_JSON_KEYS = ["audio_url", "audioUrl", "play_url", "playUrl", "hls_url", "hlsUrl"]
+PLAY_SELECTORS = [
+    "button:has-text('播放')",
+    "[aria-label='播放']",
+    ".play",
+    ".player-play",
+    "button",
+]
+PLAY_MEDIA_JS = """
+() => {
+  const media = document.querySelector('audio, video');
+  if (media) {
+    media.muted = false;
+    const p = media.play();
+    if (p && p.catch) p.catch(() => {});
+  }
+}
+"""
+# Resource types a capture never needs; skipping them saves bandwidth and renderer CPU
+BLOCKED_RESOURCE_TYPES = {"image", "font", "stylesheet"}
+TRACKER_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "hm.baidu.com",
+    "cnzz.com",
+    "umeng.com",
+    "growingio.com",
+    "sensorsdata.cn",
+    "aegis.qq.com",
+)
+
+
+def _text_len(x: Any) -> int:
+    return len(x) if isinstance(x, str) else 0
+
+
+class Entity:
+    # One listing entry with only what downstream code reads; it["id"] / it.get("title") work as on the
+    # dicts it replaced. The API node it came from is not kept (see RawArchive).
+    __slots__ = ("id", "title")
+
+    def __init__(self, id: str, title: Optional[str] = None) -> None:
+        self.id = id
+        self.title = title
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "title": self.title}
+
+    def __repr__(self) -> str:
+        return f"Entity({self.id!r}, {self.title!r})"
+
+
+class RawArchive:
+    # Optional NDJSON side file holding the full API node of each kept entity, one {"id", "raw"} per line
+    # (a later line for an id supersedes earlier ones). Nodes are written as they are merged, so listing
+    # memory stays one Entity per id.
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+        self._f: Any = None
+
+    def __enter__(self) -> "RawArchive":
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._f = open(self.path, "w", encoding="utf-8")
+        return self
+
+    def add(self, _id: str, raw: Any) -> None:
+        self._f.write(json.dumps({"id": _id, "raw": raw}, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._f.close()
+
+
+def write_listing(path: str, meta: Dict[str, Any], items: Iterable[Any]) -> int:
+    # NDJSON: a {"_meta": {...}} line, then one compact {"id", "title"} object per entity. Goes through
+    # a .tmp file so a reader never sees half a listing. Returns the number of entities written.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    n = 0
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"_meta": meta}, ensure_ascii=False) + "\n")
+        for it in items:
+            f.write(json.dumps({"id": it.get("id"), "title": it.get("title")}, ensure_ascii=False) + "\n")
+            n += 1
+    os.replace(tmp, path)
+    return n
+
+
+def read_listing(path: str) -> Iterator[Entity]:
+    # Entities of a listing written by write_listing, one line at a time
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            if "_meta" not in row:
+                yield Entity(row.get("id"), row.get("title"))
 
 
 class XetCore:
-    def __init__(self, appid: str) -> None:
+    def __init__(
+        self,
+        appid: str,
+        max_tabs: int = 3,
+        connections: int = 4,
+        block_assets: bool = False,
+        profile_dir: Optional[str] = None,
+    ) -> None:
         self.appid = appid
-        self.playwright_storage = os.path.join("playwright_data", appid)
+        # Abort images/fonts/css/trackers and media bodies on capture pages (opt-in)
+        self.block_assets = block_assets
+        # Upper bound of resource pages captured concurrently for this shop
+        self.max_tabs = max(1, max_tabs)
+        # Parallel byte-range connections per downloaded file
+        self.connections = max(1, connections)
+        # A running Chromium locks its profile, so parallel workers of one shop each pass their own copy
+        self.playwright_storage = profile_dir or os.path.join("playwright_data", appid)
         self.capture_dir = os.path.join("captured", appid)
         self.download_dir = "download"
+        # Cookie snapshot of the persistent profile, refreshed whenever a browser session closes; kept inside
+        # the profile, so a cloned worker profile is judged by its own login rather than another one's
+        self.cookie_file = os.path.join(self.playwright_storage, "cookies.json")
+        # Listing API requests learned from browser captures, replayed over plain HTTP
+        self.api_file = os.path.join(self.capture_dir, "listing_api.json")
+        # Optional xet_postprocess.PostProcessor: HLS is then piped into ffmpeg instead of saved as .ts
+        self.postprocessor: Any = None
+        # Optional xet_store.ContentStore: downloads are deduplicated by URL, ETag and content hash
+        self.store: Any = None
+        # Also archive the full API node of every listed entity to captured/{appid}/raw/*.ndjson
+        self.keep_raw = False
+        # Browser mode for captures: None runs headless while the stored login is valid and opens a
+        # visible browser for the QR login only once it has expired; True/False force a mode
+        self.headless: Optional[bool] = None
+        self._probed: Optional[Tuple[float, bool]] = None
         os.makedirs(self.playwright_storage, exist_ok=True)
+        os.makedirs(os.path.dirname(self.cookie_file), exist_ok=True)
         os.makedirs(self.capture_dir, exist_ok=True)
         os.makedirs(self.download_dir, exist_ok=True)
 
     @staticmethod
-    def _walk_collect_entities(node: Any, id_prefixes: List[str]) -> List[Dict[str, Any]]:
-        results: List[Dict[str, Any]] = []
-        try:
-            if isinstance(node, dict):
-                # If dict itself represents an entity
-                possible_keys = ["id", "resource_id", "spu_id", "src_id", "rid"]
-                _id = None
-                for k in possible_keys:
-                    v = node.get(k)
-                    if isinstance(v, str) and any(v.startswith(p) for p in id_prefixes):
-                        _id = v
-                        break
-                if _id:
-                    title = (
-                        node.get("title")
-                        or node.get("product_name")
-                        or node.get("name")
-                        or node.get("resource_title")
-                        or node.get("course_title")
-                    )
-                    results.append({"id": _id, "title": title, "raw": node})
-                # Recurse values
-                for v in node.values():
-                    results.extend(XetCore._walk_collect_entities(v, id_prefixes))
-            elif isinstance(node, list):
-                for it in node:
-                    results.extend(XetCore._walk_collect_entities(it, id_prefixes))
-        except Exception:
-            pass
-        return results
+    def iter_entities(node: Any, id_prefixes: Iterable[str]) -> Iterator[Tuple[str, Optional[str], Dict[str, Any]]]:
+        # Single pass over an explicit stack of iterators: no per-node result lists to copy upwards
+        # and no recursion limit on deep payloads. Yields (id, title, raw) in recursive-walk pre-order.
+        prefixes = tuple(id_prefixes)
+        stack: List[Iterator[Any]] = [iter((node,))]
+        push = stack.append
+        while stack:
+            for cur in stack[-1]:
+                if isinstance(cur, dict):
+                    for k in ENTITY_ID_KEYS:
+                        v = cur.get(k)
+                        if isinstance(v, str) and v.startswith(prefixes):
+                            title = None
+                            for tk in ENTITY_TITLE_KEYS:
+                                title = cur.get(tk)
+                                if title:
+                                    break
+                            yield v, title, cur
+                            break
+                    push(iter(cur.values()))
+                    break
+                if isinstance(cur, list):
+                    push(iter(cur))
+                    break
+            else:
+                stack.pop()
 
     @staticmethod
-    def _unique_by_id(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        best: Dict[str, Dict[str, Any]] = {}
-        for it in items:
-            _id = it.get("id")
-            if not _id:
-                continue
+    def merge_entities(
+        best: Dict[str, Entity],
+        node: Any,
+        id_prefixes: Iterable[str],
+        archive: Optional[RawArchive] = None,
+        on_new: Optional[Callable[[Entity], None]] = None,
+    ) -> int:
+        # Fold entities of one payload into best (id -> Entity, first-seen order), keeping the
+        # non-empty/longer title per id. Returns the number of new ids,
+        # each of which is also passed to on_new.
+        added = 0
+        for _id, title, raw in XetCore.iter_entities(node, id_prefixes):
             cur = best.get(_id)
             if cur is None:
-                best[_id] = it
+                cur = best[_id] = Entity(_id, title)
+                added += 1
+                if on_new is not None:
+                    on_new(cur)
+            elif (not cur.title and title) or (_text_len(title) > _text_len(cur.title)):
+                cur.title = title
+            else:
                 continue
-            cur_title = cur.get("title")
-            new_title = it.get("title")
-            # Prefer the one with a non-empty title, or longer title text
-            def _len(x: Optional[str]) -> int:
-                return len(x) if isinstance(x, str) else 0
-            if (not cur_title and new_title) or (_len(new_title) > _len(cur_title)):
-                best[_id] = it
-        return list(best.values())
+            if archive is not None:
+                archive.add(_id, raw)
+        return added
+
+    @staticmethod
+    def _walk_collect_entities(node: Any, id_prefixes: List[str]) -> List[Entity]:
+        return [Entity(_id, title) for _id, title, _raw in XetCore.iter_entities(node, id_prefixes)]
 
     def _cookie_header_for_domain(self, cookies: List[Dict], domain: str) -> str:
         pairs: List[str] = []
@@ -77,143 +248,446 @@ class XetCore:
                 pairs.append(f"{c['name']}={c['value']}")
         return "; ".join(pairs)
 
-    def login_and_capture(self, resource_url: str, resource_id: Optional[str] = None, wait_seconds: int = 120) -> str:
-        with sync_playwright() as p:
-            context = p.chromium.launch_persistent_context(self.playwright_storage, headless=False)
-            page = context.new_page()
-            candidates: List[Dict[str, Any]] = []
+    def save_cookies(self, cookies: List[Dict], logged_in_at: Optional[float] = None) -> None:
+        # Written via rename, so a reader in another process never sees half a snapshot.
+        # logged_in_at (start of the QR login) is carried over from the previous snapshot unless given.
+        if logged_in_at is None:
+            logged_in_at = self._cookie_snapshot().get("logged_in_at")
+        tmp = f"{self.cookie_file}.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"saved_at": int(time.time()), "logged_in_at": logged_in_at, "cookies": cookies}, f, ensure_ascii=False)  # noqa: E501
+        os.replace(tmp, self.cookie_file)
 
-            def on_response(resp):
-                try:
-                    url = resp.url
-                    ct = resp.headers.get("content-type", "").lower()
-                    if any(x in url for x in [".m3u8", ".mp3", ".m4a", ".aac", ".flac"]) or "audio/" in ct or "mpegurl" in ct or "m3u8" in ct:  # noqa: E501
-                        candidates.append({"type": "response", "from": url, "url": url})
-                    elif "application/json" in ct:
-                        try:
-                            data = resp.json()
-                            for key in ["audio_url", "audioUrl", "play_url", "playUrl", "hls_url", "hlsUrl"]:
-                                if isinstance(data, dict) and key in data and isinstance(data[key], str):
-                                    candidates.append({"type": "json_key", "from": url, "url": data[key]})
-                                    break
-                        except Exception:
-                            pass
-                except Exception:
+    def _cookie_snapshot(self) -> Dict[str, Any]:
+        try:
+            with open(self.cookie_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def load_cookies(self) -> List[Dict]:
+        return self._cookie_snapshot().get("cookies") or []
+
+    def session_expires_at(self) -> Optional[float]:
+        # When the stored login runs out: SESSION_TTL after the QR login, or earlier if the cookies
+        # themselves expire. None when no login was recorded.
+        snap = self._cookie_snapshot()
+        logged_in_at = snap.get("logged_in_at")
+        cookies = snap.get("cookies") or []
+        if not logged_in_at or not cookies:
+            return None
+        expiry = logged_in_at + SESSION_TTL
+        # Session cookies carry expires -1; any with a real expiry bound the login too
+        dated = [c["expires"] for c in cookies if isinstance(c.get("expires"), (int, float)) and c["expires"] > 0]
+        if dated:
+            expiry = min(expiry, max(dated))
+        return expiry
+
+    def probe_session(self, cookies: Optional[List[Dict]] = None) -> Optional[bool]:
+        # One page of a learned listing endpoint with the stored cookies; True when it still returns
+        # entities, None when no endpoint has been learned yet (nothing to check against)
+        cookies = self.load_cookies() if cookies is None else cookies
+        endpoints = load_endpoints(self.api_file)
+        for kind, prefixes in (("products", ["p_"]), ("resources", ["a_", "v_"])):
+            endpoint = endpoints.get(kind)
+            if not endpoint:
+                continue
+            host = urlsplit(endpoint["url"]).hostname or ""
+            best: Dict[str, Entity] = {}
+            with metrics.span("session_probe", kind=kind) as m:
+                for _ in iter_replay(
+                    endpoint,
+                    self._cookie_header_for_domain(cookies, host),
+                    lambda b, data: self.merge_entities(b, data, prefixes),
+                    best,
+                    subject=endpoint.get("subject"),
+                    max_pages=1,
+                    timeout=10.0,
+                ):
                     pass
+                m["ok"] = bool(best)
+            return bool(best)
+        return None
 
-            page.on("response", on_response)
-            try:
-                page.goto(resource_url, wait_until="domcontentloaded", timeout=60000)
-            except Exception:
+    def login_confirmed(self, cookies: List[Dict]) -> bool:
+        # Only a positive signal counts: the probe returns entities (an endpoint learned during the session
+        # means an authenticated listing request answered), or with nothing to probe the login cookie is set
+        ok = self.probe_session(cookies)
+        if ok is None:
+            return any(c.get("name") == LOGIN_COOKIE and c.get("value") for c in cookies)
+        return ok
+
+    def session_valid(self, probe: bool = True) -> bool:
+        # Cheap checks first (recorded login age, cookie expiry), then the probe request; the result is
+        # kept for SESSION_PROBE_TTL so a batch opening many sessions probes once
+        now = time.time()
+        if probe and self._probed is not None and now - self._probed[0] < SESSION_PROBE_TTL:
+            return self._probed[1]
+        expiry = self.session_expires_at()
+        ok = expiry is not None and expiry - now > SESSION_MARGIN
+        if probe:
+            if ok:
+                # A probe that cannot check anything (no endpoint learned yet) is unknown: go headed
+                ok = self.probe_session() is True
+            self._probed = (now, ok)
+        return ok
+
+    def _iter_via_api(
+        self,
+        kind: str,
+        id_prefixes: List[str],
+        subject: Optional[str],
+        best: Dict[str, Entity],
+        archive: Optional[RawArchive] = None,
+    ) -> Iterator[List[Entity]]:
+        # Replay the learned listing endpoint page by page, yielding the entities each page added to best.
+        # best stays empty when there is no endpoint or cookie snapshot, or the replay failed; ReplayFailed
+        # means pages after the first failed and best holds only part of the listing.
+        endpoint = load_endpoints(self.api_file).get(kind)
+        cookies = self.load_cookies()
+        if not endpoint or not cookies:
+            return
+        host = urlsplit(endpoint["url"]).hostname or ""
+        fresh: List[Entity] = []
+        with metrics.span("api_listing", kind=kind) as m:
+            for _ in iter_replay(
+                endpoint,
+                self._cookie_header_for_domain(cookies, host),
+                lambda b, data: self.merge_entities(b, data, id_prefixes, archive, fresh.append),
+                best,
+                subject=subject,
+            ):
+                batch, fresh[:] = fresh[:], []
+                yield batch
+            m["items"] = len(best) if best else None
+        if best:
+            print(f"Listed {len(best)} {kind} via API replay")
+
+    def _list_via_api(
+        self, kind: str, id_prefixes: List[str], subject: Optional[str], archive: Optional[RawArchive] = None
+    ) -> Optional[List[Entity]]:
+        best: Dict[str, Entity] = {}
+        try:
+            for _ in self._iter_via_api(kind, id_prefixes, subject, best, archive):
                 pass
+        except ReplayFailed as e:
+            print(f"{e}; listing in the browser instead")
+            return None
+        return list(best.values()) if best else None
+
+    def capture_session(self, headless: Optional[bool] = None) -> "CaptureSession":
+        # headless=None: self.headless, and when that is None too, decided by session_valid() on start
+        return CaptureSession(self, headless=self.headless if headless is None else headless)
+
+    @contextmanager
+    def _use_session(self, session: Optional["CaptureSession"], headless: Optional[bool]) -> Iterator["CaptureSession"]:
+        # Reuse the caller's long-lived browser, or open a one-shot one for this call
+        if session is not None:
+            yield session
+            return
+        with self.capture_session(headless=headless) as s:
+            yield s
+
+    @staticmethod
+    def is_media_response(url: str, content_type: str) -> bool:
+        ct = content_type.lower()
+        return any(x in url for x in MEDIA_EXTS) or "audio/" in ct or "mpegurl" in ct or "m3u8" in ct
 
-            # Try to trigger media playback/network by simulating user gestures
+    @staticmethod
+    def json_candidate(url: str, data: Any) -> Optional[Dict[str, Any]]:
+        if isinstance(data, dict):
+            for key in MEDIA_JSON_KEYS:
+                if key in data and isinstance(data[key], str):
+                    return {"type": "json_key", "from": url, "url": data[key]}
+        return None
+
+    @staticmethod
+    def should_block(url: str, resource_type: str, candidates: Optional[List[Dict[str, Any]]]) -> bool:
+        host = urlsplit(url).hostname or ""
+        if resource_type in BLOCKED_RESOURCE_TYPES or any(host == h or host.endswith("." + h) for h in TRACKER_HOSTS):
+            return True
+        if candidates is not None and (resource_type == "media" or any(x in url for x in MEDIA_EXTS)):
+            # The URL is all a capture needs; record it and spare the media body
+            if not any(c.get("url") == url for c in candidates):
+                candidates.append({"type": "request", "from": url, "url": url})
+            return True
+        return False
+
+    @staticmethod
+    def _attach_media_listener(page: Any, candidates: List[Dict[str, Any]]) -> None:
+        def on_response(resp):
             try:
-                page.wait_for_timeout(800)
-                # Attempt clicking common play buttons
-                selectors = [
-                    "button:has-text('播放')",
-                    "[aria-label='播放']",
-                    ".play",
-                    ".player-play",
-                    "button",
-                ]
-                for sel in selectors:
+                url = resp.url
+                ct = resp.headers.get("content-type", "").lower()
+                if XetCore.is_media_response(url, ct):
+                    candidates.append({"type": "response", "from": url, "url": url})
+                elif "application/json" in ct:
                     try:
-                        loc = page.locator(sel)
-                        if loc.count() > 0:
-                            loc.first.click(timeout=1000)
-                            page.wait_for_timeout(300)
-                            break
+                        found = XetCore.json_candidate(url, resp.json())
+                        if found:
+                            candidates.append(found)
                     except Exception:
-                        continue
-                # Directly call HTMLMediaElement.play() on first audio/video
-                try:
-                    page.evaluate(
-                        """
-                        () => {
-                          const media = document.querySelector('audio, video');
-                          if (media) {
-                            media.muted = false;
-                            const p = media.play();
-                            if (p && p.catch) p.catch(() => {});
-                          }
-                        }
-                        """
-                    )
-                except Exception:
-                    pass
+                        pass
             except Exception:
                 pass
 
-            start = time.time()
-            while time.time() - start < wait_seconds:
-                time.sleep(2)
-                if candidates:
-                    break
+        page.on("response", on_response)
+
+    @staticmethod
+    def _install_asset_filter(page: Any, candidates: Optional[List[Dict[str, Any]]] = None) -> None:
+        def handle(route):
+            try:
+                req = route.request
+                if XetCore.should_block(req.url, req.resource_type, candidates):
+                    route.abort()
+                else:
+                    route.continue_()
+            except Exception:
                 try:
-                    page.mouse.wheel(0, 800)
+                    route.continue_()
                 except Exception:
                     pass
 
-            cookies = context.cookies()
-            domain = re.sub(r"^https?://([^/]+).*$", r"\1", resource_url)
-            cookie_header = self._cookie_header_for_domain(cookies, domain)
-            headers = {
-                "User-Agent": (
-                    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/127.0.0.0 Safari/537.36"
-                ),
-                "Accept": "*/*",
-                "Referer": resource_url,
-                "Origin": re.sub(r"^(https?://[^/]+).*$", r"\\1", resource_url),
-                "Cookie": cookie_header,
-            }
-
-            rid = resource_id or re.sub(r"^.*?/([av]_\w+).*?$", r"\1", resource_url)
-            outfile = os.path.join(self.capture_dir, f"{rid or 'unknown_resource'}.json")
-            payload = {
-                "appid": self.appid,
-                "resource_id": rid,
-                "page_url": resource_url,
-                "headers": headers,
-                "cookies": cookies,
-                "candidates": candidates,
-                "captured_at": int(time.time()),
-            }
-            with open(outfile, "w", encoding="utf-8") as f:
-                json.dump(payload, f, ensure_ascii=False, indent=2)
+        page.route("**/*", handle)
+
+    @staticmethod
+    def _trigger_playback(page: Any) -> None:
+        # Try to trigger media playback/network by simulating user gestures
+        try:
+            page.wait_for_timeout(800)
+            # Attempt clicking common play buttons
+            for sel in PLAY_SELECTORS:
+                try:
+                    loc = page.locator(sel)
+                    if loc.count() > 0:
+                        loc.first.click(timeout=1000)
+                        page.wait_for_timeout(300)
+                        break
+                except Exception:
+                    continue
+            # Directly call HTMLMediaElement.play() on first audio/video
             try:
-                context.close()
+                page.evaluate(PLAY_MEDIA_JS)
             except Exception:
                 pass
+        except Exception:
+            pass
+
+    def _save_capture(self, context: Any, resource_url: str, resource_id: Optional[str], candidates: List[Dict[str, Any]]) -> str:  # noqa: E501
+        with metrics.span("cookies"):
+            cookies = context.cookies()
+        return self.write_capture(resource_url, resource_id, candidates, cookies)
+
+    def write_capture(self, resource_url: str, resource_id: Optional[str], candidates: List[Dict[str, Any]], cookies: List[Dict]) -> str:  # noqa: E501
+        domain = re.sub(r"^https?://([^/]+).*$", r"\1", resource_url)
+        cookie_header = self._cookie_header_for_domain(cookies, domain)
+        headers = {
+            "User-Agent": (
+                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                "AppleWebKit/537.36 (KHTML, like Gecko) "
+                "Chrome/127.0.0.0 Safari/537.36"
+            ),
+            "Accept": "*/*",
+            "Referer": resource_url,
+            "Origin": re.sub(r"^(https?://[^/]+).*$", r"\\1", resource_url),
+            "Cookie": cookie_header,
+        }
+
+        rid = resource_id or self.resource_id_from_url(resource_url)
+        outfile = self.capture_path(rid)
+        payload = {
+            "appid": self.appid,
+            "resource_id": rid,
+            "page_url": resource_url,
+            "headers": headers,
+            "cookies": cookies,
+            "candidates": candidates,
+            "captured_at": int(time.time()),
+        }
+        with open(outfile, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        return outfile
+
+    @staticmethod
+    def resource_id_from_url(resource_url: str) -> str:
+        return re.sub(r"^.*?/([av]_\w+).*?$", r"\1", resource_url)
+
+    def capture_path(self, resource_id: Optional[str]) -> str:
+        return os.path.join(self.capture_dir, f"{resource_id or 'unknown_resource'}.json")
+
+    def cached_capture(self, resource_id: str, max_age: int = CAPTURE_TTL, probe: bool = True) -> Optional[str]:
+        # A stored capture is reused while it is young enough, its signed URL has not expired,
+        # and (optionally) the URL still answers a one-byte ranged GET
+        path = self.capture_path(resource_id)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except Exception:
+            return None
+        url = self.pick_best_candidate(payload.get("candidates", []))
+        now = time.time()
+        if not url or now - payload.get("captured_at", 0) > max_age:
+            return None
+        expiry = signed_url_expiry(url)
+        if expiry is not None and expiry - now < CAPTURE_EXPIRY_MARGIN:
+            return None
+        if probe and not url_is_alive(url, self.download_headers(payload)):
+            return None
+        return path
+
+    def capture_or_reuse(
+        self,
+        resource_url: str,
+        resource_id: Optional[str] = None,
+        wait_seconds: int = 120,
+        session: Optional["CaptureSession"] = None,
+        max_age: int = CAPTURE_TTL,
+    ) -> str:
+        rid = resource_id or self.resource_id_from_url(resource_url)
+        cached = self.cached_capture(rid, max_age) if rid else None
+        if cached:
+            print(f"Reusing capture: {cached}")
+            return cached
+        return self.login_and_capture(resource_url, resource_id, wait_seconds, session=session)
+
+    def login_and_capture(
+        self,
+        resource_url: str,
+        resource_id: Optional[str] = None,
+        wait_seconds: int = 120,
+        session: Optional["CaptureSession"] = None,
+    ) -> str:
+        for _, _, outfile in self.capture_many([(resource_url, resource_id)], wait_seconds, session=session, max_tabs=1):
             return outfile
+        raise RuntimeError(f"Capture did not complete: {resource_url}")
+
+    def capture_many(
+        self,
+        jobs: Iterable[Optional[Tuple[str, Optional[str]]]],
+        wait_seconds: int = 120,
+        session: Optional["CaptureSession"] = None,
+        max_tabs: Optional[int] = None,
+        open_interval: Optional[Callable[[], float]] = None,
+        poll: Optional[Callable[[], None]] = None,
+    ) -> Iterator[Tuple[str, Optional[str], str]]:
+        # Capture (resource_url, resource_id) jobs through up to max_tabs pages of one browser,
+        # yielding (resource_url, resource_id, capture_json_path) as each page finishes.
+        # open_interval returns the pause before the next page may be opened (keeps other tabs pumping).
+        # jobs may yield None while more are still coming (e.g. from a listing that is still loading);
+        # poll is called once per round so such a producer keeps going while every tab is busy.
+        limit = max(1, max_tabs or self.max_tabs)
+        with self._use_session(session, headless=None) as s:
+            pending = iter(jobs)
+            exhausted = False
+            active: List[Dict[str, Any]] = []
+            next_open = 0.0
+            try:
+                while active or not exhausted:
+                    if poll is not None:
+                        poll()
+                    while not exhausted and len(active) < limit:
+                        if time.time() < next_open:
+                            break
+                        try:
+                            job = next(pending)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        if job is None:
+                            break
+                        resource_url, resource_id = job
+                        opened = time.time()
+                        page = s.new_page()
+                        candidates: List[Dict[str, Any]] = []
+                        # Each tab gets its own listener, so responses land on the right resource
+                        self._attach_media_listener(page, candidates)
+                        if self.block_assets:
+                            self._install_asset_filter(page, candidates)
+                        with metrics.span("page_goto", rid=resource_id):
+                            try:
+                                page.goto(resource_url, wait_until="domcontentloaded", timeout=60000)
+                            except Exception:
+                                pass
+                        self._trigger_playback(page)
+                        now = time.time()
+                        if open_interval is not None:
+                            next_open = now + max(0.0, open_interval())
+                        active.append({
+                            "page": page,
+                            "url": resource_url,
+                            "rid": resource_id,
+                            "candidates": candidates,
+                            "opened": opened,
+                            "started": now,
+                            "scrolled": now,
+                        })
+                    if not active:
+                        if exhausted:
+                            break
+                        time.sleep(max(0.0, min(0.5, next_open - time.time())))
+                        continue
+
+                    # Wake on the next response from any tab (handlers fill each tab's candidates),
+                    # or when the nearest scroll/deadline is due
+                    if not any(t["candidates"] for t in active):
+                        due = min(min(t["scrolled"] + 2, t["started"] + wait_seconds) for t in active)
+                        if not exhausted and len(active) < limit:
+                            due = min(due, next_open)
+                        self._pump(s.context, min(2.0, max(0.05, due - time.time())))
+
+                    now = time.time()
+                    for tab in list(active):
+                        if tab["candidates"] or now - tab["started"] >= wait_seconds:
+                            active.remove(tab)
+                            # Page open to first media candidate (or to the timeout when none showed up)
+                            metrics.record("first_candidate", now - tab["opened"], rid=tab["rid"], found=bool(tab["candidates"]))  # noqa: E501
+                            outfile = self._save_capture(s.context, tab["url"], tab["rid"], tab["candidates"])
+                            try:
+                                tab["page"].close()
+                            except Exception:
+                                pass
+                            yield tab["url"], tab["rid"], outfile
+                        elif now - tab["scrolled"] >= 2:
+                            tab["scrolled"] = now
+                            try:
+                                tab["page"].mouse.wheel(0, 800)
+                            except Exception:
+                                pass
+            finally:
+                for tab in active:
+                    try:
+                        tab["page"].close()
+                    except Exception:
+                        pass
 
     @staticmethod
     def pick_best_candidate(candidates: List[Dict[str, Any]]) -> Optional[str]:
         if not candidates:
             return None
-        priority = [".m3u8", ".m4a", ".mp3", ".aac", ".flac"]
-        for ext in priority:
+        for ext in MEDIA_EXTS:
             for c in candidates:
                 url = c.get("url")
                 if isinstance(url, str) and ext in url:
                     return url
         return candidates[0].get("url")
 
+    @staticmethod
+    def download_headers(payload: Dict[str, Any]) -> Dict[str, str]:
+        return {k: v for k, v in payload.get("headers", {}).items() if k in ["User-Agent", "Accept", "Referer", "Origin", "Cookie"]}  # noqa: E501
+
     @staticmethod
     def sanitize_filename(name: str) -> str:
         safe = re.sub(r"[\\/:*?\"<>|]", "_", name).strip()
         return safe or "audio"
 
-    def download_from_capture(self, capture_json_path: str, title: Optional[str] = None) -> Optional[str]:
+    def plan_download(self, capture_json_path: str, title: Optional[str] = None) -> Optional[Tuple[str, Dict[str, str], str, bool]]:  # noqa: E501
+        # (url, headers, outfile, is_hls) for a capture file, or None when there is nothing to fetch
         if not os.path.exists(capture_json_path):
             print(f"Capture file not found: {capture_json_path}")
             return None
         with open(capture_json_path, "r", encoding="utf-8") as f:
             payload = json.load(f)
-        headers = {k: v for k, v in payload.get("headers", {}).items() if k in ["User-Agent", "Accept", "Referer", "Origin", "Cookie"]}  # noqa: E501
+        headers = self.download_headers(payload)
         url = self.pick_best_candidate(payload.get("candidates", []))
         if not url:
             print("No audio candidate found.")
@@ -222,124 +696,304 @@ class XetCore:
         base_name = self.sanitize_filename(title or rid)
         suffix = url.split("?")[0].split("#")[0].split("/")[-1]
         ext = suffix.split(".")[-1] if "." in suffix else "mp3"
-        outfile = os.path.join(self.download_dir, f"{base_name}.{ext}")
-        with requests.get(url, headers=headers, stream=True) as r:
-            r.raise_for_status()
-            with open(outfile + ".tmp", "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-        os.replace(outfile + ".tmp", outfile)
-        return outfile
+        if ext.lower() == "m3u8":
+            # Fetch the media segments rather than saving the playlist text
+            return url, headers, os.path.join(self.download_dir, f"{base_name}.ts"), True
+        return url, headers, os.path.join(self.download_dir, f"{base_name}.{ext}"), False
 
-    def capture_products(self, entry_url: str, wait_seconds: int = 120, headless: bool = True) -> List[Dict[str, Any]]:
-        with sync_playwright() as p:
-            context = p.chromium.launch_persistent_context(self.playwright_storage, headless=headless)
-            page = context.new_page()
-            products: List[Dict[str, Any]] = []
+    def download_from_capture(
+        self,
+        capture_json_path: str,
+        title: Optional[str] = None,
+        recapture: Optional[Callable[[str], str]] = None,
+    ) -> Optional[str]:
+        # When the signed URL is rejected partway, recapture(capture_json_path) -> fresh capture path
+        # (default: self.recapture) and the download resumes from its journal with the new URL
+        attempt = 0
+        while True:
+            plan = self.plan_download(capture_json_path, title)
+            if plan is None:
+                return None
+            url, headers, outfile, is_hls = plan
+            before = journal_bytes(outfile, url)
+            try:
+                with metrics.span("download", file=os.path.basename(outfile), hls=is_hls) as m:
+                    if self.store is not None:
+                        out = self._download_via_store(url, headers, outfile, is_hls)
+                    elif is_hls:
+                        out = download_hls(url, headers, outfile, postprocessor=self.postprocessor)
+                    else:
+                        out = download_file(url, headers, outfile, connections=self.connections)
+                    m["bytes"] = os.path.getsize(out)
+                return out
+            except SignedUrlExpired as e:
+                # A URL that expired after more bytes landed is just a long download; only stalls count
+                attempt = 1 if journal_bytes(outfile, url) > before else attempt + 1
+                if attempt > RECAPTURE_ATTEMPTS:
+                    raise
+                print(f"{e}; capturing {os.path.basename(outfile)} again to resume")
+                with metrics.span("recapture", file=os.path.basename(outfile), status=e.status):
+                    capture_json_path = (recapture or self.recapture)(capture_json_path)
+
+    def recapture(self, capture_json_path: str, wait_seconds: int = 120, session: Optional["CaptureSession"] = None) -> str:  # noqa: E501
+        # Capture the page behind a stored capture again, for a freshly signed media URL
+        with open(capture_json_path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        return self.login_and_capture(payload["page_url"], payload.get("resource_id"), wait_seconds, session=session)
+
+    def _download_via_store(self, url: str, headers: Dict[str, str], outfile: str, is_hls: bool) -> str:
+        store = self.store
+        post = self.postprocessor if is_hls else None
+        if post is not None:
+            # ffmpeg's mp4/m4a differs from the .ts and per mode: keyed by mode, linked under its own name
+            keys = [f"{url_store_key(url)}#{post.mode}"]
+            dest = target_path(outfile, post.mode)
+        else:
+            keys = [url_store_key(url)]
+            dest = outfile
+        sha = store.lookup(keys[0])
+        if sha and store.materialize(sha, dest):
+            print(f"Linked from store (same URL): {os.path.basename(dest)}")
+            return dest
+        hasher = OrderedHasher()
+        if is_hls:
+            if post is not None:
+                # ffmpeg writes the output itself, so its bytes never pass through a hasher
+                out = download_hls(url, headers, outfile, postprocessor=post)
+                return store.add(out, file_sha256(out), keys)
+            out = download_hls(url, headers, outfile, hasher=hasher)
+            return store.add(out, hasher.digest, keys)
+
+        def precheck(etag: Optional[str], size: Optional[int]) -> bool:
+            key = etag_store_key(url, etag, size)
+            keys.append(key)
+            sha = store.lookup(key)
+            if sha and store.materialize(sha, outfile, keys):
+                print(f"Linked from store (same ETag): {os.path.basename(outfile)}")
+                return True
+            return False
+
+        out = download_file(url, headers, outfile, connections=self.connections, hasher=hasher, precheck=precheck)
+        if hasher.digest is None:
+            return out
+        return store.add(out, hasher.digest, keys)
+
+    @staticmethod
+    def _pump(target: Any, timeout: float) -> None:
+        # Block until the next network response of a page/context, or the timeout; event handlers
+        # only run while Playwright has control, so this is what lets captures react immediately.
+        try:
+            target.wait_for_event("response", timeout=max(1, int(timeout * 1000)))
+        except PlaywrightTimeoutError:
+            pass
+        except Exception:
+            time.sleep(min(timeout, 0.2))
+
+    def _iter_listing(
+        self,
+        url: str,
+        id_prefixes: List[str],
+        wait_seconds: int,
+        idle_seconds: float,
+        headless: bool,
+        session: Optional["CaptureSession"],
+        scroll_px: int,
+        api_kind: str,
+        api_subject: Optional[str],
+        archive: Optional[RawArchive],
+        best: Dict[str, Entity],
+        pump_seconds: float = 1.0,
+    ) -> Iterator[List[Entity]]:
+        # Open the listing page and keep scrolling so paginated listings load, yielding the entities added
+        # to best after every pump of at most pump_seconds (an empty list when nothing new came in).
+        # Only time spent inside the generator counts towards wait_seconds/idle_seconds, so a caller that
+        # drives other tabs of the same browser between steps does not cut the listing short.
+        with self._use_session(session, headless=headless) as s:
+            page = s.new_page()
+            fresh: List[Entity] = []
+            learned: List[bool] = []
 
             def on_response(resp):
                 try:
                     ct = resp.headers.get("content-type", "").lower()
                     if "application/json" in ct:
-                        data = resp.json()
-                        found = self._walk_collect_entities(data, ["p_"])
-                        if found:
-                            products.extend(found)
+                        if self.merge_entities(best, resp.json(), id_prefixes, archive, fresh.append) and not learned:
+                            learned.append(True)
+                            record_endpoint(self.api_file, api_kind, resp.request, api_subject)
                 except Exception:
                     pass
 
             page.on("response", on_response)
+            if self.block_assets:
+                self._install_asset_filter(page)
+            start = time.time()
             try:
-                page.goto(entry_url, wait_until="domcontentloaded", timeout=60000)
-            except Exception:
-                pass
+                with metrics.span("page_goto", url=url):
+                    try:
+                        page.goto(url, wait_until="domcontentloaded", timeout=60000)
+                    except Exception:
+                        pass
 
-            start = time.time()
-            while time.time() - start < wait_seconds:
-                time.sleep(2)
-                if products:
-                    break
+                # Finish once no new ids arrived for idle_seconds
+                spent = quiet = 0.0
+                last_scroll = -1.0
+                while spent < wait_seconds and not (best and quiet >= idle_seconds):
+                    if spent - last_scroll >= 1.0:
+                        last_scroll = spent
+                        try:
+                            page.mouse.wheel(0, scroll_px)
+                        except Exception:
+                            pass
+                    t0 = time.time()
+                    self._pump(page, min(pump_seconds, wait_seconds - spent))
+                    step = time.time() - t0
+                    spent += step
+                    # Responses may also have arrived while the caller was pumping other tabs
+                    batch, fresh[:] = fresh[:], []
+                    quiet = 0.0 if batch else quiet + step
+                    yield batch
+            finally:
+                metrics.record("listing", time.time() - start, kind=api_kind, items=len(best))
                 try:
-                    page.mouse.wheel(0, 1000)
+                    page.close()
                 except Exception:
                     pass
 
-            products = self._unique_by_id(products)
-            out = {
-                "appid": self.appid,
-                "entry_url": entry_url,
-                "products": products,
-                "captured_at": int(time.time()),
-            }
-            os.makedirs(self.capture_dir, exist_ok=True)
-            outfile = os.path.join(self.capture_dir, "products.json")
-            with open(outfile, "w", encoding="utf-8") as f:
-                json.dump(out, f, ensure_ascii=False, indent=2)
-            try:
-                context.close()
-            except Exception:
-                pass
-            return products
+    def _capture_listing(
+        self,
+        url: str,
+        id_prefixes: List[str],
+        wait_seconds: int,
+        idle_seconds: float,
+        headless: bool,
+        session: Optional["CaptureSession"],
+        scroll_px: int,
+        api_kind: str,
+        api_subject: Optional[str] = None,
+        archive: Optional[RawArchive] = None,
+    ) -> List[Entity]:
+        best: Dict[str, Entity] = {}
+        for _ in self._iter_listing(
+            url, id_prefixes, wait_seconds, idle_seconds, headless, session, scroll_px, api_kind, api_subject,
+            archive, best,
+        ):
+            pass
+        return list(best.values())
 
-    def capture_resources(self, product_url: str, product_id: Optional[str] = None, wait_seconds: int = 120, headless: bool = True) -> List[Dict[str, Any]]:
-        with sync_playwright() as p:
-            context = p.chromium.launch_persistent_context(self.playwright_storage, headless=headless)
-            page = context.new_page()
-            resources: List[Dict[str, Any]] = []
+    def _raw_archive(self, name: str) -> Any:
+        # RawArchive context for one listing when keep_raw is set, otherwise a no-op context yielding None
+        if not self.keep_raw:
+            return nullcontext()
+        return RawArchive(os.path.join(self.capture_dir, "raw", f"{name}.ndjson"))
 
-            def on_response(resp):
-                try:
-                    ct = resp.headers.get("content-type", "").lower()
-                    if "application/json" in ct:
-                        data = resp.json()
-                        found = self._walk_collect_entities(data, ["a_", "v_"])
-                        if found:
-                            resources.extend(found)
-                except Exception:
-                    pass
+    def capture_products(
+        self,
+        entry_url: str,
+        wait_seconds: int = 120,
+        headless: bool = True,
+        session: Optional["CaptureSession"] = None,
+        idle_seconds: float = 5.0,
+        use_api: bool = True,
+    ) -> List[Entity]:
+        with self._raw_archive("products") as archive:
+            products = self._list_via_api("products", ["p_"], None, archive) if use_api else None
+            if products is None:
+                products = self._capture_listing(
+                    entry_url, ["p_"], wait_seconds, idle_seconds, headless, session, 1000, "products", None, archive
+                )
+        self.write_products(entry_url, products)
+        return products
 
-            page.on("response", on_response)
-            try:
-                page.goto(product_url, wait_until="domcontentloaded", timeout=60000)
-            except Exception:
-                pass
+    def products_file(self) -> str:
+        return os.path.join(self.capture_dir, "products.ndjson")
 
-            start = time.time()
-            while time.time() - start < wait_seconds:
-                time.sleep(2)
-                if resources:
-                    break
+    def write_products(self, entry_url: str, products: Iterable[Any]) -> str:
+        meta = {"appid": self.appid, "entry_url": entry_url, "captured_at": int(time.time())}
+        outfile = self.products_file()
+        write_listing(outfile, meta, products)
+        return outfile
+
+    def capture_resources(
+        self,
+        product_url: str,
+        product_id: Optional[str] = None,
+        wait_seconds: int = 120,
+        headless: bool = True,
+        session: Optional["CaptureSession"] = None,
+        idle_seconds: float = 5.0,
+        use_api: bool = True,
+        on_resource: Optional[Callable[[Entity], None]] = None,
+    ) -> List[Entity]:
+        # on_resource(entity) is called for each new resource as soon as its listing response is merged
+        resources: List[Entity] = []
+        for item in self.iter_resources(product_url, product_id, wait_seconds, headless, session, idle_seconds, use_api):  # noqa: E501
+            if item is None:
+                continue
+            resources.append(item)
+            if on_resource is not None:
+                on_resource(item)
+        return resources
+
+    def iter_resources(
+        self,
+        product_url: str,
+        product_id: Optional[str] = None,
+        wait_seconds: int = 120,
+        headless: bool = True,
+        session: Optional["CaptureSession"] = None,
+        idle_seconds: float = 5.0,
+        use_api: bool = True,
+        pump_seconds: float = 1.0,
+    ) -> Iterator[Optional[Entity]]:
+        # Generator form of capture_resources: yields each new resource (in listing order) while the
+        # listing is still loading, and None after a pump of at most pump_seconds that brought nothing,
+        # so a caller can capture pages in the same browser between steps. Titles of yielded entities may
+        # still be improved in place by later responses. The listing file is written once it finishes.
+        pid = self.product_id_from_url(product_url, product_id)
+        best: Dict[str, Entity] = {}
+        with self._raw_archive(f"{pid or 'unknown_product'}_resources") as archive:
+            # The learned endpoint is keyed by product id, so replaying it for another column needs one
+            complete = False
+            if use_api and pid:
                 try:
-                    page.mouse.wheel(0, 1200)
-                except Exception:
-                    pass
+                    for batch in self._iter_via_api("resources", ["a_", "v_"], pid, best, archive):
+                        yield from batch
+                    complete = bool(best)
+                except ReplayFailed as e:
+                    # Resources already yielded stay in best; the browser listing only adds the rest
+                    print(f"{e}; finishing the listing in the browser")
+            if not complete:
+                for batch in self._iter_listing(
+                    product_url, ["a_", "v_"], wait_seconds, idle_seconds, headless, session, 1200, "resources", pid,
+                    archive, best, pump_seconds,
+                ):
+                    if batch:
+                        yield from batch
+                    else:
+                        yield None
+        self.write_resources(product_url, pid, best.values())
 
-            resources = self._unique_by_id(resources)
-            # try to infer product_id
-            pid = product_id
-            if not pid:
-                m = re.search(r"product_id=([pA-Za-z0-9_]+)", product_url)
-                if m:
-                    pid = m.group(1)
-
-            out = {
-                "appid": self.appid,
-                "product_id": pid,
-                "product_url": product_url,
-                "resources": resources,
-                "captured_at": int(time.time()),
-            }
-            os.makedirs(self.capture_dir, exist_ok=True)
-            key = pid or "unknown_product"
-            outfile = os.path.join(self.capture_dir, f"{key}_resources.json")
-            with open(outfile, "w", encoding="utf-8") as f:
-                json.dump(out, f, ensure_ascii=False, indent=2)
-            try:
-                context.close()
-            except Exception:
-                pass
-            return resources
+    @staticmethod
+    def product_id_from_url(product_url: str, product_id: Optional[str] = None) -> Optional[str]:
+        # try to infer product_id
+        if product_id:
+            return product_id
+        m = re.search(r"product_id=([pA-Za-z0-9_]+)", product_url)
+        return m.group(1) if m else None
+
+    def resources_file(self, pid: Optional[str]) -> str:
+        return os.path.join(self.capture_dir, f"{pid or 'unknown_product'}_resources.ndjson")
+
+    def write_resources(self, product_url: str, pid: Optional[str], resources: Iterable[Any]) -> str:
+        meta = {"appid": self.appid, "product_id": pid, "product_url": product_url, "captured_at": int(time.time())}
+        outfile = self.resources_file(pid)
+        write_listing(outfile, meta, resources)
+        return outfile
+
+    @staticmethod
+    def build_product_page_url(appid: str, product_id: str) -> str:
+        # Observed pattern: details?{product_id}
+        return f"https://{appid}.xet.citv.cn/p/column/details?{product_id}"
 
     @staticmethod
     def build_resource_page_url(appid: str, resource_id: str, product_id: Optional[str] = None) -> str:
@@ -350,3 +1004,73 @@ class XetCore:
         return base
 
 
+class CaptureSession:
+    # One persistent Chromium context kept open across many captures of a shop:
+    #   with core.capture_session() as s: core.login_and_capture(url, rid, session=s)
+    # headless=None picks the mode on start: headless while the stored login is valid, otherwise a
+    # visible browser for the QR login, whose start time is recorded once the login checks out.
+
+    def __init__(self, core: XetCore, headless: Optional[bool] = None) -> None:
+        self.core = core
+        self.headless = headless
+        self._playwright: Any = None
+        self.context: Any = None
+        self._login_started: Optional[float] = None
+
+    def __enter__(self) -> "CaptureSession":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def start(self) -> None:
+        if self.context is not None:
+            return
+        if self.headless is None:
+            self.headless = self.core.session_valid()
+            if self.headless:
+                print("Stored login is valid, capturing headless")
+            else:
+                print("Login expired or unknown, opening the browser for a QR login")
+        if not self.headless and not self.core.session_valid(probe=False):
+            self._login_started = time.time()
+        self._playwright = sync_playwright().start()
+        try:
+            with metrics.span("browser_launch", appid=self.core.appid, headless=self.headless):
+                self.context = self._playwright.chromium.launch_persistent_context(
+                    self.core.playwright_storage, headless=self.headless
+                )
+        except Exception:
+            self._playwright.stop()
+            self._playwright = None
+            raise
+
+    def new_page(self) -> Any:
+        self.start()
+        return self.context.new_page()
+
+    def close(self) -> None:
+        try:
+            if self.context is not None:
+                cookies = self.context.cookies()
+                logged_in_at = None
+                # A visible session that began without a valid login: stamp the login if the new cookies work
+                if self._login_started is not None and self.core.login_confirmed(cookies):
+                    logged_in_at = self._login_started
+                    self.core._probed = None
+                self.core.save_cookies(cookies, logged_in_at)
+        except Exception:
+            pass
+        try:
+            if self.context is not None:
+                self.context.close()
+        except Exception:
+            pass
+        try:
+            if self._playwright is not None:
+                self._playwright.stop()
+        except Exception:
+            pass
+        self.context = None
+        self._playwright = None
@@ -4,7 +4,7 @@ import os
 import re
 from typing import Any, Dict, List, Optional
 
-import requests
+from xet_http import get_session
 
 
 def pick_best_candidate(candidates: List[Dict[str, Any]]) -> Optional[str]:
@@ -59,7 +59,7 @@ def download_audio(capture_json_path: str, title: Optional[str] = None, out_dir:
     os.makedirs(out_dir, exist_ok=True)
     outfile = os.path.join(out_dir, f"{base_name}.{ext}")
 
-    with requests.get(url, headers=headers, stream=True) as r:
+    with get_session().get(url, headers=headers, stream=True, timeout=30) as r:
         r.raise_for_status()
         with open(outfile + ".tmp", "wb") as f:
             for chunk in r.iter_content(chunk_size=8192):
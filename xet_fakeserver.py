@@ -0,0 +1,431 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+try:
+    from Crypto.Cipher import AES  # pycryptodome, only needed for encrypted HLS fixtures
+except ImportError:
+    AES = None
+
+
+# Offline stand-in for a Xiaoet shop: shop/column/lesson pages whose scripts call JSON listing and
+# lesson APIs shaped like the real ones, plus mp3 (with Range) and HLS media. Latency, per-connection
+# bandwidth and error injection are configurable, so captures and downloads can be benchmarked locally:
+#
+#   with FakeXet(lessons=40, latency=0.05) as srv:
+#       core.capture_resources(srv.column_url(pid), pid, ...)
+
+COOKIE_NAME = "ko_token"
+HLS_KEY = bytes(range(16))
+_PATTERN = hashlib.sha256(b"xet-fake-media").digest() * 2048  # 64KB repeating body pattern
+
+SHOP_HTML = """<!doctype html><html><head><meta charset="utf-8"><title>Fake shop</title></head>
+<body><h1>Fake shop</h1><ul id="list"></ul><script>
+fetch('/api/products?page=1&page_size=50').then(r => r.json()).then(j => {
+  for (const p of j.data.list) {
+    const li = document.createElement('li');
+    li.innerHTML = '<a href="/p/column/details?' + p.spu_id + '">' + p.product_name + '</a>';
+    document.getElementById('list').appendChild(li);
+  }
+});
+</script></body></html>"""
+
+COLUMN_HTML = """<!doctype html><html><head><meta charset="utf-8"><title>Column</title></head>
+<body style="min-height: 100000px"><ul id="list"></ul><script>
+const PID = location.search.slice(1).split('&')[0];
+let page = 1, busy = false, done = false;
+async function more() {
+  if (busy || done) return;
+  busy = true;
+  const r = await fetch('/api/resources?product_id=' + PID + '&page=' + page + '&page_size=__PAGE_SIZE__');
+  const j = await r.json();
+  if (!j.data.list.length) done = true;
+  for (const it of j.data.list) {
+    const li = document.createElement('li');
+    li.textContent = it.resource_title;
+    document.getElementById('list').appendChild(li);
+  }
+  page += 1;
+  busy = false;
+}
+more();
+window.addEventListener('scroll', more);
+window.addEventListener('wheel', more);
+</script></body></html>"""
+
+LESSON_HTML = """<!doctype html><html><head><meta charset="utf-8"><title>Lesson</title></head>
+<body><button class="play">播放</button><audio controls></audio><script>
+document.querySelector('.play').addEventListener('click', async () => {
+  const r = await fetch('/api/lesson?resource_id=__RID__');
+  const j = await r.json();
+  const a = document.querySelector('audio');
+  a.src = j.audio_url || j.hls_url;
+  a.play().catch(() => {});
+});
+</script></body></html>"""
+
+
+class FakeXet:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        columns: int = 3,
+        lessons: int = 40,
+        page_size: int = 10,
+        media_size: int = 2 * 1024 * 1024,
+        hls_every: int = 0,
+        hls_segments: int = 20,
+        segment_size: int = 64 * 1024,
+        hls_encrypt: bool = False,
+        latency: float = 0.0,
+        bandwidth: int = 0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        throttle_status: int = 429,
+        drop_rate: float = 0.0,
+        require_cookie: bool = True,
+        url_ttl: int = 3600,
+        seed: int = 0,
+    ) -> None:
+        self.appid = "appfakeshop"
+        self.columns = columns
+        self.lessons = lessons
+        self.page_size = max(1, page_size)
+        self.media_size = media_size
+        # Every n-th lesson is a video served as HLS (0: all lessons are mp3)
+        self.hls_every = hls_every
+        self.hls_segments = hls_segments
+        self.segment_size = segment_size
+        if hls_encrypt and AES is None:
+            raise RuntimeError("Encrypted HLS fixtures require pycryptodome (pip3 install pycryptodome)")
+        self.hls_encrypt = hls_encrypt
+        # Seconds before every response, and bytes/s per connection for media bodies (0: unlimited)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        # Media requests: fraction answered 503, answered 429, or cut off halfway through the body
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        # Some CDNs push back with a 403 (on a URL that is still valid) instead of a 429
+        self.throttle_status = throttle_status
+        self.drop_rate = drop_rate
+        self.require_cookie = require_cookie
+        # Seconds a signed media URL is accepted; past its t= expiry the CDN answers 403
+        self.url_ttl = url_ttl
+        self._rnd = random.Random(seed)
+        self._rnd_lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self  # type: ignore[attr-defined]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeXet":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeXet":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    # Catalogue ---------------------------------------------------------------
+    def product_ids(self) -> List[str]:
+        return [f"p_fake{i:04d}" for i in range(self.columns)]
+
+    def resource_ids(self, product_id: str) -> List[str]:
+        col = product_id[-4:]
+        out = []
+        for i in range(self.lessons):
+            kind = "v" if self.hls_every and i % self.hls_every == self.hls_every - 1 else "a"
+            out.append(f"{kind}_{col}{i:06d}")
+        return out
+
+    def is_hls(self, resource_id: str) -> bool:
+        return resource_id.startswith("v_")
+
+    # URLs, mirroring XetCore.build_*_page_url --------------------------------
+    def shop_url(self) -> str:
+        return self.base_url + "/"
+
+    def column_url(self, product_id: str) -> str:
+        return f"{self.base_url}/p/column/details?{product_id}"
+
+    def lesson_url(self, resource_id: str, product_id: Optional[str] = None) -> str:
+        kind = "audio" if resource_id.startswith("a_") else "video"
+        url = f"{self.base_url}/p/course/{kind}/{resource_id}"
+        return url + (f"?anonymous=2&product_id={product_id}" if product_id else "")
+
+    def media_url(self, resource_id: str) -> str:
+        ext = "m3u8" if self.is_hls(resource_id) else "mp3"
+        # Signed like the real CDN, with a hex expiry url_ttl seconds out
+        return f"{self.base_url}/media/{resource_id}.{ext}?sign=fake&t={int(time.time()) + self.url_ttl:x}"
+
+    def cookies(self) -> List[Dict[str, Any]]:
+        host = urlsplit(self.base_url).hostname
+        return [{"name": COOKIE_NAME, "value": "fake-session", "domain": host, "path": "/"}]
+
+    # Media -------------------------------------------------------------------
+    def media_total(self, resource_id: str) -> int:
+        return self.hls_segments * self.segment_size if self.is_hls(resource_id) else self.media_size
+
+    def media_slice(self, resource_id: str, start: int, end: int) -> bytes:
+        # Deterministic content: a fixed pattern shifted per resource, so any range can be produced
+        shift = int(hashlib.md5(resource_id.encode()).hexdigest()[:4], 16)
+        n = len(_PATTERN) // 2
+        out = bytearray()
+        pos = start
+        while pos <= end:
+            i = (pos + shift) % n
+            take = min(end + 1 - pos, n - i)
+            out += _PATTERN[i:i + take]
+            pos += take
+        return bytes(out)
+
+    def media_bytes(self, resource_id: str) -> bytes:
+        # What a correct download of this resource contains (HLS segments decrypted and concatenated)
+        return self.media_slice(resource_id, 0, self.media_total(resource_id) - 1)
+
+    def playlist(self, resource_id: str) -> str:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10", "#EXT-X-MEDIA-SEQUENCE:0"]
+        if self.hls_encrypt:
+            lines.append('#EXT-X-KEY:METHOD=AES-128,URI="/media/key.bin"')
+        for i in range(self.hls_segments):
+            lines += ["#EXTINF:10.0,", f"{resource_id}/{i}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def segment(self, resource_id: str, index: int) -> bytes:
+        data = self.media_slice(resource_id, index * self.segment_size, (index + 1) * self.segment_size - 1)
+        if not self.hls_encrypt:
+            return data
+        pad = 16 - len(data) % 16
+        return AES.new(HLS_KEY, AES.MODE_CBC, index.to_bytes(16, "big")).encrypt(data + bytes([pad]) * pad)
+
+    def roll(self) -> str:
+        with self._rnd_lock:
+            x = self._rnd.random()
+        if x < self.error_rate:
+            return "error"
+        if x < self.error_rate + self.throttle_rate:
+            return "throttle"
+        if x < self.error_rate + self.throttle_rate + self.drop_rate:
+            return "drop"
+        return "ok"
+
+    def count(self, kind: str) -> None:
+        with self._rnd_lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    @property
+    def fake(self) -> FakeXet:
+        return self.server.fake  # type: ignore[attr-defined]
+
+    def _send(self, status: int, body: bytes, ctype: str, extra: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data: Any) -> None:
+        self._send(200, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+    def _html(self, html: str) -> None:
+        cookie = f"{COOKIE_NAME}=fake-session; Path=/"
+        self._send(200, html.encode("utf-8"), "text/html; charset=utf-8", {"Set-Cookie": cookie})
+
+    def do_GET(self) -> None:
+        fake = self.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        if path == "/":
+            fake.count("page")
+            return self._html(SHOP_HTML)
+        if path == "/p/column/details":
+            fake.count("page")
+            return self._html(COLUMN_HTML.replace("__PAGE_SIZE__", str(fake.page_size)))
+        m = re.fullmatch(r"/p/course/(?:audio|video)/([av]_\w+)", path)
+        if m:
+            fake.count("page")
+            return self._html(LESSON_HTML.replace("__RID__", m.group(1)))
+        if path.startswith("/api/"):
+            fake.count("api")
+            return self._api(path, query)
+        if path.startswith("/media/"):
+            fake.count("media")
+            return self._media(path, query)
+        self._send(404, b"not found", "text/plain")
+
+    def _logged_in(self) -> bool:
+        return not self.fake.require_cookie or f"{COOKIE_NAME}=fake-session" in (self.headers.get("Cookie") or "")
+
+    def _api(self, path: str, query: Dict[str, str]) -> None:
+        fake = self.fake
+        if not self._logged_in():
+            # Like the real shop API: HTTP 200, but an error code and no data once the login is gone
+            return self._json({"code": 2001, "msg": "请先登录", "data": {}})
+        page = int(query.get("page") or 1)
+        size = int(query.get("page_size") or fake.page_size)
+        if path == "/api/products":
+            rows = [{"spu_id": pid, "product_name": f"专栏 {i}", "img_url": ""} for i, pid in enumerate(fake.product_ids())]  # noqa: E501
+        elif path == "/api/resources":
+            pid = query.get("product_id") or ""
+            rows = [
+                {"resource_id": rid, "resource_title": f"第{i + 1}课", "resource_type": 2 if rid.startswith("a_") else 3}
+                for i, rid in enumerate(fake.resource_ids(pid))
+            ] if pid in fake.product_ids() else []
+        elif path == "/api/lesson":
+            rid = query.get("resource_id") or ""
+            key = "hls_url" if fake.is_hls(rid) else "audio_url"
+            return self._json({key: fake.media_url(rid), "resource_id": rid})
+        else:
+            return self._send(404, b"{}", "application/json")
+        chunk = rows[(page - 1) * size:page * size]
+        self._json({"code": 0, "msg": "ok", "data": {"list": chunk, "total": len(rows), "page": page}})
+
+    def _media(self, path: str, query: Dict[str, str]) -> None:
+        fake = self.fake
+        if not self._logged_in():
+            return self._send(403, b"forbidden", "text/plain")
+        expires = query.get("t")
+        if expires and int(expires, 16) < time.time():
+            return self._send(403, b"signature expired", "text/plain")
+        if path == "/media/key.bin":
+            return self._send(200, HLS_KEY, "application/octet-stream")
+        outcome = fake.roll()
+        if outcome == "error":
+            return self._send(503, b"busy", "text/plain")
+        if outcome == "throttle":
+            return self._send(fake.throttle_status, b"slow down", "text/plain", {"Retry-After": "1"})
+        m = re.fullmatch(r"/media/([av]_\w+)\.m3u8", path)
+        if m:
+            return self._send(200, fake.playlist(m.group(1)).encode(), "application/vnd.apple.mpegurl")
+        m = re.fullmatch(r"/media/([av]_\w+)/(\d+)\.ts", path)
+        if m:
+            return self._body(fake.segment(m.group(1), int(m.group(2))), "video/mp2t", outcome == "drop")
+        m = re.fullmatch(r"/media/([av]_\w+)\.mp3", path)
+        if not m:
+            return self._send(404, b"not found", "text/plain")
+        rid = m.group(1)
+        total = fake.media_total(rid)
+        rng = _parse_range(self.headers.get("Range"), total)
+        if rng is None:
+            return self._body(fake.media_slice(rid, 0, total - 1), "audio/mpeg", outcome == "drop")
+        start, end = rng
+        headers = {"Content-Range": f"bytes {start}-{end}/{total}", "ETag": f'"{rid}"'}
+        self._body(fake.media_slice(rid, start, end), "audio/mpeg", outcome == "drop", 206, headers)
+
+    def _body(self, body: bytes, ctype: str, drop: bool, status: int = 200, extra: Optional[Dict[str, str]] = None) -> None:  # noqa: E501
+        fake = self.fake
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        # A dropped response promises the full length, sends half and hangs up
+        limit = len(body) // 2 if drop else len(body)
+        step = 16 * 1024
+        t0 = time.perf_counter()
+        sent = 0
+        try:
+            while sent < limit:
+                n = min(step, limit - sent)
+                self.wfile.write(body[sent:sent + n])
+                sent += n
+                if fake.bandwidth:
+                    ahead = sent / fake.bandwidth - (time.perf_counter() - t0)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        if drop:
+            self.close_connection = True
+
+
+def _parse_range(header: Optional[str], total: int) -> Optional[Tuple[int, int]]:
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        n = int(m.group(2))
+        return max(0, total - n), total - 1
+    start = int(m.group(1))
+    end = min(int(m.group(2)), total - 1) if m.group(2) else total - 1
+    return (start, end) if start <= end else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a fake Xiaoet shop for offline benchmarks")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--columns", type=int, default=3)
+    parser.add_argument("--lessons", type=int, default=40)
+    parser.add_argument("--media-size", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--hls-every", type=int, default=0, help="Every n-th lesson is HLS video")
+    parser.add_argument("--hls-encrypt", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added before every response")
+    parser.add_argument("--bandwidth", type=int, default=0, help="Bytes/s per media connection (0: unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of media requests answered 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of media requests throttled")
+    parser.add_argument("--throttle-status", type=int, default=429, choices=(429, 403), help="Status of a throttled request")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of media bodies cut off halfway")
+    parser.add_argument("--url-ttl", type=int, default=3600, help="Seconds a signed media URL stays valid")
+    args = parser.parse_args()
+    srv = FakeXet(
+        port=args.port,
+        columns=args.columns,
+        lessons=args.lessons,
+        media_size=args.media_size,
+        hls_every=args.hls_every,
+        hls_encrypt=args.hls_encrypt,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        throttle_status=args.throttle_status,
+        drop_rate=args.drop_rate,
+        url_ttl=args.url_ttl,
+    )
+    print(f"Fake shop at {srv.shop_url()}")
+    for pid in srv.product_ids():
+        print(f"  {srv.column_url(pid)}")
+    try:
+        srv._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
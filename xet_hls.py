@@ -0,0 +1,279 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from typing import Any, Deque, Dict, Iterator, List, Optional
+from urllib.parse import urljoin
+
+import requests
+
+import xet_metrics as metrics
+from xet_http import (
+    JOURNAL_INTERVAL,
+    TRANSIENT_ERRORS,
+    backoff_delay,
+    clear_journal,
+    get_limiter,
+    get_session,
+    load_journal,
+    raise_for_status,
+    save_journal,
+    url_host,
+)
+
+try:
+    from Crypto.Cipher import AES  # pycryptodome, only needed for encrypted streams
+except ImportError:
+    AES = None
+
+
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def _parse_attrs(text: str) -> Dict[str, str]:
+    return {k: v.strip('"') for k, v in _ATTR_RE.findall(text)}
+
+
+def parse_playlist(text: str, base_url: str) -> Dict[str, Any]:
+    # Master playlists yield {"variants": [...]}, media playlists {"segments": [...]}
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    if not lines or not lines[0].startswith("#EXTM3U"):
+        raise ValueError(f"Not an HLS playlist: {base_url}")
+
+    variants: List[Dict[str, Any]] = []
+    segments: List[Dict[str, Any]] = []
+    seq = 0
+    key: Optional[Dict[str, Any]] = None
+    init_map: Optional[Dict[str, Any]] = None
+    pending_variant: Optional[Dict[str, str]] = None
+    pending_range: Optional[str] = None
+    next_offset = 0
+    for ln in lines[1:]:
+        if ln.startswith("#EXT-X-STREAM-INF:"):
+            pending_variant = _parse_attrs(ln.split(":", 1)[1])
+        elif ln.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            seq = int(ln.split(":", 1)[1])
+        elif ln.startswith("#EXT-X-KEY:"):
+            attrs = _parse_attrs(ln.split(":", 1)[1])
+            method = attrs.get("METHOD", "NONE")
+            if method == "NONE":
+                key = None
+            else:
+                key = {"method": method, "uri": urljoin(base_url, attrs.get("URI", "")), "iv": attrs.get("IV")}
+        elif ln.startswith("#EXT-X-MAP:"):
+            attrs = _parse_attrs(ln.split(":", 1)[1])
+            init_map = {"uri": urljoin(base_url, attrs.get("URI", "")), "byterange": None}
+            if attrs.get("BYTERANGE"):
+                length, _, offset = attrs["BYTERANGE"].partition("@")
+                init_map["byterange"] = (int(length), int(offset or 0))
+        elif ln.startswith("#EXT-X-BYTERANGE:"):
+            pending_range = ln.split(":", 1)[1]
+        elif ln.startswith("#"):
+            continue
+        elif pending_variant is not None:
+            bandwidth = pending_variant.get("BANDWIDTH", "0")
+            variants.append({
+                "uri": urljoin(base_url, ln),
+                "bandwidth": int(bandwidth) if bandwidth.isdigit() else 0,
+                "resolution": pending_variant.get("RESOLUTION"),
+                "codecs": pending_variant.get("CODECS"),
+            })
+            pending_variant = None
+        else:
+            byterange = None
+            if pending_range is not None:
+                length, _, offset = pending_range.partition("@")
+                start = int(offset) if offset else next_offset
+                byterange = (int(length), start)
+                next_offset = start + int(length)
+                pending_range = None
+            segments.append({"uri": urljoin(base_url, ln), "seq": seq, "key": key, "byterange": byterange})
+            seq += 1
+
+    if variants:
+        return {"variants": variants}
+    return {"segments": segments, "map": init_map}
+
+
+def pick_variant(variants: List[Dict[str, Any]], max_bandwidth: Optional[int] = None) -> Dict[str, Any]:
+    # Highest bandwidth wins, optionally capped (falls back to the lowest one if all exceed the cap)
+    ranked = sorted(variants, key=lambda v: v.get("bandwidth") or 0)
+    if max_bandwidth:
+        within = [v for v in ranked if (v.get("bandwidth") or 0) <= max_bandwidth]
+        return within[-1] if within else ranked[0]
+    return ranked[-1]
+
+
+class HlsDownloader:
+    def __init__(
+        self,
+        headers: Optional[Dict[str, str]] = None,
+        workers: int = 8,
+        session: Optional[requests.Session] = None,
+        max_bandwidth: Optional[int] = None,
+        timeout: float = 30.0,
+        retries: int = 5,
+    ) -> None:
+        self.headers = dict(headers or {})
+        self.workers = max(1, workers)
+        self.session = session or get_session()
+        self.retries = retries
+        self.max_bandwidth = max_bandwidth
+        self.timeout = timeout
+        self._keys: Dict[str, bytes] = {}
+        self._keys_lock = threading.Lock()
+
+    def _get(self, url: str, byterange: Optional[tuple] = None) -> bytes:
+        headers = dict(self.headers)
+        if byterange:
+            length, offset = byterange
+            headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+        attempt = 0
+        while True:
+            try:
+                r = self.session.get(url, headers=headers, timeout=self.timeout)
+                raise_for_status(r)
+                get_limiter().wait_bytes(url_host(url), len(r.content))
+                return r.content
+            except TRANSIENT_ERRORS:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+
+    def load_media_playlist(self, url: str) -> Dict[str, Any]:
+        # Follow master playlists down to a media playlist (nested masters are rare but legal)
+        for _ in range(3):
+            text = self._get(url).decode("utf-8", errors="replace")
+            playlist = parse_playlist(text, url)
+            if "variants" not in playlist:
+                return playlist
+            url = pick_variant(playlist["variants"], self.max_bandwidth)["uri"]
+        raise ValueError(f"Too many nested master playlists: {url}")
+
+    def _key_bytes(self, uri: str) -> bytes:
+        with self._keys_lock:
+            cached = self._keys.get(uri)
+        if cached is None:
+            cached = self._get(uri)
+            with self._keys_lock:
+                self._keys[uri] = cached
+        return cached
+
+    def _decrypt(self, data: bytes, segment: Dict[str, Any]) -> bytes:
+        key = segment.get("key")
+        if not key:
+            return data
+        if key["method"] != "AES-128":
+            raise RuntimeError(f"Unsupported HLS encryption: {key['method']}")
+        if AES is None:
+            raise RuntimeError("Encrypted HLS stream requires pycryptodome (pip3 install pycryptodome)")
+        iv_text = key.get("iv")
+        if iv_text:
+            iv = bytes.fromhex(iv_text[2:] if iv_text.lower().startswith("0x") else iv_text)
+        else:
+            iv = segment["seq"].to_bytes(16, "big")
+        plain = AES.new(self._key_bytes(key["uri"]), AES.MODE_CBC, iv).decrypt(data)
+        pad = plain[-1] if plain else 0
+        if 0 < pad <= 16 and plain.endswith(bytes([pad]) * pad):
+            plain = plain[:-pad]
+        return plain
+
+    def fetch_segment(self, segment: Dict[str, Any]) -> bytes:
+        with metrics.span("hls_segment", seq=segment["seq"]) as m:
+            data = self._decrypt(self._get(segment["uri"], segment.get("byterange")), segment)
+            m["bytes"] = len(data)
+        return data
+
+    def _in_order(self, ex: ThreadPoolExecutor, segments: List[Dict[str, Any]]) -> Iterator[bytes]:
+        # Keep a bounded window of in-flight segments and hand them out strictly in playlist order
+        it = iter(segments)
+        window: Deque[Future] = deque()
+        for seg in it:
+            window.append(ex.submit(self.fetch_segment, seg))
+            if len(window) >= self.workers * 2:
+                break
+        try:
+            while window:
+                data = window.popleft().result()
+                seg = next(it, None)
+                if seg is not None:
+                    window.append(ex.submit(self.fetch_segment, seg))
+                yield data
+        finally:
+            for fut in window:
+                fut.cancel()
+
+    def download(self, url: str, outfile: str, postprocessor: Any = None, hasher: Any = None) -> str:
+        playlist = self.load_media_playlist(url)
+        segments = playlist["segments"]
+        if not segments:
+            raise ValueError(f"HLS playlist has no segments: {url}")
+        if postprocessor is not None:
+            return self._download_into(playlist, outfile, postprocessor)
+        tmp = outfile + ".tmp"
+
+        # Segments are appended in order, so the journal only needs the count and byte length written
+        journal = load_journal(outfile, url)
+        if journal is None or journal.get("segments_total") != len(segments):
+            journal = {"url": url, "segments_total": len(segments), "segments_done": 0, "bytes": 0}
+        journal["url"] = url
+        skip = journal["segments_done"]
+        if skip:
+            print(f"Resuming {os.path.basename(outfile)}: {skip}/{len(segments)} segments already on disk")
+        mode = "r+b" if skip else "wb"
+        last_saved = time.time()
+        with open(tmp, mode) as f, ThreadPoolExecutor(max_workers=self.workers) as ex:
+            f.truncate(journal["bytes"])
+            f.seek(journal["bytes"])
+            if hasher is not None and journal["bytes"]:
+                hasher.catch_up(tmp, journal["bytes"])
+            if playlist.get("map") and not skip:
+                init = self._get(playlist["map"]["uri"], playlist["map"].get("byterange"))
+                if hasher is not None:
+                    hasher.update_at(0, init)
+                f.write(init)
+            try:
+                with closing(self._in_order(ex, segments[skip:])) as chunks:
+                    for data in chunks:
+                        if hasher is not None:
+                            hasher.update_at(f.tell(), data)
+                        f.write(data)
+                        journal["segments_done"] += 1
+                        if time.time() - last_saved >= JOURNAL_INTERVAL:
+                            f.flush()
+                            journal["bytes"] = f.tell()
+                            save_journal(outfile, journal)
+                            last_saved = time.time()
+            except BaseException:
+                # Record everything written so far so the next run picks up from here
+                f.flush()
+                journal["bytes"] = f.tell()
+                save_journal(outfile, journal)
+                raise
+        if hasher is not None:
+            hasher.finish(tmp)
+        with metrics.span("finalize", file=os.path.basename(outfile)):
+            os.replace(tmp, outfile)
+            clear_journal(outfile)
+        return outfile
+
+    def _download_into(self, playlist: Dict[str, Any], outfile: str, postprocessor: Any) -> str:
+        # Segments stream straight into ffmpeg in order; nothing but the final container touches the disk.
+        # A pipe cannot be resumed, so an interrupted run starts this file over.
+        init = playlist.get("map")
+        with ThreadPoolExecutor(max_workers=self.workers) as ex, \
+                postprocessor.sink(outfile, input_format="mov" if init else "mpegts") as sink:
+            if init:
+                sink.write(self._get(init["uri"], init.get("byterange")))
+            with closing(self._in_order(ex, playlist["segments"])) as chunks:
+                for data in chunks:
+                    sink.write(data)
+        return sink.dest
+
+
+def download_hls(url: str, headers: Dict[str, str], outfile: str, workers: int = 8, postprocessor: Any = None, hasher: Any = None) -> str:  # noqa: E501
+    return HlsDownloader(headers, workers=workers).download(url, outfile, postprocessor, hasher)
@@ -0,0 +1,738 @@
+import calendar
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import xet_metrics as metrics
+
+
+CHUNK_SIZE = 64 * 1024
+# Ranged parts are sized so every connection gets work, within these bounds (small parts resume finer,
+# but each one costs a request)
+PART_SIZE = 8 * 1024 * 1024
+MIN_PART_SIZE = 1024 * 1024
+# At least this many parts per connection, so no single part holds a large share of the file
+PARTS_PER_CONNECTION = 4
+# A limiter shared through a Manager hands out bytes in batches of this fraction of a second's budget,
+# so the worker processes meet in the manager a few times per second rather than once per chunk
+SHARED_BATCH_SECONDS = 1 / 16
+# Seconds between journal saves while parts are in flight; a killed run loses at most this much
+JOURNAL_INTERVAL = 1.0
+
+
+# Statuses worth retrying; 429/503 responses also carry Retry-After, which urllib3 honours
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses a CDN uses to push back on a client going too fast
+THROTTLE_STATUSES = (429, 403)
+# Statuses a signed media URL is answered with once its signature has run out; a 403 only counts
+# once the URL's own expiry has passed (see is_expired)
+EXPIRED_STATUSES = (403, 410)
+
+
+class Throttled(requests.exceptions.HTTPError):
+    # A 403/429 the host uses to push back. The limiter has already paused the host and halved its
+    # rate, so the caller retries like any transient failure instead of capturing the URL again.
+    pass
+
+
+# Failures that surface while reading a body, after urllib3's own retries have been used up
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+    Throttled,
+)
+
+
+class SignedUrlExpired(RuntimeError):
+    # The media URL stopped being accepted, possibly partway through a file. The journal keeps what
+    # already landed, so capturing the resource again and downloading with the fresh URL resumes.
+
+    def __init__(self, url: str, status: int) -> None:
+        super().__init__(f"Signed URL rejected with {status}: {url.split('?')[0]}")
+        self.url = url
+        self.status = status
+
+
+def raise_for_status(r: requests.Response) -> None:
+    if is_expired(r.status_code, r.url):
+        r.close()
+        raise SignedUrlExpired(r.url, r.status_code)
+    if is_throttle(r.status_code, r.url):
+        r.close()
+        raise Throttled(f"Throttled with {r.status_code}: {r.url.split('?')[0]}", response=r)
+    r.raise_for_status()
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_settings: Dict[str, float] = {"pool_size": 32, "retries": 5, "backoff": 0.5}
+
+
+def parse_rate(text: Optional[str]) -> float:
+    # "0"/None -> unlimited; accepts plain numbers and K/M/G suffixes ("512K", "4M", "1.5G")
+    if not text:
+        return 0.0
+    text = str(text).strip().upper().rstrip("B")
+    scale = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}.get(text[-1:], 1)
+    return float(text[:-1] if scale > 1 else text) * scale
+
+
+class _HostState:
+    __slots__ = ("byte_tokens", "req_tokens", "stamp", "factor", "paused_until")
+
+    def __init__(self, now: float) -> None:
+        self.byte_tokens = 0.0
+        self.req_tokens = 0.0
+        self.stamp = now
+        self.factor = 1.0
+        self.paused_until = 0.0
+
+    def row(self) -> Tuple[float, float, float, float, float]:
+        return (self.byte_tokens, self.req_tokens, self.stamp, self.factor, self.paused_until)
+
+    @classmethod
+    def from_row(cls, row: Tuple[float, float, float, float, float]) -> "_HostState":
+        st = cls(0.0)
+        st.byte_tokens, st.req_tokens, st.stamp, st.factor, st.paused_until = row
+        return st
+
+
+class HostLimiter:
+    # Token buckets per host (bytes/s and requests/s), shared by every download thread in the process.
+    # Reservations may go into debt, so a large chunk simply makes the next caller wait longer.
+    # AIMD: a 429/403 halves the host's rate and pauses it briefly; each success wins back a step.
+    # 0 disables a bucket; throttled hosts are still paused even without configured rates.
+    # shared=(dict, lock) from a multiprocessing Manager puts the state of every host in the manager
+    # process, so worker processes passing the same pair draw from one bucket and back off together.
+    # Each such process takes bytes in batches (SHARED_BATCH_SECONDS) and spends them locally.
+
+    def __init__(self, bytes_per_sec: float = 0.0, requests_per_sec: float = 0.0, min_factor: float = 1 / 16, recover_step: float = 0.02, shared: Any = None) -> None:  # noqa: E501
+        self.bytes_per_sec = max(0.0, bytes_per_sec)
+        self.requests_per_sec = max(0.0, requests_per_sec)
+        self.min_factor = min_factor
+        self.recover_step = recover_step
+        self.shared = shared
+        # host -> _HostState.row(); rows rather than objects, since a manager dict only sees assignments
+        self._hosts: Any = shared[0] if shared is not None else {}
+        self._lock: Any = shared[1] if shared is not None else threading.Lock()
+        # host -> bytes already taken from the shared bucket and not yet handed out
+        self._credit: Dict[str, int] = {}
+        self._credit_lock = threading.Lock()
+
+    def _state(self, host: str, now: float) -> _HostState:
+        row = self._hosts.get(host)
+        if row is None:
+            st = _HostState(now)
+            st.byte_tokens = self.bytes_per_sec
+            st.req_tokens = max(1.0, self.requests_per_sec)
+        else:
+            st = _HostState.from_row(row)
+        # Refill both buckets at the host's current (possibly backed-off) rate, capped at one second's worth
+        elapsed = max(0.0, now - st.stamp)
+        st.stamp = now
+        if self.bytes_per_sec:
+            rate = self.bytes_per_sec * st.factor
+            st.byte_tokens = min(rate, st.byte_tokens + elapsed * rate)
+        if self.requests_per_sec:
+            rate = self.requests_per_sec * st.factor
+            st.req_tokens = min(max(1.0, rate), st.req_tokens + elapsed * rate)
+        return st
+
+    def _save(self, host: str, st: _HostState) -> None:
+        self._hosts[host] = st.row()
+
+    def reserve_request(self, host: str) -> float:
+        # Returns how long the caller must wait before sending
+        now = time.monotonic()
+        with self._lock:
+            st = self._state(host, now)
+            delay = max(0.0, st.paused_until - now)
+            if self.requests_per_sec:
+                st.req_tokens -= 1
+                if st.req_tokens < 0:
+                    delay = max(delay, -st.req_tokens / (self.requests_per_sec * st.factor))
+            self._save(host, st)
+            return delay
+
+    def reserve_bytes(self, host: str, n: int) -> float:
+        if not self.bytes_per_sec or n <= 0:
+            return 0.0
+        if self.shared is None:
+            return self._take_bytes(host, n)
+        # The thread that draws a batch waits for all of it; chunks spent from the credit go right away
+        with self._credit_lock:
+            credit = self._credit.get(host, 0)
+            if credit >= n:
+                self._credit[host] = credit - n
+                return 0.0
+            batch = max(n - credit, int(self.bytes_per_sec * SHARED_BATCH_SECONDS))
+            self._credit[host] = credit + batch - n
+            return self._take_bytes(host, batch)
+
+    def _take_bytes(self, host: str, n: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            st = self._state(host, now)
+            st.byte_tokens -= n
+            self._save(host, st)
+            return max(0.0, -st.byte_tokens / (self.bytes_per_sec * st.factor), st.paused_until - now)
+
+    def wait_request(self, host: str) -> None:
+        delay = self.reserve_request(host)
+        if delay > 0:
+            time.sleep(delay)
+
+    def wait_bytes(self, host: str, n: int) -> None:
+        delay = self.reserve_bytes(host, n)
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttled(self, host: str, retry_after: Optional[float] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            st = self._state(host, now)
+            st.factor = max(self.min_factor, st.factor / 2)
+            pause = retry_after if retry_after is not None else backoff_delay(0) * 2
+            st.paused_until = max(st.paused_until, now + min(60.0, pause))
+            self._save(host, st)
+
+    def succeeded(self, host: str) -> None:
+        with self._lock:
+            row = self._hosts.get(host)
+            if row is not None and row[3] < 1.0:
+                st = _HostState.from_row(row)
+                st.factor = min(1.0, st.factor + self.recover_step)
+                self._save(host, st)
+
+    def factor(self, host: str) -> float:
+        with self._lock:
+            row = self._hosts.get(host)
+            return row[3] if row is not None else 1.0
+
+
+_limiter = HostLimiter()
+
+
+def configure_limits(bytes_per_sec: Optional[float] = None, requests_per_sec: Optional[float] = None, shared: Any = None) -> None:  # noqa: E501
+    # shared: see HostLimiter; the orchestrator hands every worker process the same pair
+    global _limiter
+    _limiter = HostLimiter(
+        _limiter.bytes_per_sec if bytes_per_sec is None else bytes_per_sec,
+        _limiter.requests_per_sec if requests_per_sec is None else requests_per_sec,
+        shared=shared if shared is not None else _limiter.shared,
+    )
+
+
+def get_limiter() -> HostLimiter:
+    return _limiter
+
+
+def url_host(url: str) -> str:
+    return urlsplit(url).hostname or ""
+
+
+def _retry_after(headers: Any) -> Optional[float]:
+    value = (headers or {}).get("Retry-After")
+    return float(value) if value and value.isdigit() else None
+
+
+class _JitterRetry(Retry):
+    # Full jitter on top of the exponential backoff keeps parallel workers from retrying in lockstep
+    def get_backoff_time(self) -> float:
+        base = super().get_backoff_time()
+        return base + random.uniform(0, base) if base > 0 else 0
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):  # type: ignore[override]  # noqa: E501
+        # urllib3 retries 429s on its own; the limiter still has to hear about each one it retries. Once
+        # the retries are used up this raises and the response reaches _LimitedAdapter.send, which reports
+        # it there, so every throttled response is counted exactly once.
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if response is not None and _pool is not None and is_throttle(response.status, url or ""):
+            get_limiter().throttled(_pool.host, _retry_after(response.headers))
+        return retry
+
+
+class _LimitedAdapter(HTTPAdapter):
+    # Every request of the shared session passes the per-host request bucket and feeds AIMD with its
+    # final response (retried ones were already reported by _JitterRetry.increment)
+    def send(self, request, **kwargs):  # type: ignore[override]
+        host = url_host(request.url)
+        limiter = get_limiter()
+        limiter.wait_request(host)
+        resp = super().send(request, **kwargs)
+        if is_throttle(resp.status_code, request.url):
+            limiter.throttled(host, _retry_after(resp.headers))
+        elif resp.status_code < 400:
+            limiter.succeeded(host)
+        return resp
+
+
+def configure_session(pool_size: Optional[int] = None, retries: Optional[int] = None, backoff: Optional[float] = None) -> None:  # noqa: E501
+    global _session
+    with _session_lock:
+        if pool_size is not None:
+            _settings["pool_size"] = max(1, pool_size)
+        if retries is not None:
+            _settings["retries"] = max(0, retries)
+        if backoff is not None:
+            _settings["backoff"] = max(0.0, backoff)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session() -> requests.Session:
+    # One keep-alive pool shared by every download in the process
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = int(_settings["retries"])
+            retry = _JitterRetry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                backoff_factor=_settings["backoff"],
+                status_forcelist=RETRY_STATUSES,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            pool_size = int(_settings["pool_size"])
+            adapter = _LimitedAdapter(pool_connections=8, pool_maxsize=pool_size, max_retries=retry)
+            s = requests.Session()
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session = s
+        return _session
+
+
+def backoff_delay(attempt: int) -> float:
+    base = _settings["backoff"] * (2 ** attempt)
+    return min(60.0, base + random.uniform(0, base))
+
+
+def _pwrite(fd: int, data: bytes, offset: int, lock: threading.Lock) -> None:
+    if hasattr(os, "pwrite"):
+        while data:
+            n = os.pwrite(fd, data, offset)
+            data = data[n:]
+            offset += n
+        return
+    # Windows has no pwrite; serialize seek+write on the shared descriptor instead
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            n = os.write(fd, data)
+            data = data[n:]
+
+
+def part_size_for(total: int, connections: int) -> int:
+    # A few parts per connection, so a part is a small share of the file and idle connections pick up
+    # the tail; capped for long files and floored so short ones do not turn into many tiny requests
+    return max(MIN_PART_SIZE, min(PART_SIZE, -(-total // (max(1, connections) * PARTS_PER_CONNECTION))))
+
+
+def split_ranges(total: int, part_size: int, start: int = 0) -> List[Tuple[int, int]]:
+    return [(a, min(a + part_size, total) - 1) for a in range(start, total, part_size)]
+
+
+def missing_ranges(total: int, done: Iterable[Iterable[int]], part_size: int) -> List[Tuple[int, int]]:
+    # Part-sized ranges of [0, total) not covered by the journal's done ranges, which may be parts
+    # cut short by a failure as well as whole ones
+    out: List[Tuple[int, int]] = []
+    pos = 0
+    for a, b in sorted(tuple(r) for r in done):
+        if a > pos:
+            out += split_ranges(a, part_size, pos)
+        pos = max(pos, b + 1)
+    if pos < total:
+        out += split_ranges(total, part_size, pos)
+    return out
+
+
+def probe(session: requests.Session, url: str, headers: Dict[str, str], timeout: float = 30.0) -> Tuple[requests.Response, Optional[int], bool]:  # noqa: E501
+    # A one-byte ranged GET tells us both the size and whether ranges are honoured;
+    # HEAD is avoided because signed CDN URLs are often only valid for GET.
+    attempt = 0
+    while True:
+        r = session.get(url, headers={**headers, "Range": "bytes=0-0"}, stream=True, timeout=timeout)
+        try:
+            raise_for_status(r)
+            break
+        except Throttled:
+            # The limiter paused the host; the next request waits that out
+            if attempt >= _settings["retries"]:
+                raise
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+    if r.status_code == 206:
+        m = re.match(r"bytes\s+\d+-\d+/(\d+)", r.headers.get("Content-Range", ""))
+        total = int(m.group(1)) if m else None
+        return r, total, total is not None
+    length = r.headers.get("Content-Length")
+    return r, int(length) if length and length.isdigit() else None, False
+
+
+# Query parameters CDNs use for the expiry of signed URLs
+_EXPIRY_PARAMS = ("t", "expires", "Expires", "x-oss-expires", "e", "deadline", "exp")
+
+
+def signed_url_expiry(url: str) -> Optional[int]:
+    # Best-effort unix expiry of a signed media URL; None when the URL carries no recognizable one
+    query = dict(parse_qsl(urlsplit(url).query))
+    amz_date, amz_expires = query.get("X-Amz-Date"), query.get("X-Amz-Expires")
+    if amz_date and amz_expires and amz_expires.isdigit():
+        try:
+            start = calendar.timegm(time.strptime(amz_date, "%Y%m%dT%H%M%SZ"))
+            return start + int(amz_expires)
+        except ValueError:
+            pass
+    for key in _EXPIRY_PARAMS:
+        value = query.get(key)
+        if not value:
+            continue
+        if value.isdigit() and len(value) == 10:
+            return int(value)
+        # Tencent Cloud key anti-leech signs with t=<hex unix expiry>
+        if key == "t" and re.fullmatch(r"[0-9a-fA-F]{8}", value):
+            return int(value, 16)
+    return None
+
+
+def is_expired(status: int, url: str) -> bool:
+    # 410 always; a 403 only when the signed URL says it has run out, otherwise it is throttling
+    if status not in EXPIRED_STATUSES:
+        return False
+    if status == 410:
+        return True
+    expiry = signed_url_expiry(url)
+    return expiry is not None and expiry <= time.time()
+
+
+def is_throttle(status: int, url: str) -> bool:
+    return status in THROTTLE_STATUSES and not is_expired(status, url)
+
+
+def url_is_alive(url: str, headers: Dict[str, str], timeout: float = 10.0) -> bool:
+    # Cheap validity check for a stored capture: a one-byte ranged GET with its headers
+    try:
+        r, _, _ = probe(get_session(), url, headers, timeout)
+        r.close()
+        return True
+    except Throttled:
+        # Pushed back, not rejected: the URL itself may still be good
+        return True
+    except Exception:
+        return False
+
+
+class OrderedHasher:
+    # sha256 of a file whose parts land out of order: contiguous bytes are hashed as they arrive and
+    # early arrivals wait in memory (up to max_buffer). Whatever was never seen here (parts from a
+    # resumed run, buffer overflow) is read back from disk by finish(), so the common case hashes in-stream.
+
+    def __init__(self, max_buffer: int = 64 * 1024 * 1024) -> None:
+        self.max_buffer = max_buffer
+        self.pos = 0
+        self._h = hashlib.sha256()
+        self._pending: Dict[int, bytes] = {}
+        self._buffered = 0
+        self._gap = False
+        self._lock = threading.Lock()
+        self.digest: Optional[str] = None
+
+    def update_at(self, offset: int, data: bytes) -> None:
+        with self._lock:
+            if offset == self.pos:
+                self._h.update(data)
+                self.pos += len(data)
+                while self.pos in self._pending:
+                    chunk = self._pending.pop(self.pos)
+                    self._buffered -= len(chunk)
+                    self._h.update(chunk)
+                    self.pos += len(chunk)
+            elif offset > self.pos and not self._gap:
+                if self._buffered + len(data) <= self.max_buffer:
+                    self._pending[offset] = data
+                    self._buffered += len(data)
+                else:
+                    # Past a dropped chunk nothing can become contiguous again; stop holding memory
+                    self._gap = True
+                    self._pending.clear()
+                    self._buffered = 0
+
+    def catch_up(self, path: str, upto: int) -> None:
+        # Hash bytes already on disk (e.g. from a resumed run) up to `upto`
+        with self._lock, open(path, "rb") as f:
+            f.seek(self.pos)
+            while self.pos < upto:
+                chunk = f.read(min(CHUNK_SIZE * 16, upto - self.pos))
+                if not chunk:
+                    break
+                self._h.update(chunk)
+                self.pos += len(chunk)
+
+    def finish(self, path: str) -> str:
+        with self._lock:
+            self._pending.clear()
+            self._buffered = 0
+        self.catch_up(path, os.path.getsize(path))
+        self.digest = self._h.hexdigest()
+        return self.digest
+
+
+def _stream_to(r: requests.Response, path: str, hasher: Optional[OrderedHasher] = None) -> None:
+    limiter, host = get_limiter(), url_host(r.url)
+    with open(path, "wb") as f:
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            if chunk:
+                limiter.wait_bytes(host, len(chunk))
+                if hasher is not None:
+                    hasher.update_at(f.tell(), chunk)
+                f.write(chunk)
+
+
+def journal_path(outfile: str) -> str:
+    return outfile + ".tmp.json"
+
+
+def url_key(url: str) -> str:
+    # Signed URLs get a fresh query string on every capture; the path identifies the file
+    return url.split("?")[0].split("#")[0]
+
+
+def load_journal(outfile: str, url: str) -> Optional[Dict]:
+    path = journal_path(outfile)
+    if not (os.path.exists(path) and os.path.exists(outfile + ".tmp")):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            journal = json.load(f)
+    except Exception:
+        return None
+    if url_key(journal.get("url") or "") != url_key(url):
+        return None
+    return journal
+
+
+def save_journal(outfile: str, journal: Dict) -> None:
+    path = journal_path(outfile)
+    with open(path + ".new", "w", encoding="utf-8") as f:
+        json.dump(journal, f)
+    os.replace(path + ".new", path)
+
+
+def journal_bytes(outfile: str, url: str) -> int:
+    # Bytes of outfile already on disk according to its journal (ranged parts or HLS prefix)
+    journal = load_journal(outfile, url)
+    if journal is None:
+        return 0
+    if "done" in journal:
+        return sum(b + 1 - a for a, b in journal["done"])
+    return journal.get("bytes", 0)
+
+
+def clear_journal(outfile: str) -> None:
+    try:
+        os.remove(journal_path(outfile))
+    except FileNotFoundError:
+        pass
+
+
+def finish_download(outfile: str) -> str:
+    # Move the completed .tmp into place and drop its journal
+    with metrics.span("finalize", file=os.path.basename(outfile)):
+        os.replace(outfile + ".tmp", outfile)
+        clear_journal(outfile)
+    return outfile
+
+
+def open_journal(outfile: str, url: str, total: int, etag: Optional[str], last_modified: Optional[str]) -> Dict:
+    # The journal to resume outfile from, or a fresh one when the remote file changed since
+    journal = load_journal(outfile, url)
+    if journal is not None:
+        same = journal.get("total") == total
+        if etag and journal.get("etag"):
+            same = same and journal["etag"] == etag
+        if last_modified and journal.get("last_modified"):
+            same = same and journal["last_modified"] == last_modified
+        if not same:
+            journal = None
+    if journal is None:
+        journal = {"url": url, "etag": etag, "last_modified": last_modified, "total": total, "done": []}
+    journal["url"] = url
+    return journal
+
+
+class RangedFile:
+    # The on-disk side of a ranged download, shared by the threaded engine below and the asyncio one:
+    # a preallocated .tmp written with pwrite, the resume journal, the optional in-stream hasher and the
+    # per-part metrics. The engines only fetch byte ranges and hand them over.
+
+    def __init__(
+        self,
+        outfile: str,
+        url: str,
+        total: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        hasher: Optional[OrderedHasher] = None,
+    ) -> None:
+        self.outfile = outfile
+        self.tmp = outfile + ".tmp"
+        self.total = total
+        self.hasher = hasher
+        self.journal = open_journal(outfile, url, total, etag, last_modified)
+        # part start -> offset written so far, for parts still in flight
+        self._inflight: Dict[int, int] = {}
+        self._saved = 0.0
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+
+    def parts(self, connections: int, part_size: Optional[int] = None) -> List[Tuple[int, int]]:
+        done = self.journal["done"]
+        if done:
+            print(f"Resuming {os.path.basename(self.outfile)}: {sum(b + 1 - a for a, b in done)} bytes already on disk")
+        return missing_ranges(self.total, done, part_size or part_size_for(self.total, connections))
+
+    def __enter__(self) -> "RangedFile":
+        self._fd = os.open(self.tmp, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        if os.fstat(self._fd).st_size != self.total:
+            os.ftruncate(self._fd, self.total)
+        with self._lock:
+            self._save()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        os.close(self._fd)  # type: ignore[arg-type]
+        self._fd = None
+
+    def write(self, offset: int, data: bytes) -> None:
+        if self.hasher is not None:
+            self.hasher.update_at(offset, data)
+        _pwrite(self._fd, data, offset, self._lock)  # type: ignore[arg-type]
+
+    def progress(self, start: int, offset: int) -> None:
+        # The part starting at start has written up to offset; saved with the journal about once a
+        # second, so even a killed process resumes from inside its parts
+        with self._lock:
+            self._inflight[start] = offset
+            if time.monotonic() - self._saved >= JOURNAL_INTERVAL:
+                self._save()
+
+    def part_done(self, start: int, end: int, seconds: float, retries: int = 0) -> None:
+        metrics.record("part", seconds, start=start, bytes=end + 1 - start, retries=retries)
+        self._record(start, end)
+
+    def part_cut(self, start: int, offset: int) -> None:
+        # Keep what a part cut short (expired URL, retries used up) already wrote for the next run
+        if offset > start:
+            self._record(start, offset - 1)
+
+    def _record(self, start: int, end: int) -> None:
+        with self._lock:
+            self._inflight.pop(start, None)
+            self.journal["done"].append([start, end])
+            self._save()
+
+    def _save(self) -> None:
+        # Called with the lock held; in-flight parts count as done up to what they wrote
+        done = self.journal["done"] + [[a, b - 1] for a, b in self._inflight.items() if b > a]
+        save_journal(self.outfile, {**self.journal, "done": done})
+        self._saved = time.monotonic()
+
+    def finish(self) -> str:
+        if self.hasher is not None:
+            self.hasher.finish(self.tmp)
+        return finish_download(self.outfile)
+
+
+def download_file(
+    url: str,
+    headers: Dict[str, str],
+    outfile: str,
+    connections: int = 4,
+    session: Optional[requests.Session] = None,
+    part_size: Optional[int] = None,
+    timeout: float = 30.0,
+    hasher: Optional[OrderedHasher] = None,
+    precheck: Optional[Callable[[Optional[str], Optional[int]], bool]] = None,
+) -> str:
+    # hasher receives every byte as it lands; precheck(etag, size) runs right after the probe and
+    # returns True when outfile was already provided some other way (e.g. from a dedup store)
+    session = session or get_session()
+    tmp = outfile + ".tmp"
+    # With stream=True the probe returns as soon as headers arrive: this is the time to first byte
+    with metrics.span("http_ttfb", host=url_host(url)):
+        r, total, ranged = probe(session, url, headers, timeout)
+    if precheck is not None and precheck(r.headers.get("ETag"), total):
+        r.close()
+        return outfile
+    if not ranged:
+        # Server ignored the Range header and is already sending the whole body; nothing to resume
+        clear_journal(outfile)
+        with r, metrics.span("part", start=0) as m:
+            _stream_to(r, tmp, hasher)
+            m["bytes"] = os.path.getsize(tmp)
+        if hasher is not None:
+            hasher.finish(tmp)
+        return finish_download(outfile)
+    rf = RangedFile(outfile, url, total, r.headers.get("ETag"), r.headers.get("Last-Modified"), hasher)
+    r.close()
+    parts = rf.parts(connections, part_size)
+    limiter, host = get_limiter(), url_host(url)
+
+    def fetch(part: Tuple[int, int]) -> None:
+        start, end = part
+        offset = start
+        attempt = 0
+        t0 = time.perf_counter()
+        try:
+            while True:
+                rh = {**headers, "Range": f"bytes={offset}-{end}"}
+                try:
+                    with session.get(url, headers=rh, stream=True, timeout=timeout) as pr:
+                        raise_for_status(pr)
+                        if pr.status_code != 206:
+                            raise RuntimeError(f"Server stopped honouring Range requests: {url}")
+                        for chunk in pr.iter_content(chunk_size=CHUNK_SIZE):
+                            if chunk:
+                                limiter.wait_bytes(host, len(chunk))
+                                rf.write(offset, chunk)
+                                offset += len(chunk)
+                                rf.progress(start, offset)
+                    if offset != end + 1:
+                        raise requests.exceptions.ChunkedEncodingError(f"Short read for bytes {start}-{end}")
+                    break
+                except TRANSIENT_ERRORS:
+                    # Connection reset mid-body: continue this part from the last byte written
+                    if attempt >= _settings["retries"]:
+                        raise
+                    time.sleep(backoff_delay(attempt))
+                    attempt += 1
+        except BaseException:
+            rf.part_cut(start, offset)
+            raise
+        rf.part_done(start, end, time.perf_counter() - t0, attempt)
+
+    with rf:
+        ex = ThreadPoolExecutor(max_workers=max(1, connections))
+        try:
+            for _ in ex.map(fetch, parts):
+                pass
+        finally:
+            # On failure stop queued parts right away; the journal keeps what already landed
+            ex.shutdown(wait=True, cancel_futures=True)
+    return rf.finish()
@@ -0,0 +1,298 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from xet_batch import existing_download, run_batch
+from xet_core import CaptureSession, Entity, XetCore
+from xet_http import journal_bytes, journal_path
+from xet_manifest import Manifest
+
+
+class Job:
+    # One unit of background work; workers update the fields, the GUI reads them on every refresh
+
+    def __init__(self, job_id: int, kind: str, label: str, appid: str) -> None:
+        self.id = job_id
+        self.kind = kind
+        self.label = label
+        self.appid = appid
+        self.state = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Items done/total for bulk jobs; bytes of finished files plus the file in flight (outfile, url)
+        self.done = 0
+        self.failed = 0
+        self.total = 0
+        self.bytes = 0
+        self.current: Optional[Tuple[str, str]] = None
+        self.message = ""
+        self.result: Any = None
+        # Counters are bumped from several download threads at once
+        self._lock = threading.Lock()
+
+    def count(self, done: int = 0, failed: int = 0, nbytes: int = 0) -> None:
+        with self._lock:
+            self.done += done
+            self.failed += failed
+            self.bytes += nbytes
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "failed")
+
+    def live_bytes(self) -> int:
+        n = self.bytes
+        current = self.current
+        if current is not None:
+            n += file_progress(*current)
+        return n
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def row(self) -> Dict[str, Any]:
+        n = self.live_bytes()
+        secs = self.elapsed()
+        return {
+            "#": self.id,
+            "任务": self.label,
+            "状态": self.state,
+            "进度": f"{self.done}/{self.total}" + (f"（失败 {self.failed}）" if self.failed else "") if self.total else "",
+            "已下载": f"{n / 1e6:.1f} MB" if n else "",
+            "速度": f"{n / secs / 1e6:.2f} MB/s" if n and secs > 0 else "",
+            "耗时": f"{int(secs)}s",
+            "信息": self.message,
+        }
+
+
+def file_progress(outfile: str, url: str) -> int:
+    # Bytes of a download so far: ranged and HLS downloads keep a journal, a single stream just grows its .tmp
+    if os.path.exists(outfile):
+        return os.path.getsize(outfile)
+    if os.path.exists(journal_path(outfile)):
+        return journal_bytes(outfile, url)
+    try:
+        return os.path.getsize(outfile + ".tmp")
+    except OSError:
+        return 0
+
+
+class JobManager:
+    # Background work for the GUI. Everything that drives the browser runs on a single thread: Playwright's
+    # sync API stays on the thread that started it and a running browser locks the profile. Single downloads
+    # run on a small pool; a bulk download runs the batch pipeline from the browser thread, and browser work
+    # of single downloads for the same shop is handed to its batch loop meanwhile instead of waiting behind it.
+    #   jobs = JobManager(); job = jobs.submit_capture(appid, url); ...; jobs.snapshot()
+
+    def __init__(self, download_workers: int = 3) -> None:
+        self._browser = ThreadPoolExecutor(max_workers=1, thread_name_prefix="browser")
+        self._downloads = ThreadPoolExecutor(max_workers=max(1, download_workers), thread_name_prefix="download")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs: Dict[int, Job] = {}
+        self._cores: Dict[str, XetCore] = {}
+        # (appid, work queue) of the bulk job holding the browser thread
+        self._bulk: Optional[Tuple[str, "queue.Queue[Tuple[Callable[[CaptureSession], Any], Future]]"]] = None
+
+    def core(self, appid: str) -> XetCore:
+        with self._lock:
+            if appid not in self._cores:
+                self._cores[appid] = XetCore(appid)
+            return self._cores[appid]
+
+    def snapshot(self) -> List[Job]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.id, reverse=True)
+
+    def get(self, job_id: Optional[int]) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id) if job_id is not None else None
+
+    def active(self, kind: str, label: str) -> Optional[Job]:
+        # A queued or running job of this kind and label, so the GUI does not submit the same listing twice
+        for job in self.snapshot():
+            if job.kind == kind and job.label == label and not job.finished:
+                return job
+        return None
+
+    def clear_finished(self) -> None:
+        with self._lock:
+            self._jobs = {k: j for k, j in self._jobs.items() if not j.finished}
+
+    def _submit(self, pool: ThreadPoolExecutor, kind: str, label: str, appid: str, fn: Callable[[Job], Any]) -> Job:
+        job = Job(next(self._ids), kind, label, appid)
+        with self._lock:
+            self._jobs[job.id] = job
+
+        def run() -> None:
+            job.state = "running"
+            job.started_at = time.time()
+            try:
+                job.result = fn(job)
+                job.state = "done"
+            except Exception as e:
+                job.message = str(e)
+                job.state = "failed"
+            finally:
+                job.current = None
+                job.finished_at = time.time()
+
+        pool.submit(run)
+        return job
+
+    def in_browser(self, appid: str, fn: Callable[[Optional[CaptureSession]], Any]) -> "Future[Any]":
+        # fn(session) on the browser thread; a running bulk job of the same shop runs it with its own browser
+        with self._lock:
+            if self._bulk is not None and self._bulk[0] == appid:
+                fut: "Future[Any]" = Future()
+                self._bulk[1].put((fn, fut))
+                return fut
+        return self._browser.submit(fn, None)
+
+    def bulk_running(self) -> Optional[str]:
+        # appid of the bulk job holding the browser thread
+        with self._lock:
+            return self._bulk[0] if self._bulk is not None else None
+
+    def submit_capture(self, appid: str, resource_url: str, resource_id: Optional[str] = None, wait_seconds: int = 180) -> Job:  # noqa: E501
+        core = self.core(appid)
+
+        def run(job: Job) -> str:
+            path = core.login_and_capture(resource_url, resource_id, wait_seconds)
+            job.message = path
+            return path
+
+        return self._submit(self._browser, "capture", f"抓取 {resource_id or resource_url}", appid, run)
+
+    def submit_download(self, appid: str, capture_file: str, title: Optional[str] = None) -> Job:
+        core = self.core(appid)
+
+        def run(job: Job) -> Optional[str]:
+            def recapture(path: str) -> str:
+                # An expired signed URL is captured again on the browser thread, never on this one
+                busy = self.bulk_running()
+                if busy is not None and busy != appid:
+                    # Another shop's bulk job keeps its own browser open; this waits until it is done
+                    job.message = f"签名过期，等待 {busy} 的批量任务结束后重新抓取"
+                fut = self.in_browser(appid, lambda session: core.recapture(path, session=session))
+                result = fut.result()
+                job.message = ""
+                return result
+
+            plan = core.plan_download(capture_file, title)
+            if plan is not None:
+                job.current = (plan[2], plan[0])
+            out = core.download_from_capture(capture_file, title, recapture=recapture)
+            if not out:
+                raise RuntimeError("没有可下载的直链，请检查抓取文件与登录状态")
+            job.current = None
+            job.bytes = os.path.getsize(out)
+            job.message = out
+            return out
+
+        return self._submit(self._downloads, "download", f"下载 {title or os.path.basename(capture_file)}", appid, run)
+
+    def submit_products(self, appid: str, entry_url: str) -> Job:
+        core = self.core(appid)
+
+        def run(job: Job) -> str:
+            job.total = job.done = len(core.capture_products(entry_url))
+            job.message = core.products_file()
+            return job.message
+
+        label = f"专栏列表 {appid}"
+        return self.active("listing", label) or self._submit(self._browser, "listing", label, appid, run)
+
+    def submit_resources(self, appid: str, product_url: str, product_id: Optional[str] = None) -> Job:
+        core = self.core(appid)
+        pid = core.product_id_from_url(product_url, product_id)
+
+        def run(job: Job) -> str:
+            job.total = job.done = len(core.capture_resources(product_url, pid))
+            job.message = core.resources_file(pid)
+            return job.message
+
+        label = f"资源列表 {pid or product_url}"
+        return self.active("listing", label) or self._submit(self._browser, "listing", label, appid, run)
+
+    def submit_bulk(
+        self,
+        appid: str,
+        product_id: Optional[str],
+        items: List[Tuple[int, str, str]],
+        wait_capture: int = 180,
+        tabs: int = 3,
+        download_workers: int = 2,
+    ) -> Job:
+        # (idx, rid, title) rows picked in the listing table; captures and downloads overlap as in the CLI batch
+        core = self.core(appid)
+
+        def run(job: Job) -> Dict[str, int]:
+            job.total = len(items)
+            todo = []
+            for idx, rid, title in items:
+                if existing_download(core.download_dir, title):
+                    job.count(done=1)
+                else:
+                    todo.append((idx, rid, title))
+            titles = {rid: title for _, rid, title in todo}
+
+            def progress(event: str, rid: str) -> None:
+                if event == "downloaded":
+                    found = existing_download(core.download_dir, titles.get(rid, rid))
+                    nbytes = os.path.getsize(os.path.join(core.download_dir, found)) if found else 0
+                    job.count(done=1, nbytes=nbytes)
+                elif event == "failed":
+                    job.count(failed=1)
+                job.message = f"{event}: {titles.get(rid, rid)}"
+
+            manifest = Manifest.for_shop(core.capture_dir) if product_id else None
+            work: "queue.Queue[Tuple[Callable[[CaptureSession], Any], Future]]" = queue.Queue()
+            with self._lock:
+                self._bulk = (appid, work)
+            try:
+                if manifest is not None:
+                    manifest.upsert_product(product_id)
+                    for idx, rid, title in todo:
+                        manifest.upsert_resources(product_id, [Entity(rid, title)], start=idx)
+                stats = run_batch(
+                    core,
+                    todo,
+                    product_id=product_id,
+                    wait_capture=wait_capture,
+                    tabs=tabs,
+                    download_workers=download_workers,
+                    manifest=manifest,
+                    progress=progress,
+                    browser_work=work,
+                )
+            finally:
+                with self._lock:
+                    self._bulk = None
+                # Work handed over after the batch loop stopped serving it; this thread is still the browser's
+                while True:
+                    try:
+                        fn, fut = work.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        fut.set_result(fn(None))
+                    except Exception as e:
+                        fut.set_exception(e)
+                if manifest is not None:
+                    manifest.close()
+            job.message = f"抓取 {stats['captured']}，下载 {stats['downloaded']}，失败 {stats['failed']}"
+            return stats
+
+        return self._submit(self._browser, "bulk", f"批量下载 {product_id or appid}（{len(items)} 个）", appid, run)
+
+    def shutdown(self) -> None:
+        self._browser.shutdown(wait=False, cancel_futures=True)
+        self._downloads.shutdown(wait=False, cancel_futures=True)
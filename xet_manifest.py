@@ -0,0 +1,129 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT PRIMARY KEY,
+    title TEXT,
+    listed_at INTEGER
+);
+CREATE TABLE IF NOT EXISTS resources (
+    product_id TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    title TEXT,
+    position INTEGER,
+    status TEXT NOT NULL DEFAULT 'new',
+    captured_at INTEGER,
+    capture_path TEXT,
+    url TEXT,
+    output_path TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    error TEXT,
+    updated_at INTEGER,
+    PRIMARY KEY (product_id, resource_id)
+);
+CREATE INDEX IF NOT EXISTS idx_resources_rid ON resources (resource_id);
+"""
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    # Per-shop record of what was listed, captured and downloaded (captured/{appid}/manifest.db)
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    @classmethod
+    def for_shop(cls, capture_dir: str) -> "Manifest":
+        return cls(os.path.join(capture_dir, "manifest.db"))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _write(self, sql: str, params: Iterable[Any] = ()) -> None:
+        with self._lock:
+            self._db.execute(sql, tuple(params))
+            self._db.commit()
+
+    def upsert_product(self, product_id: str, title: Optional[str] = None) -> None:
+        self._write(
+            "INSERT INTO products (product_id, title, listed_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(product_id) DO UPDATE SET title = COALESCE(excluded.title, title), listed_at = excluded.listed_at",  # noqa: E501
+            (product_id, title, int(time.time())),
+        )
+
+    def upsert_resources(self, product_id: str, items: Iterable[Any], start: int = 0) -> int:
+        # Adds newly listed resources and refreshes titles/positions (counted from start, for a listing
+        # that arrives piece by piece); download state is kept. Returns new rows.
+        now = int(time.time())
+        with self._lock:
+            before = self._db.execute("SELECT COUNT(*) FROM resources WHERE product_id = ?", (product_id,)).fetchone()[0]
+            self._db.executemany(
+                "INSERT INTO resources (product_id, resource_id, title, position, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(product_id, resource_id) DO UPDATE SET "
+                "title = COALESCE(excluded.title, title), position = excluded.position",
+                [(product_id, it.get("id"), it.get("title"), pos, now) for pos, it in enumerate(items, start) if it.get("id")],
+            )
+            self._db.commit()
+            after = self._db.execute("SELECT COUNT(*) FROM resources WHERE product_id = ?", (product_id,)).fetchone()[0]
+        return after - before
+
+    def record_capture(self, product_id: str, resource_id: str, capture_path: str, url: Optional[str]) -> None:
+        self._write(
+            "UPDATE resources SET status = CASE WHEN status = 'done' THEN status ELSE 'captured' END, "
+            "captured_at = ?, capture_path = ?, url = ?, error = NULL, updated_at = ? WHERE product_id = ? AND resource_id = ?",  # noqa: E501
+            (int(time.time()), capture_path, url, int(time.time()), product_id, resource_id),
+        )
+
+    def record_download(self, product_id: str, resource_id: str, output_path: str, sha256: Optional[str] = None) -> None:  # noqa: E501
+        size = os.path.getsize(output_path)
+        digest = sha256 or file_sha256(output_path)
+        self._write(
+            "UPDATE resources SET status = 'done', output_path = ?, size = ?, sha256 = ?, error = NULL, "
+            "updated_at = ? WHERE product_id = ? AND resource_id = ?",
+            (output_path, size, digest, int(time.time()), product_id, resource_id),
+        )
+
+    def record_failure(self, product_id: str, resource_id: str, error: str) -> None:
+        self._write(
+            "UPDATE resources SET status = 'failed', error = ?, updated_at = ? WHERE product_id = ? AND resource_id = ?",
+            (error[:500], int(time.time()), product_id, resource_id),
+        )
+
+    def resources(self, product_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM resources WHERE product_id = ? ORDER BY position", (product_id,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def pending(self, product_id: str) -> List[Dict[str, Any]]:
+        # The sync delta: never downloaded, failed, or whose file is gone or has the wrong size
+        out: List[Dict[str, Any]] = []
+        for row in self.resources(product_id):
+            path = row.get("output_path")
+            if row["status"] == "done" and path and os.path.exists(path) and os.path.getsize(path) == row.get("size"):
+                continue
+            out.append(row)
+        return out
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+
+# Off unless enable() is called; span() then costs one attribute check
+_out: Optional[TextIO] = None
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def enable(path: str) -> None:
+    # Append one JSON object per finished span to `path` (JSON lines)
+    global _out
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _lock:
+        if _out is not None:
+            _out.close()
+        _out = open(path, "a", encoding="utf-8", buffering=1)
+        _stats.clear()
+
+
+def disable() -> None:
+    global _out
+    with _lock:
+        if _out is not None:
+            _out.close()
+        _out = None
+
+
+def enabled() -> bool:
+    return _out is not None
+
+
+def record(name: str, seconds: float, **fields: Any) -> None:
+    if _out is None:
+        return
+    event = {"ts": round(time.time(), 3), "span": name, "ms": round(seconds * 1000, 2), "pid": os.getpid(), "thread": threading.current_thread().name}  # noqa: E501
+    event.update(fields)
+    nbytes = fields.get("bytes")
+    if nbytes and seconds > 0:
+        event["bytes_per_s"] = round(nbytes / seconds)
+    with _lock:
+        if _out is None:
+            return
+        _out.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+        st = _stats.setdefault(name, {"durations": [], "bytes": 0, "errors": 0})
+        st["durations"].append(seconds)
+        st["bytes"] += nbytes or 0
+        st["errors"] += 1 if fields.get("error") else 0
+
+
+@contextmanager
+def span(name: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+    # with span("download", url=u) as m: ...; m["bytes"] = n   -> one metrics line on exit
+    if _out is None:
+        yield fields
+        return
+    t0 = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields["error"] = type(e).__name__
+        raise
+    finally:
+        record(name, time.perf_counter() - t0, **fields)
+
+
+def _pct(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summary() -> str:
+    with _lock:
+        rows = [(name, sorted(st["durations"]), st["bytes"], st["errors"]) for name, st in sorted(_stats.items())]
+    lines = [f"{'span':<20}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'MB/s':>8}{'errors':>8}"]
+    for name, ds, nbytes, errors in rows:
+        total = sum(ds)
+        rate = f"{nbytes / total / 1e6:.2f}" if nbytes and total > 0 else "-"
+        lines.append(
+            f"{name:<20}{len(ds):>7}{total:>10.1f}{_pct(ds, 0.5) * 1000:>10.0f}"
+            f"{_pct(ds, 0.95) * 1000:>10.0f}{ds[-1] * 1000:>10.0f}{rate:>8}{errors:>8}"
+        )
+    return "\n".join(lines)
+
+
+def print_summary() -> None:
+    if _stats:
+        print(summary())
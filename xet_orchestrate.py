@@ -0,0 +1,312 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+from xet_batch import sync_product
+from xet_core import XetCore
+from xet_http import configure_limits, configure_session, parse_rate
+from xet_manifest import Manifest
+from xet_postprocess import from_flags
+from xet_store import ContentStore
+
+
+# Chromium lock files that must not be carried over into a cloned profile
+PROFILE_LOCKS = ("SingletonLock", "SingletonCookie", "SingletonSocket", "lockfile", "*.lock")
+
+
+def load_jobs(path: Optional[str], specs: List[str]) -> List[Tuple[str, str]]:
+    # Jobs come from a JSON file ([{"appid": ..., "product_ids": [...]}]), a text file with
+    # "appid p_xxx p_yyy" per line, and/or "appid:p_xxx,p_yyy" arguments; duplicates are dropped
+    pairs: List[Tuple[str, str]] = []
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        try:
+            for job in json.loads(text):
+                pairs.extend((job["appid"], pid) for pid in job.get("product_ids") or [])
+        except ValueError:
+            for line in text.splitlines():
+                fields = line.split("#", 1)[0].split()
+                if len(fields) >= 2:
+                    pairs.extend((fields[0], pid) for pid in fields[1:])
+    for spec in specs:
+        appid, _, pids = spec.partition(":")
+        pairs.extend((appid, pid) for pid in pids.split(",") if pid)
+    seen = set()
+    return [p for p in pairs if not (p in seen or seen.add(p))]
+
+
+def profile_for_slot(appid: str, slot: int) -> str:
+    base = os.path.join("playwright_data", appid)
+    return base if slot == 0 else f"{base}__w{slot}"
+
+
+def profile_logged_in_at(path: str) -> float:
+    # QR login time recorded in a profile's cookie snapshot (0 when it never logged in)
+    try:
+        with open(os.path.join(path, "cookies.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("logged_in_at") or 0
+    except Exception:
+        return 0
+
+
+def refresh_clone(appid: str, slot: int) -> None:
+    # Extra slots are copies of the logged-in base profile, so they skip the QR login. A clone whose login
+    # is older than the base profile's is copied again, so a new login of the base reaches every slot;
+    # a clone that logged in on its own since then is kept. The base profile must not be in use.
+    base = profile_for_slot(appid, 0)
+    path = profile_for_slot(appid, slot)
+    if slot == 0 or not os.path.isdir(base):
+        return
+    if os.path.exists(path):
+        if profile_logged_in_at(path) >= profile_logged_in_at(base):
+            return
+        print(f"Refreshing {path} from {base} (newer login)")
+        shutil.rmtree(path, ignore_errors=True)
+    shutil.copytree(base, path, ignore=shutil.ignore_patterns(*PROFILE_LOCKS), symlinks=True)
+
+
+def prepare_profiles(appid: str, slots: int) -> None:
+    for slot in range(1, slots):
+        refresh_clone(appid, slot)
+
+
+def run_job(appid: str, product_id: str, slot: int, opts: Dict[str, Any], events: Any, limits: Any = None) -> Dict[str, Any]:  # noqa: E501
+    # Runs in a pool process: one shop/column sync in its own browser profile. Worker output goes to
+    # a per-job log file; the parent only sees progress events and the returned stats. limits is the
+    # manager-held limiter state every worker shares, so the caps and back-off apply to the whole run.
+    def emit(event: str, rid: str = "") -> None:
+        try:
+            events.put((appid, product_id, event, rid))
+        except Exception:
+            pass
+
+    log_dir = opts["log_dir"]
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{appid}_{product_id}.log")
+    emit("started")
+    try:
+        with open(log_path, "a", encoding="utf-8", buffering=1) as log, \
+                contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            configure_session(pool_size=opts["pool_size"], retries=opts["retries"])
+            configure_limits(opts["max_bps"], opts["max_rps"], shared=limits)
+            core = XetCore(
+                appid,
+                max_tabs=opts["tabs"],
+                connections=opts["connections"],
+                block_assets=opts["block_assets"],
+                profile_dir=profile_for_slot(appid, slot),
+            )
+            core.postprocessor = from_flags(opts["remux"], opts["audio_only"], opts["post_workers"])
+            if opts["dedup"]:
+                # One store for every shop and worker: the same lesson sold by two shops is fetched once
+                core.store = ContentStore.for_download_dir(core.download_dir)
+            manifest = Manifest(opts["manifest"]) if opts["manifest"] else Manifest.for_shop(core.capture_dir)
+            try:
+                stats = sync_product(
+                    core,
+                    product_id,
+                    manifest,
+                    wait_list=opts["wait_list"],
+                    idle_list=opts["idle_list"],
+                    use_api=opts["use_api"],
+                    headless=opts["headless"],
+                    wait_capture=opts["wait_capture"],
+                    tabs=opts["tabs"],
+                    download_workers=opts["download_workers"],
+                    queue_size=opts["queue_size"],
+                    sleep_min=opts["sleep_min"],
+                    sleep_max=opts["sleep_max"],
+                    reuse_captures=opts["reuse_captures"],
+                    progress=emit,
+                )
+            finally:
+                manifest.close()
+        emit("finished")
+        return {"appid": appid, "product_id": product_id, "stats": stats, "log": log_path}
+    except Exception as e:
+        emit("error")
+        return {"appid": appid, "product_id": product_id, "error": str(e), "log": log_path}
+
+
+class Progress:
+    # Combined view of every worker, fed from the shared event queue
+    def __init__(self, jobs: List[Tuple[str, str]]) -> None:
+        self.total = len(jobs)
+        self.shop_jobs: Dict[str, int] = defaultdict(int)
+        for appid, _ in jobs:
+            self.shop_jobs[appid] += 1
+        self.counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.started = time.time()
+
+    def feed(self, appid: str, event: str) -> None:
+        self.counts[appid][event] += 1
+
+    def line(self) -> str:
+        agg: Dict[str, int] = defaultdict(int)
+        for c in self.counts.values():
+            for k, v in c.items():
+                agg[k] += v
+        done = agg["finished"] + agg["error"]
+        running = agg["started"] - done
+        shops = " ".join(
+            f"{appid}={self.counts[appid]['finished'] + self.counts[appid]['error']}/{n}"
+            for appid, n in sorted(self.shop_jobs.items())
+        )
+        return (
+            f"[{time.time() - self.started:7.0f}s] jobs {done}/{self.total} done, {running} running | "
+            f"captured {agg['captured']} downloaded {agg['downloaded']} failed {agg['failed']} | {shops}"
+        )
+
+
+def orchestrate(
+    jobs: List[Tuple[str, str]],
+    opts: Dict[str, Any],
+    workers: int,
+    per_shop: int,
+    report_every: float = 10.0,
+) -> List[Dict[str, Any]]:
+    # The parent schedules (appid, product_id) jobs onto a process pool: at most `workers` jobs overall
+    # and `per_shop` per shop, each running job holding one profile slot of its shop
+    shops = sorted({appid for appid, _ in jobs})
+    workers = max(1, workers)
+    per_shop = max(1, per_shop)
+    for appid in shops:
+        prepare_profiles(appid, per_shop)
+    free_slots: Dict[str, List[int]] = {appid: list(range(per_shop)) for appid in shops}
+    pending = list(jobs)
+    running: Dict[Future, Tuple[str, int]] = {}
+    results: List[Dict[str, Any]] = []
+    progress = Progress(jobs)
+    last_report = 0.0
+
+    # spawn: Playwright and the HTTP pools do not survive fork()
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Manager() as manager, ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        events = manager.Queue()
+        limits = (manager.dict(), manager.Lock())
+        while pending or running:
+            for job in list(pending):
+                if len(running) >= workers:
+                    break
+                appid, product_id = job
+                if not free_slots[appid]:
+                    continue
+                slot = free_slots[appid].pop(0)
+                if 0 in free_slots[appid]:
+                    # The base profile is idle, so a login it gained since the start can be copied over
+                    refresh_clone(appid, slot)
+                pending.remove(job)
+                running[ex.submit(run_job, appid, product_id, slot, opts, events, limits)] = (appid, slot)
+
+            finished, _ = wait(list(running), timeout=1.0, return_when=FIRST_COMPLETED)
+            while not events.empty():
+                appid, _, event, _ = events.get()
+                progress.feed(appid, event)
+            for fut in finished:
+                appid, slot = running.pop(fut)
+                free_slots[appid].append(slot)
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    # The worker process itself died (crash, OOM); its job is reported as failed
+                    res = {"appid": appid, "product_id": "?", "error": str(e)}
+                    progress.feed(appid, "error")
+                results.append(res)
+                if "error" in res:
+                    reason = (res["error"].strip().splitlines() or [""])[0]
+                    print(f"{res['appid']}/{res['product_id']}: error: {reason} (log: {res.get('log')})")
+                else:
+                    print(f"{res['appid']}/{res['product_id']}: {res['stats']}")
+            if finished or time.time() - last_report >= report_every:
+                print(progress.line())
+                last_report = time.time()
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Sync many shops/columns in parallel worker processes")
+    parser.add_argument("jobs", nargs="*", help="appid:p_xxx,p_yyy (repeatable)")
+    parser.add_argument("--jobs-file", type=str, default=None, help="JSON or 'appid p_xxx p_yyy' lines")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Jobs running at once across all shops")  # noqa: E501
+    parser.add_argument("--per-shop", type=int, default=1, help="Jobs running at once per shop (one browser profile each)")  # noqa: E501
+    parser.add_argument("--manifest", type=str, default=None, help="One manifest for all shops (default: per shop)")
+    parser.add_argument("--log-dir", type=str, default=os.path.join("captured", "logs"), help="Per-job worker logs")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument("--wait-list", type=int, default=120, help="Seconds to wait for listing resources")
+    parser.add_argument("--idle-list", type=float, default=5.0, help="Stop listing after this many quiet seconds")
+    parser.add_argument("--wait-capture", type=int, default=180, help="Seconds to wait for each capture")
+    parser.add_argument("--headless", action="store_true", help="Always run worker browsers headless (needs valid logins)")
+    parser.add_argument("--headed", action="store_true", help="Always show worker browsers (default: headless while the login is valid)")  # noqa: E501
+    parser.add_argument("--no-api", action="store_true", help="List through the browser instead of replaying the API")
+    parser.add_argument("--block-assets", action="store_true", help="Skip images/fonts/css/trackers/media bodies while capturing")  # noqa: E501
+    parser.add_argument("--fresh-captures", action="store_true", help="Capture every item even if a stored capture is still valid")  # noqa: E501
+    parser.add_argument("--tabs", type=int, default=3, help="Max resource pages captured concurrently per job")
+    parser.add_argument("--connections", type=int, default=4, help="Parallel range connections per file")
+    parser.add_argument("--pool-size", type=int, default=32, help="HTTP keep-alive connections kept per host")
+    parser.add_argument("--dedup", action="store_true", help="Keep downloads in a content-addressed store (download/.store) and link duplicates")  # noqa: E501
+    parser.add_argument("--remux", action="store_true", help="Pipe HLS video into ffmpeg and save mp4 instead of .ts")
+    parser.add_argument("--audio-only", action="store_true", help="Pipe HLS video into ffmpeg and keep only the audio (m4a)")  # noqa: E501
+    parser.add_argument("--post-workers", type=int, default=1, help="ffmpeg processes running at once per worker")
+    parser.add_argument("--max-bps", type=str, default=None, help="Per-host bandwidth cap for the whole run, e.g. 20M")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="Per-host requests per second cap for the whole run")
+    parser.add_argument("--retries", type=int, default=5, help="Retries for 5xx/429/connection errors")
+    parser.add_argument("--sleep-min", type=float, default=2.0, help="Min seconds to sleep between steps of each stage")
+    parser.add_argument("--sleep-max", type=float, default=7.0, help="Max seconds to sleep between steps of each stage")
+    parser.add_argument("--download-workers", type=int, default=2, help="Downloads running alongside capturing per job")
+    parser.add_argument("--queue-size", type=int, default=4, help="Max finished captures waiting for a download worker")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    jobs = load_jobs(args.jobs_file, args.jobs)
+    if not jobs:
+        raise SystemExit("No jobs given")
+    if args.workers < 1 or args.per_shop < 1:
+        raise SystemExit("--workers and --per-shop must be at least 1")
+    opts = {
+        "log_dir": args.log_dir,
+        "manifest": args.manifest,
+        "wait_list": args.wait_list,
+        "idle_list": args.idle_list,
+        "wait_capture": args.wait_capture,
+        "headless": True if args.headless else (False if args.headed else None),
+        "use_api": not args.no_api,
+        "block_assets": args.block_assets,
+        "reuse_captures": not args.fresh_captures,
+        "tabs": args.tabs,
+        "connections": args.connections,
+        "pool_size": args.pool_size,
+        "retries": args.retries,
+        "remux": args.remux,
+        "dedup": args.dedup,
+        "audio_only": args.audio_only,
+        "post_workers": args.post_workers,
+        # Run-wide caps: every worker draws from the same per-host buckets (see orchestrate)
+        "max_bps": parse_rate(args.max_bps),
+        "max_rps": args.max_rps,
+        "sleep_min": args.sleep_min,
+        "sleep_max": args.sleep_max,
+        "download_workers": args.download_workers,
+        "queue_size": args.queue_size,
+    }
+    print(f"{len(jobs)} jobs over {len({a for a, _ in jobs})} shops, {args.workers} workers, {args.per_shop} per shop")
+    results = orchestrate(jobs, opts, args.workers, args.per_shop, args.report_every)
+    failed = [r for r in results if "error" in r]
+    totals: Dict[str, int] = defaultdict(int)
+    for r in results:
+        for k, v in (r.get("stats") or {}).items():
+            totals[k] += v
+    print(f"Finished: {len(results) - len(failed)} ok, {len(failed)} failed | " + " ".join(f"{k} {v}" for k, v in sorted(totals.items())))  # noqa: E501
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+import xet_metrics as metrics
+from xet_http import CHUNK_SIZE
+
+
+# remux: MPEG-TS -> mp4 with the original streams; audio: keep only the audio track as m4a
+MODES = ("remux", "audio")
+TARGET_EXT = {"remux": "mp4", "audio": "m4a"}
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def target_path(outfile: str, mode: str) -> str:
+    return os.path.splitext(outfile)[0] + "." + TARGET_EXT[mode]
+
+
+def ffmpeg_command(mode: str, dest: str, threads: int = 1, input_format: str = "mpegts") -> List[str]:
+    # Input arrives on stdin (MPEG-TS, or fMP4 for HLS with EXT-X-MAP); streams are copied, never re-encoded
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-threads", str(threads), "-f", input_format, "-i", "pipe:0"]  # noqa: E501
+    if mode == "audio":
+        cmd += ["-map", "0:a:0", "-vn"]
+    else:
+        # Only audio/video: timed-ID3 and other data tracks in the TS would make the mp4 muxer fail
+        cmd += ["-map", "0:v?", "-map", "0:a?"]
+    cmd += ["-c", "copy", "-bsf:a", "aac_adtstoasc", "-movflags", "+faststart", "-f", "mp4", dest]
+    return cmd
+
+
+def _lower_priority() -> None:
+    try:
+        os.nice(10)
+    except Exception:
+        pass
+
+
+class FfmpegSink:
+    # File-like writer feeding ffmpeg's stdin: HLS segments go straight into the container, no .ts on disk
+    #   with processor.sink(outfile) as sink: sink.write(segment_bytes)
+
+    def __init__(self, processor: "PostProcessor", outfile: str, input_format: str = "mpegts") -> None:
+        self.processor = processor
+        self.input_format = input_format
+        self.dest = target_path(outfile, processor.mode)
+        self.tmp = self.dest + ".tmp"
+        self._proc: Optional[subprocess.Popen] = None
+        self._stderr = b""
+        self._reader: Optional[threading.Thread] = None
+        self.bytes = 0
+
+    def __enter__(self) -> "FfmpegSink":
+        # Blocks while all ffmpeg slots are busy; that backpressure is what bounds CPU use
+        self.processor._slots.acquire()
+        try:
+            self._proc = subprocess.Popen(
+                ffmpeg_command(self.processor.mode, self.tmp, self.processor.threads, self.input_format),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                preexec_fn=_lower_priority if os.name == "posix" else None,
+            )
+        except Exception:
+            self.processor._slots.release()
+            raise
+        # Drain stderr on the side so a chatty ffmpeg can never block on a full pipe
+        self._reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._reader.start()
+        return self
+
+    def _read_stderr(self) -> None:
+        try:
+            self._stderr = self._proc.stderr.read()  # type: ignore[union-attr]
+        except Exception:
+            pass
+
+    def write(self, data: bytes) -> int:
+        try:
+            self._proc.stdin.write(data)  # type: ignore[union-attr]
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg exited early: {self._error()}")
+        self.bytes += len(data)
+        return len(data)
+
+    def _error(self) -> str:
+        if self._reader is not None:
+            self._reader.join(timeout=5)
+        return self._stderr.decode("utf-8", errors="replace").strip()[-500:]
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            try:
+                self._proc.stdin.close()  # type: ignore[union-attr]
+            except Exception:
+                pass
+            if exc_type is not None:
+                self._proc.kill()  # type: ignore[union-attr]
+                self._proc.wait()  # type: ignore[union-attr]
+                try:
+                    os.remove(self.tmp)
+                except FileNotFoundError:
+                    pass
+                return
+            code = self._proc.wait()  # type: ignore[union-attr]
+            if code != 0:
+                try:
+                    os.remove(self.tmp)
+                except FileNotFoundError:
+                    pass
+                raise RuntimeError(f"ffmpeg failed ({code}) for {self.dest}: {self._error()}")
+            os.replace(self.tmp, self.dest)
+        finally:
+            self.processor._slots.release()
+
+
+class PostProcessor:
+    # Bounded ffmpeg stage: at most `workers` ffmpeg processes at once (niced, single-threaded),
+    # fed either live from the HLS downloader (sink) or from finished .ts files (submit/process_file)
+
+    def __init__(self, mode: str = "remux", workers: int = 1, threads: int = 1, keep_source: bool = False) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown post-processing mode: {mode}")
+        if not ffmpeg_available():
+            raise RuntimeError("ffmpeg not found on PATH; install it or drop --remux/--audio-only")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.threads = max(1, threads)
+        self.keep_source = keep_source
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def sink(self, outfile: str, input_format: str = "mpegts") -> FfmpegSink:
+        return FfmpegSink(self, outfile, input_format)
+
+    def process_file(self, path: str) -> str:
+        # Pipe an already downloaded MPEG-TS file through ffmpeg; the source goes once the output is in place
+        with metrics.span("postprocess", file=os.path.basename(path), mode=self.mode) as m:
+            with self.sink(path) as sink, open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE * 16), b""):
+                    sink.write(chunk)
+            m["bytes"] = sink.bytes
+        if not self.keep_source and os.path.abspath(path) != os.path.abspath(sink.dest):
+            os.remove(path)
+        return sink.dest
+
+    def submit(self, path: str) -> "Future[str]":
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ffmpeg")
+        return self._pool.submit(self.process_file, path)
+
+    def close(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+
+def from_flags(remux: bool, audio_only: bool, workers: int = 1) -> Optional[PostProcessor]:
+    # --audio-only wins over --remux; neither means HLS is saved as .ts as before
+    if audio_only:
+        return PostProcessor("audio", workers=workers)
+    if remux:
+        return PostProcessor("remux", workers=workers)
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Remux downloaded .ts files to mp4, or extract their audio to m4a")
+    parser.add_argument("files", nargs="+", help="MPEG-TS files, e.g. download/*.ts")
+    parser.add_argument("--audio-only", action="store_true", help="Keep only the audio track (m4a)")
+    parser.add_argument("--workers", type=int, default=1, help="ffmpeg processes at once")
+    parser.add_argument("--keep-source", action="store_true", help="Keep the .ts after a successful conversion")
+    args = parser.parse_args()
+    pp = PostProcessor("audio" if args.audio_only else "remux", workers=args.workers, keep_source=args.keep_source)
+    futures = [(path, pp.submit(path)) for path in args.files]
+    for path, fut in futures:
+        try:
+            print(f"{path} -> {fut.result()}")
+        except Exception as e:
+            print(f"{path}: failed - {e}")
+    pp.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import errno
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from xet_http import url_key
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    created_at INTEGER
+);
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+"""
+
+# ioctl that clones file extents copy-on-write (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def url_store_key(url: str) -> str:
+    # Signed query strings change per capture; the CDN path names the file
+    return "url:" + url_key(url)
+
+
+def etag_store_key(url: str, etag: Optional[str], size: Optional[int]) -> Optional[str]:
+    if not etag or etag.startswith("W/"):
+        return None
+    host = url.split("/")[2] if "://" in url else ""
+    return f"etag:{host}:{etag}:{size}"
+
+
+def _reflink(src: str, dst: str) -> None:
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+class ContentStore:
+    # Content-addressed copies under download/.store/objects/<sha[:2]>/<sha><ext>; the per-column files in
+    # download/ are hardlinks (or reflinks, or as a last resort copies) of them. index.db maps URL paths and
+    # ETags to hashes, so a lesson already downloaded through another column is linked instead of fetched.
+
+    def __init__(self, root: str, link_mode: str = "hardlink") -> None:
+        self.root = root
+        self.link_mode = link_mode
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.db"), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    @classmethod
+    def for_download_dir(cls, download_dir: str, link_mode: str = "hardlink") -> "ContentStore":
+        return cls(os.path.join(download_dir, ".store"), link_mode)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _object(self, sha256: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT path FROM objects WHERE sha256 = ?", (sha256,)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def lookup(self, key: Optional[str]) -> Optional[str]:
+        # Hash of a known key whose object is still on disk
+        if not key:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT sha256 FROM keys WHERE key = ?", (key,)).fetchone()
+        return row[0] if row and self._object(row[0]) else None
+
+    def digest_of(self, path: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT sha256 FROM links WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return row[0] if row else None
+
+    def _link(self, src: str, dst: str) -> None:
+        tmp = dst + ".link"
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        modes = ["hardlink", "reflink", "copy"] if self.link_mode == "hardlink" else ["reflink", "hardlink", "copy"]
+        for mode in modes:
+            try:
+                if mode == "hardlink":
+                    os.link(src, tmp)
+                elif mode == "reflink":
+                    _reflink(src, tmp)
+                else:
+                    shutil.copyfile(src, tmp)
+                break
+            except OSError:
+                try:
+                    os.remove(tmp)
+                except FileNotFoundError:
+                    pass
+        os.replace(tmp, dst)
+
+    def materialize(self, sha256: str, dst: str, keys: Iterable[Optional[str]] = ()) -> bool:
+        # Put the stored object at dst; False when the object is gone
+        obj = self._object(sha256)
+        if obj is None:
+            return False
+        self._link(obj, dst)
+        self._remember(dst, sha256, keys)
+        return True
+
+    def _remember(self, path: str, sha256: str, keys: Iterable[Optional[str]]) -> None:
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO keys (key, sha256) VALUES (?, ?)", [(k, sha256) for k in keys if k]
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO links (path, sha256) VALUES (?, ?)", (os.path.abspath(path), sha256)
+            )
+            self._db.commit()
+
+    def add(self, path: str, sha256: str, keys: Iterable[Optional[str]] = ()) -> str:
+        # Adopt a freshly downloaded file: the first copy of some content moves into the store, later
+        # copies are dropped in favour of a link to it. Returns path, now backed by the store.
+        obj = self._object(sha256)
+        if obj is None:
+            ext = os.path.splitext(path)[1]
+            obj = os.path.join(self.root, "objects", sha256[:2], sha256 + ext)
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            os.replace(path, obj)
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO objects (sha256, size, path, created_at) VALUES (?, ?, ?, ?)",
+                    (sha256, os.path.getsize(obj), obj, int(time.time())),
+                )
+                self._db.commit()
+        self._link(obj, path)
+        self._remember(path, sha256, keys)
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            objects, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+            links = self._db.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+        return {"objects": objects, "bytes": size, "links": links}